@@ -1,4 +1,32 @@
 from django.contrib import admin
-from .models import Auto
+from .models import Auto, ColaDireccion
 
-admin.site.register(Auto)
+
+@admin.register(Auto)
+class AutoAdmin(admin.ModelAdmin):
+    # Los autos se registran por la API, que reserva el turno en ColaDireccion.
+    # Borrarlos aquí sí mantiene el resumen (señal post_delete). No se editan:
+    # la versión de las vistas de estado solo cambia con altas y bajas
+    list_display = ('id', 'direccion', 'turno', 'velocidad', 'tiempo_cruce', 'timestamp')
+    list_filter = ('direccion',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(ColaDireccion)
+class ColaDireccionAdmin(admin.ModelAdmin):
+    # Contadores derivados de la tabla Auto: solo lectura
+    list_display = ('direccion', 'cantidad', 'tiempo_total', 'cabeza', 'ultimo_turno')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,343 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .motor import MotorPuente
+from .puentes import PUENTE_POR_DEFECTO
+
+logger = logging.getLogger(__name__)
+
+# Comandos del motor que no cambian el estado
+COMANDOS_LECTURA = {'estado', 'estado_json', 'estado_versionado', 'obtener_version', 'metricas', 'resumen',
+                    'estado_filtrado'}
+
+
+def _ruta_puente(ruta, puente):
+    """Archivo propio de cada puente: el principal usa `ruta` y el resto <nombre>.<puente><extensión>."""
+    ruta = Path(ruta)
+    if puente == PUENTE_POR_DEFECTO:
+        return ruta
+    return ruta.with_name(f'{ruta.stem}.{puente}{ruta.suffix}')
+
+
+class EstadoMemoria:
+    """Estado del puente en la memoria del proceso. Sirve para un solo worker."""
+
+    compartido = False
+
+    def __init__(self, puente=PUENTE_POR_DEFECTO):
+        self.motor = MotorPuente()
+
+    async def ejecutar(self, comando, args):
+        return getattr(self.motor, comando)(*args)
+
+
+class EstadoSQLite:
+    """Estado compartido entre procesos mediante un log de comandos en SQLite (WAL).
+
+    Cada worker mantiene su propia réplica del motor. Un comando se ejecuta
+    dentro de una transacción: primero se aplican los comandos que otros
+    workers agregaron al log, luego el propio, y si cambió el estado se
+    agrega al log antes del COMMIT. Todos los workers aplican los mismos
+    comandos en el mismo orden, así que generan los mismos deltas con el
+    mismo seq; cada uno los difunde a sus propios sockets.
+
+    La transacción empieza como lectura y solo toma el lock de escritura al
+    agregar un comando que produjo deltas: un solicitar_cruce sin permiso no
+    bloquea a los demás workers. Si otro worker escribió en el medio, la
+    réplica ya aplicó el comando fuera de orden; se reconstruye y el comando
+    se repite con BEGIN IMMEDIATE.
+
+    Cada `instantanea_cada` comandos el worker que escribe guarda el estado
+    completo en la tabla instantanea y borra del log lo anterior a la
+    instantánea previa. Un worker nuevo, o uno que se quedó atrás de lo
+    borrado, parte de la instantánea y reaplica solo lo posterior; sus
+    clientes ven un hueco en el seq y se resincronizan.
+    """
+
+    compartido = True
+    COMANDOS_LECTURA = COMANDOS_LECTURA
+
+    def __init__(self, ruta, intervalo_sincronizacion=0.1, timeout=30, instantanea_cada=10000,
+                 puente=PUENTE_POR_DEFECTO):
+        self.ruta = str(_ruta_puente(ruta, puente))
+        self.intervalo_sincronizacion = intervalo_sincronizacion
+        self.timeout = timeout
+        self.instantanea_cada = instantanea_cada
+        self.motor = MotorPuente()
+        self._aplicado = 0  # último seq del log aplicado a la réplica
+        self._entregado = 0  # último seq cuyos deltas ya se entregaron
+        self._remotos = []  # deltas de otros workers aún no entregados
+        self._conexion = None
+        # Un solo hilo: la E/S de SQLite no bloquea el event loop y la réplica
+        # solo se modifica desde ese hilo
+        self._ejecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='puente-estado')
+
+    def _conectar(self):
+        if self._conexion is None:
+            conexion = sqlite3.connect(self.ruta, timeout=self.timeout,
+                                       isolation_level=None, check_same_thread=False)
+            conexion.execute('PRAGMA journal_mode=WAL')
+            conexion.execute('PRAGMA synchronous=NORMAL')
+            conexion.execute(
+                'CREATE TABLE IF NOT EXISTS comandos ('
+                'seq INTEGER PRIMARY KEY AUTOINCREMENT, comando TEXT NOT NULL, args TEXT NOT NULL)'
+            )
+            conexion.execute(
+                'CREATE TABLE IF NOT EXISTS instantanea ('
+                'id INTEGER PRIMARY KEY CHECK (id = 1), seq INTEGER NOT NULL, motor TEXT NOT NULL)'
+            )
+            self._conexion = conexion
+        return self._conexion
+
+    def _reconstruir(self):
+        # Tras un error de la base la réplica puede haber divergido: se
+        # descarta y se vuelve a construir desde el log en el próximo comando.
+        # Los deltas que ya se entregaron no se vuelven a difundir
+        self.motor = MotorPuente()
+        self._aplicado = 0
+        self._remotos = []
+
+    def _restaurar_instantanea(self, conexion):
+        fila = conexion.execute('SELECT seq, motor FROM instantanea').fetchone()
+        if fila is None or fila[0] <= self._aplicado:
+            return
+        if self._aplicado and conexion.execute(
+                'SELECT 1 FROM comandos WHERE seq = ?', (self._aplicado + 1,)).fetchone():
+            return  # lo que falta sigue en el log: reaplicarlo da los deltas a los clientes
+        self.motor.restaurar(json.loads(fila[1]))
+        self._aplicado = fila[0]
+
+    def _ponerse_al_dia(self, conexion):
+        self._restaurar_instantanea(conexion)
+        filas = conexion.execute(
+            'SELECT seq, comando, args FROM comandos WHERE seq > ? ORDER BY seq', (self._aplicado,)
+        )
+        for seq, comando, args in filas:
+            deltas = getattr(self.motor, comando)(*json.loads(args))[1]
+            if seq > self._entregado:
+                self._remotos.extend(deltas)
+            self._aplicado = seq
+
+    def _tomar_remotos(self):
+        remotos, self._remotos = self._remotos, []
+        self._entregado = max(self._entregado, self._aplicado)
+        return remotos
+
+    def _guardar_instantanea(self, conexion):
+        # Se borra hasta la instantánea anterior, no hasta esta: un worker
+        # que va hasta instantanea_cada comandos atrás todavía los reaplica
+        anterior = conexion.execute('SELECT seq FROM instantanea').fetchone()
+        conexion.execute('INSERT OR REPLACE INTO instantanea (id, seq, motor) VALUES (1, ?, ?)',
+                         (self._aplicado, json.dumps(self.motor.instantanea())))
+        if anterior is not None:
+            conexion.execute('DELETE FROM comandos WHERE seq <= ?', anterior)
+
+    def _transaccion(self, conexion, comando, args, inmediata):
+        lectura = comando in self.COMANDOS_LECTURA
+        conexion.execute('BEGIN IMMEDIATE' if inmediata else 'BEGIN')
+        try:
+            self._ponerse_al_dia(conexion)
+            respuesta, deltas = getattr(self.motor, comando)(*args)
+            if deltas and not lectura:
+                # Aquí la transacción pasa a ser de escritura
+                cursor = conexion.execute(
+                    'INSERT INTO comandos (comando, args) VALUES (?, ?)', (comando, json.dumps(args))
+                )
+                self._aplicado = cursor.lastrowid
+                if self._aplicado % self.instantanea_cada == 0:
+                    self._guardar_instantanea(conexion)
+        except BaseException:
+            conexion.execute('ROLLBACK')
+            raise
+        conexion.execute('COMMIT')
+        return respuesta, deltas
+
+    def _ejecutar(self, comando, args):
+        conexion = self._conectar()
+        try:
+            try:
+                respuesta, deltas = self._transaccion(conexion, comando, args, inmediata=False)
+            except sqlite3.OperationalError:
+                if comando in self.COMANDOS_LECTURA:
+                    raise
+                # Otro worker escribió entre la lectura y el INSERT (SQLITE_BUSY):
+                # la réplica ya aplicó el comando sobre un estado viejo
+                self._reconstruir()
+                respuesta, deltas = self._transaccion(conexion, comando, args, inmediata=True)
+        except sqlite3.Error:
+            self._reconstruir()
+            raise
+        return respuesta, self._tomar_remotos() + deltas
+
+    def _sincronizar(self):
+        conexion = self._conectar()
+        try:
+            conexion.execute('BEGIN')
+            try:
+                self._ponerse_al_dia(conexion)
+            finally:
+                conexion.execute('COMMIT')
+        except sqlite3.Error:
+            self._reconstruir()
+            raise
+        return self._tomar_remotos()
+
+    async def ejecutar(self, comando, args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._ejecutor, self._ejecutar, comando, args)
+
+    async def sincronizar(self):
+        """Aplicar los comandos de otros workers y devolver sus deltas."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._ejecutor, self._sincronizar)
+
+
+class EstadoPersistente:
+    """Estado en la memoria del proceso que sobrevive a un reinicio. Sirve para un solo worker.
+
+    Los comandos se ejecutan en el event loop como con EstadoMemoria. Los que
+    cambian el estado se agregan a un buffer, y un hilo los escribe en lotes
+    al final de comandos.log, con un fsync por lote, cada
+    `intervalo_escritura` segundos. La respuesta no espera al disco: tras
+    una caída se pierden como mucho los comandos de ese último intervalo.
+    Cada `instantanea_cada` comandos se guarda el estado completo en
+    instantanea.json y se vacía el log, así que al arrancar solo se
+    reaplican los comandos posteriores a la última instantánea.
+    """
+
+    compartido = False
+
+    def __init__(self, directorio, intervalo_escritura=0.05, instantanea_cada=10000,
+                 puente=PUENTE_POR_DEFECTO):
+        self.directorio = Path(directorio)
+        self.ruta_log = _ruta_puente(self.directorio / 'comandos.log', puente)
+        self.ruta_instantanea = _ruta_puente(self.directorio / 'instantanea.json', puente)
+        self.intervalo_escritura = intervalo_escritura
+        self.instantanea_cada = instantanea_cada
+        self.motor = MotorPuente()
+        self.seq = 0  # último comando aplicado
+        self._desde_instantanea = 0  # comandos en el log desde la última instantánea
+        self._buffer = []  # líneas del log aún no entregadas al hilo escritor
+        self._escritura = None  # tarea que entregará el buffer
+        self._recuperado = False
+        self._log = None  # solo se usa desde el hilo escritor
+        self._ejecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='puente-log')
+
+    def _recuperar(self):
+        inicio = time.perf_counter()
+        self.directorio.mkdir(parents=True, exist_ok=True)
+        if self.ruta_instantanea.exists():
+            datos = json.loads(self.ruta_instantanea.read_bytes())
+            self.motor.restaurar(datos['motor'])
+            self.seq = datos['seq']
+        seq_instantanea = self.seq
+
+        valido = 0  # bytes del log hasta la última línea completa
+        if self.ruta_log.exists():
+            # Reaplicar sin registrar cada comando: ya se registró la primera vez.
+            # Solo este motor: los demás puentes siguen registrando
+            self.motor.registrar = False
+            try:
+                with open(self.ruta_log, 'rb') as archivo:
+                    for linea in archivo:
+                        if not linea.endswith(b'\n'):
+                            break  # escrita a medias durante una caída
+                        try:
+                            seq, comando, args = json.loads(linea)
+                        except ValueError:
+                            break
+                        valido += len(linea)
+                        if seq <= self.seq:
+                            continue  # ya incluido en la instantánea
+                        getattr(self.motor, comando)(*args)
+                        self.seq = seq
+                        self._desde_instantanea += 1
+            finally:
+                self.motor.registrar = True
+
+        self._log = open(self.ruta_log, 'ab')
+        self._log.truncate(valido)
+        logger.info("Estado del puente recuperado: instantánea hasta el comando %d y %d comandos del log en %.3f s",
+                    seq_instantanea, self._desde_instantanea, time.perf_counter() - inicio)
+
+    def _escribir(self, lineas):
+        self._log.write(b''.join(lineas))
+        self._log.flush()
+        os.fsync(self._log.fileno())
+
+    def _guardar_instantanea(self, lineas, datos):
+        # Primero lo pendiente del log: si la instantánea no llega al disco,
+        # el estado se sigue pudiendo reconstruir con la anterior y el log
+        self._escribir(lineas)
+        temporal = self.ruta_instantanea.with_suffix('.tmp')
+        with open(temporal, 'wb') as archivo:
+            archivo.write(json.dumps(datos).encode('utf-8'))
+            archivo.flush()
+            os.fsync(archivo.fileno())
+        os.replace(temporal, self.ruta_instantanea)
+        if os.name == 'posix':
+            # El rename es durable recién cuando se sincroniza el directorio
+            descriptor = os.open(self.directorio, os.O_RDONLY)
+            try:
+                os.fsync(descriptor)
+            finally:
+                os.close(descriptor)
+        self._log.truncate(0)
+        os.fsync(self._log.fileno())
+
+    def _al_terminar(self, futuro):
+        if not futuro.cancelled() and futuro.exception() is not None:
+            logger.error("Error al escribir el log del puente", exc_info=futuro.exception())
+
+    def _entregar(self, funcion, *args):
+        # Un solo hilo escritor: los lotes y las instantáneas llegan al disco
+        # en el orden en que se entregan
+        futuro = asyncio.get_running_loop().run_in_executor(self._ejecutor, funcion, *args)
+        futuro.add_done_callback(self._al_terminar)
+        return futuro
+
+    async def _escribir_despues(self):
+        await asyncio.sleep(self.intervalo_escritura)
+        self._escritura = None
+        await self.vaciar()
+
+    async def vaciar(self):
+        """Escribir ya lo pendiente y esperar su fsync."""
+        lineas, self._buffer = self._buffer, []
+        await self._entregar(self._escribir, lineas)
+
+    async def ejecutar(self, comando, args):
+        if not self._recuperado:
+            await asyncio.get_running_loop().run_in_executor(self._ejecutor, self._recuperar)
+            self._recuperado = True
+
+        respuesta, deltas = getattr(self.motor, comando)(*args)
+        if deltas and comando not in COMANDOS_LECTURA:
+            self.seq += 1
+            self._buffer.append(json.dumps([self.seq, comando, list(args)]).encode('utf-8') + b'\n')
+            self._desde_instantanea += 1
+            if self._desde_instantanea >= self.instantanea_cada:
+                # El estado se copia aquí; codificarlo y escribirlo queda para el hilo
+                lineas, self._buffer = self._buffer, []
+                self._entregar(self._guardar_instantanea, lineas,
+                               {'seq': self.seq, 'motor': self.motor.instantanea()})
+                self._desde_instantanea = 0
+            elif self._escritura is None:
+                self._escritura = asyncio.ensure_future(self._escribir_despues())
+        return respuesta, deltas
+
+
+def crear_backend(puente=PUENTE_POR_DEFECTO):
+    """Instanciar para un puente el backend configurado en settings.PUENTE_ESTADO."""
+    config = getattr(settings, 'PUENTE_ESTADO', {})
+    clase = import_string(config.get('BACKEND', 'puente_app.backends.EstadoMemoria'))
+    return clase(puente=puente, **config.get('OPTIONS', {}))
@@ -0,0 +1,254 @@
+import asyncio
+import logging
+import time
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from . import metricas
+from .backends import crear_backend
+from .difusion import TEMA_RESUMEN, DifusorPuente, temas_delta
+from .puentes import PUENTE_POR_DEFECTO, nombre_grupo
+from .temporizador import Temporizador
+
+logger = logging.getLogger(__name__)
+
+GRUPO = nombre_grupo(PUENTE_POR_DEFECTO)
+
+_bucles = {}  # puente: BuclePuente
+_temporizador = Temporizador()  # los plazos de cruce de todos los puentes del proceso
+
+# Deltas tras los que puede haber un auto en condiciones de entrar al puente
+_CAMBIOS_ADMISION = {'auto_registrado', 'autos_registrados', 'auto_regreso_cola', 'auto_salio'}
+
+
+def _escala_cruces():
+    """Factor de settings.PUENTE_CRUCE_AUTOMATICO, o None si los cruces los termina el cliente."""
+    config = getattr(settings, 'PUENTE_CRUCE_AUTOMATICO', None)
+    return None if config is None else float(config.get('ESCALA', 1.0))
+
+
+def obtener_bucle(puente=PUENTE_POR_DEFECTO):
+    """Bucle de un puente en este proceso, compartido por el WebSocket y las vistas HTTP.
+
+    Se crea la primera vez con su propio backend de settings.PUENTE_ESTADO y
+    un difusor hacia el grupo del puente: los puentes no comparten cola de
+    comandos ni clientes.
+    """
+    bucle = _bucles.get(puente)
+    if bucle is None:
+        channel_layer = get_channel_layer()
+        difusor = DifusorPuente(channel_layer, nombre_grupo(puente)) if channel_layer else None
+        bucle = _bucles[puente] = BuclePuente(crear_backend(puente), difusor, puente, _escala_cruces())
+    return bucle
+
+
+class BuclePuente:
+    """Único escritor del estado del puente.
+
+    Los consumidores envían comandos por una cola asyncio y esperan la
+    respuesta en un future. Una sola tarea los pasa al backend de estado en
+    orden, así que no hace falta un lock y ningún comando espera la E/S de
+    otro cliente: los deltas se entregan al difusor, que los envía fuera de
+    esta tarea. Con un backend compartido, en los ratos libres la tarea trae
+    los cambios hechos por otros workers.
+
+    Los clientes filtrados escuchan grupos por tema (ver suscribir()); solo
+    se codifican y envían los temas que tienen suscriptores en este proceso.
+
+    Con `escala_cruces` el propio bucle termina cada cruce a los
+    tiempo_cruce * escala_cruces segundos y da el puente al siguiente auto;
+    un finalizar_cruce del cliente sigue pudiendo terminarlo antes.
+    """
+
+    def __init__(self, backend, difusor=None, puente=PUENTE_POR_DEFECTO, escala_cruces=None):
+        self.backend = backend
+        self.difusor = difusor
+        self.puente = puente
+        self.grupo = nombre_grupo(puente)
+        self.escala_cruces = escala_cruces
+        self._temas = {}  # tema: [difusor, suscriptores]
+        self._cola = None
+        self._tarea = None
+        self._cruces = {}  # auto_id: plazo del cruce en curso
+        self._estado = None  # (version, estado_json) más reciente
+        self._armando = None  # (version pedida, future de estado_versionado)
+        self._estado_inicial = None  # (estado_json, mensaje estado_inicial)
+        self._cruces_iniciados = False
+        self._admision_pendiente = False
+
+    def _asegurar_tarea(self):
+        loop = asyncio.get_running_loop()
+        if self._tarea is None or self._tarea.done() or self._tarea.get_loop() is not loop:
+            self._cola = asyncio.Queue()
+            self._tarea = loop.create_task(self._bucle(self._cola))
+
+    async def ejecutar(self, comando, *args):
+        """Encolar un comando del motor y esperar su respuesta."""
+        self._asegurar_tarea()
+        futuro = asyncio.get_running_loop().create_future()
+        self._cola.put_nowait((comando, args, futuro, time.perf_counter()))
+        return await futuro
+
+    async def estado_json(self):
+        """El snapshot codificado de la versión actual, compartido por todos.
+
+        Si ya está armado para la versión que ve este proceso no pasa por la
+        cola de comandos; si no, las conexiones que llegan juntas esperan el
+        mismo pedido. Su versión nunca es anterior a la del momento de la
+        llamada, así que no se pierden deltas de quien ya está en el grupo.
+        """
+        version = self.backend.motor.version
+        if self._estado is not None and self._estado[0] == version:
+            return self._estado[1]
+        if self._armando is None or self._armando[0] != version:
+            self._armando = (version, asyncio.ensure_future(self.ejecutar('estado_versionado')))
+        pedido = self._armando
+        try:
+            estado = await asyncio.shield(pedido[1])
+        finally:
+            if self._armando is pedido:
+                self._armando = None
+        if self._estado is None or estado[0] >= self._estado[0]:
+            self._estado = estado
+        return estado[1]
+
+    async def mensaje_estado_inicial(self):
+        """El mensaje estado_inicial del WebSocket ya codificado, uno por versión.
+
+        cruce_automatico avisa al cliente que no debe enviar finalizar_cruce.
+        """
+        estado = await self.estado_json()
+        if self._estado_inicial is None or self._estado_inicial[0] is not estado:
+            automatico = 'false' if self.escala_cruces is None else 'true'
+            self._estado_inicial = estado, ('{"type": "estado_inicial", "data": ' + estado
+                                            + ', "cruce_automatico": ' + automatico + '}')
+        return self._estado_inicial[1]
+
+    def grupo_tema(self, tema):
+        return f'{self.grupo}.{tema}'
+
+    def suscribir(self, temas):
+        """Contar un cliente más en cada tema: desde ahora se le publican sus deltas.
+
+        Solo con capa de canales, como la suscripción del consumidor.
+        """
+        for tema in temas:
+            entrada = self._temas.get(tema)
+            if entrada is None:
+                difusor = DifusorPuente(self.difusor.channel_layer, self.grupo_tema(tema))
+                entrada = self._temas[tema] = [difusor, 0]
+            entrada[1] += 1
+
+    def desuscribir(self, temas):
+        for tema in temas:
+            entrada = self._temas.get(tema)
+            if entrada is not None:
+                entrada[1] -= 1
+                if entrada[1] <= 0:
+                    del self._temas[tema]
+
+    def _publicar_temas(self, deltas):
+        temas = self._temas
+        for mensaje, urgente in deltas:
+            for tema, parcial in temas_delta(mensaje, temas):
+                temas[tema][0].publicar(parcial, urgente)
+        if TEMA_RESUMEN in temas:
+            # Un resumen por comando, no por delta
+            resumen = self.backend.motor.resumen()[0]
+            temas[TEMA_RESUMEN][0].publicar(
+                {'type': 'resumen', 'seq': resumen['version'], 'data': resumen},
+                any(urgente for _, urgente in deltas), reemplazar=True
+            )
+
+    def _encolar_interno(self, comando, *args):
+        # Comandos del propio bucle: nadie espera su respuesta
+        self._asegurar_tarea()
+        self._cola.put_nowait((comando, args, None, time.perf_counter()))
+
+    def _programar_cruce(self, auto_id, cruzadas, tiempo_cruce):
+        anterior = self._cruces.get(auto_id)
+        if anterior is not None:
+            _temporizador.cancelar(anterior)
+        self._cruces[auto_id] = _temporizador.programar(
+            tiempo_cruce * self.escala_cruces, self._encolar_interno, 'finalizar_cruce', auto_id, cruzadas
+        )
+
+    def _seguir_cruces(self, deltas):
+        """Programar el fin de los cruces que empiezan y pedir una admisión si algo cambió."""
+        motor = self.backend.motor
+        admitir = False
+        if not self._cruces_iniciados:
+            # Autos que ya estaban cruzando al arrancar (p. ej. recuperados del disco)
+            self._cruces_iniciados = admitir = True
+            for auto_id in motor.autos_en_puente:
+                auto = motor.autos[auto_id]
+                self._programar_cruce(auto_id, auto.cruzadas, auto.tiempo_cruce)
+        for mensaje, _ in deltas:
+            tipo = mensaje['type']
+            if tipo == 'auto_cruzando':
+                auto = mensaje['auto']
+                self._programar_cruce(auto['id'], auto['cruzadas'], auto['tiempo_cruce'])
+            elif tipo == 'reset_sistema':
+                for plazo in self._cruces.values():
+                    _temporizador.cancelar(plazo)
+                self._cruces.clear()
+            elif tipo in _CAMBIOS_ADMISION:
+                admitir = True
+                if tipo in ('auto_regreso_cola', 'auto_salio'):
+                    plazo = self._cruces.pop(mensaje['auto']['id'], None)
+                    if plazo is not None:
+                        _temporizador.cancelar(plazo)
+        if admitir and not self._admision_pendiente:
+            self._admision_pendiente = True
+            self._encolar_interno('admitir_siguientes')
+
+    def _publicar(self, deltas):
+        if self.difusor:
+            for mensaje, urgente in deltas:
+                self.difusor.publicar(mensaje, urgente)
+        if self._temas and deltas:
+            self._publicar_temas(deltas)
+        if self.escala_cruces is not None:
+            self._seguir_cruces(deltas)
+        motor = self.backend.motor
+        metricas.COLA.set(len(motor.cola_espera), self.puente)
+        metricas.EN_PUENTE.set(len(motor.autos_en_puente), self.puente)
+
+    async def _siguiente(self, cola):
+        if not self.backend.compartido:
+            return await cola.get()
+        while True:
+            try:
+                return await asyncio.wait_for(cola.get(), self.backend.intervalo_sincronizacion)
+            except asyncio.TimeoutError:
+                try:
+                    self._publicar(await self.backend.sincronizar())
+                except Exception as e:
+                    logger.warning("Error al sincronizar el estado del puente: %s", e)
+
+    async def _bucle(self, cola):
+        while True:
+            comando, args, futuro, encolado = await self._siguiente(cola)
+            inicio = time.perf_counter()
+            metricas.ESPERA_COMANDO.observar(inicio - encolado)
+            if comando == 'admitir_siguientes':
+                self._admision_pendiente = False
+            try:
+                respuesta, deltas = await self.backend.ejecutar(comando, args)
+            except Exception as e:
+                if futuro is None:
+                    logger.warning("Error en el comando interno %s: %s", comando, e)
+                elif not futuro.done():
+                    futuro.set_exception(e)
+                continue
+            finally:
+                metricas.COMANDO.observar(time.perf_counter() - inicio, comando)
+            try:
+                self._publicar(deltas)
+            except Exception:
+                # El comando ya se aplicó: se responde igual y el bucle sigue.
+                # Los clientes ven el hueco en el seq y se resincronizan
+                logger.exception("Error al publicar los deltas de %s en el puente %s", comando, self.puente)
+            if futuro is not None and not futuro.done():
+                futuro.set_result(respuesta)
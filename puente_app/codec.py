@@ -0,0 +1,36 @@
+import json
+
+from django.conf import settings
+
+_backend = None
+
+
+def obtener_backend(nombre):
+    """Devolver (dumps, loads) para 'json' u 'orjson'.
+
+    Si orjson no está instalado se usa la biblioteca estándar.
+    """
+    if nombre == 'orjson':
+        try:
+            import orjson
+        except ImportError:
+            pass
+        else:
+            return (lambda obj: orjson.dumps(obj).decode('utf-8')), orjson.loads
+    return json.dumps, json.loads
+
+
+def _backend_configurado():
+    global _backend
+    if _backend is None:
+        _backend = obtener_backend(getattr(settings, 'PUENTE_JSON_BACKEND', 'json'))
+    return _backend
+
+
+def dumps(obj):
+    """Codificar un mensaje a texto JSON listo para enviar por el WebSocket."""
+    return _backend_configurado()[0](obj)
+
+
+def loads(texto):
+    return _backend_configurado()[1](texto)
@@ -0,0 +1,248 @@
+import random
+
+
+class _Nodo:
+    __slots__ = ('clave', 'auto_id', 'peso', 'siguientes', 'anchos', 'sumas')
+
+    def __init__(self, clave, auto_id, nivel, peso=0.0):
+        self.clave = clave  # (prioridad, llegada)
+        self.auto_id = auto_id
+        self.peso = peso  # tiempo de cruce del auto
+        self.siguientes = [None] * nivel
+        # anchos[i]: cuántas posiciones avanza el enlace del nivel i
+        self.anchos = [1] * nivel
+        # sumas[i]: suma de los pesos de los nodos que salta ese enlace
+        self.sumas = [0.0] * nivel
+
+
+class ColaEspera:
+    """Cola de espera ordenada por (prioridad, llegada).
+
+    Implementada como skip list indexable: push, pop, remove por auto_id y
+    rank en O(log n) esperado, e iteración en orden en O(n) sin reordenar.
+    Cada auto lleva un peso (su tiempo de cruce) y los enlaces guardan la
+    suma de los pesos que saltan, así que espera() también es O(log n).
+    La cola asigna el orden de llegada con un contador monótono, de modo que
+    un auto que vuelve a la cola siempre queda al final de su prioridad.
+    """
+
+    NIVEL_MAX = 32
+
+    def __init__(self):
+        self._cabeza = _Nodo(None, None, self.NIVEL_MAX)
+        self._nivel = 1
+        self._claves = {}  # auto_id: (prioridad, llegada)
+        self._total = 0.0  # suma de los pesos de la cola
+        self._rng = random.Random()
+        self.llegada_counter = 0
+
+    def __len__(self):
+        return len(self._claves)
+
+    def __bool__(self):
+        return bool(self._claves)
+
+    def __contains__(self, auto_id):
+        return auto_id in self._claves
+
+    def __iter__(self):
+        """Recorre la cola en orden: (prioridad, llegada, auto_id)."""
+        nodo = self._cabeza.siguientes[0]
+        while nodo is not None:
+            yield nodo.clave[0], nodo.clave[1], nodo.auto_id
+            nodo = nodo.siguientes[0]
+
+    def _nivel_aleatorio(self):
+        bits = self._rng.getrandbits(self.NIVEL_MAX - 1)
+        nivel = 1
+        while bits & 1:
+            nivel += 1
+            bits >>= 1
+        return nivel
+
+    @property
+    def peso_total(self):
+        return self._total
+
+    def push(self, auto_id, prioridad, peso=0.0):
+        """Agregar un auto al final de su prioridad. Devuelve la llegada asignada."""
+        if auto_id in self._claves:
+            raise ValueError(f'El auto {auto_id} ya está en la cola')
+        llegada = self.llegada_counter
+        self.llegada_counter += 1
+        clave = (prioridad, llegada)
+
+        actualizar = [None] * self.NIVEL_MAX
+        rangos = [0] * self.NIVEL_MAX
+        acumulados = [0.0] * self.NIVEL_MAX
+        nodo = self._cabeza
+        pos = 0
+        acumulado = 0.0
+        for i in reversed(range(self._nivel)):
+            siguiente = nodo.siguientes[i]
+            while siguiente is not None and siguiente.clave < clave:
+                pos += nodo.anchos[i]
+                acumulado += nodo.sumas[i]
+                nodo = siguiente
+                siguiente = nodo.siguientes[i]
+            actualizar[i] = nodo
+            rangos[i] = pos
+            acumulados[i] = acumulado
+
+        nivel = self._nivel_aleatorio()
+        if nivel > self._nivel:
+            for i in range(self._nivel, nivel):
+                actualizar[i] = self._cabeza
+                rangos[i] = 0
+                acumulados[i] = 0.0
+                self._cabeza.anchos[i] = len(self._claves) + 1
+                self._cabeza.sumas[i] = self._total
+            self._nivel = nivel
+
+        nuevo = _Nodo(clave, auto_id, nivel, peso)
+        for i in range(nivel):
+            previo = actualizar[i]
+            nuevo.siguientes[i] = previo.siguientes[i]
+            previo.siguientes[i] = nuevo
+            nuevo.anchos[i] = previo.anchos[i] - (pos - rangos[i])
+            previo.anchos[i] = pos - rangos[i] + 1
+            nuevo.sumas[i] = previo.sumas[i] - (acumulado - acumulados[i])
+            previo.sumas[i] = acumulado - acumulados[i] + peso
+        for i in range(nivel, self._nivel):
+            actualizar[i].anchos[i] += 1
+            actualizar[i].sumas[i] += peso
+
+        self._claves[auto_id] = clave
+        self._total += peso
+        return llegada
+
+    def _desenlazar(self, actualizar, nodo):
+        for i in range(self._nivel):
+            previo = actualizar[i]
+            if previo.siguientes[i] is nodo:
+                previo.anchos[i] += nodo.anchos[i] - 1
+                previo.sumas[i] += nodo.sumas[i] - nodo.peso
+                previo.siguientes[i] = nodo.siguientes[i]
+            else:
+                previo.anchos[i] -= 1
+                previo.sumas[i] -= nodo.peso
+        while self._nivel > 1 and self._cabeza.siguientes[self._nivel - 1] is None:
+            self._nivel -= 1
+        del self._claves[nodo.auto_id]
+        self._total -= nodo.peso
+        if not self._claves:
+            self._total = 0.0  # descartar el error de redondeo acumulado
+
+    def pop(self):
+        """Sacar el auto al frente de la cola: (prioridad, llegada, auto_id)."""
+        nodo = self._cabeza.siguientes[0]
+        if nodo is None:
+            raise IndexError('pop de una cola vacía')
+        self._desenlazar([self._cabeza] * self._nivel, nodo)
+        return nodo.clave[0], nodo.clave[1], nodo.auto_id
+
+    def peek(self):
+        """Id del auto al frente de la cola, o None si está vacía."""
+        nodo = self._cabeza.siguientes[0]
+        return nodo.auto_id if nodo is not None else None
+
+    def frente(self):
+        """(prioridad, llegada, auto_id) del auto al frente, o None si está vacía."""
+        nodo = self._cabeza.siguientes[0]
+        return (nodo.clave[0], nodo.clave[1], nodo.auto_id) if nodo is not None else None
+
+    def remove(self, auto_id):
+        """Quitar un auto de cualquier posición. Devuelve False si no estaba."""
+        clave = self._claves.get(auto_id)
+        if clave is None:
+            return False
+        actualizar = [None] * self._nivel
+        nodo = self._cabeza
+        for i in reversed(range(self._nivel)):
+            siguiente = nodo.siguientes[i]
+            while siguiente is not None and siguiente.clave < clave:
+                nodo = siguiente
+                siguiente = nodo.siguientes[i]
+            actualizar[i] = nodo
+        self._desenlazar(actualizar, nodo.siguientes[0])
+        return True
+
+    def rank(self, auto_id):
+        """Posición (desde 0) del auto en la cola."""
+        clave = self._claves[auto_id]
+        nodo = self._cabeza
+        pos = 0
+        for i in reversed(range(self._nivel)):
+            siguiente = nodo.siguientes[i]
+            while siguiente is not None and siguiente.clave <= clave:
+                pos += nodo.anchos[i]
+                nodo = siguiente
+                siguiente = nodo.siguientes[i]
+        return pos - 1
+
+    def posicion(self, auto_id):
+        """(rank, espera) del auto: su posición y la suma de los pesos de los autos delante."""
+        clave = self._claves[auto_id]
+        nodo = self._cabeza
+        pos = 0
+        acumulado = 0.0
+        for i in reversed(range(self._nivel)):
+            siguiente = nodo.siguientes[i]
+            while siguiente is not None and siguiente.clave <= clave:
+                pos += nodo.anchos[i]
+                acumulado += nodo.sumas[i]
+                nodo = siguiente
+                siguiente = nodo.siguientes[i]
+        return pos - 1, acumulado - nodo.peso
+
+    def espera(self, auto_id):
+        """Suma de los pesos de los autos delante de auto_id."""
+        return self.posicion(auto_id)[1]
+
+    def clear(self):
+        self._cabeza = _Nodo(None, None, self.NIVEL_MAX)
+        self._nivel = 1
+        self._claves.clear()
+        self._total = 0.0
+        self.llegada_counter = 0
+
+    def instantanea(self):
+        """Contenido de la cola como datos JSON: el contador y [prioridad, llegada, auto_id, peso] en orden."""
+        autos = []
+        nodo = self._cabeza.siguientes[0]
+        while nodo is not None:
+            autos.append([nodo.clave[0], nodo.clave[1], nodo.auto_id, nodo.peso])
+            nodo = nodo.siguientes[0]
+        return {'llegada_counter': self.llegada_counter, 'autos': autos}
+
+    @classmethod
+    def desde_instantanea(cls, datos):
+        """Reconstruir una cola de instantanea() en O(n), enlazando los nodos ya ordenados."""
+        cola = cls()
+        ultimos = [cola._cabeza] * cls.NIVEL_MAX  # último nodo enlazado en cada nivel
+        posiciones = [0] * cls.NIVEL_MAX
+        acumulados = [0.0] * cls.NIVEL_MAX
+        pos = 0
+        acumulado = 0.0
+        for prioridad, llegada, auto_id, peso in datos['autos']:
+            # JSON devuelve como listas las prioridades compuestas
+            clave = (tuple(prioridad) if isinstance(prioridad, list) else prioridad, llegada)
+            pos += 1
+            acumulado += peso
+            nivel = cola._nivel_aleatorio()
+            nodo = _Nodo(clave, auto_id, nivel, peso)
+            for i in range(nivel):
+                previo = ultimos[i]
+                previo.siguientes[i] = nodo
+                previo.anchos[i] = pos - posiciones[i]
+                previo.sumas[i] = acumulado - acumulados[i]
+                ultimos[i], posiciones[i], acumulados[i] = nodo, pos, acumulado
+            cola._nivel = max(cola._nivel, nivel)
+            cola._claves[auto_id] = clave
+        # El último enlace de cada nivel llega hasta el final de la cola
+        for i in range(cola._nivel):
+            ultimos[i].anchos[i] = pos + 1 - posiciones[i]
+            ultimos[i].sumas[i] = acumulado - acumulados[i]
+        cola._total = acumulado
+        cola.llegada_counter = datos['llegada_counter']
+        return cola
@@ -1,346 +1,333 @@
+import asyncio
 import json
+import logging
+import time
 from channels.generic.websocket import AsyncWebsocketConsumer
-from heapq import heappush, heappop
-import asyncio
+from django.conf import settings
+from . import metricas
+from .bucle import obtener_bucle
+from .codec import dumps, loads
+from .difusion import TEMA_CONTROL, TEMA_RESUMEN, tema_auto, tema_direccion
+from .planificador import DIRECCIONES
+from .puentes import PUENTE_POR_DEFECTO, atiende, nombre_grupo, puente_valido, servidor_de
+from .salida import ColaSalida
+from .temporizador import Ritmo
+
+logger = logging.getLogger(__name__)
+
+# Tipos que se cuentan por nombre en las métricas; el resto como 'desconocido'
+TIPOS_MENSAJE = {'registrar_auto', 'registrar_autos', 'solicitar_cruce', 'finalizar_cruce',
+                 'resetear_sistema', 'metricas', 'estado_inicial', 'suscribir', 'confirmar'}
+
+# Autos que puede seguir un mismo socket con un filtro
+MAX_AUTOS_FILTRO = 100
+
+# Código de cierre con el que se avisa que el puente lo atiende otro worker
+CIERRE_REDIRIGIR = 4301
+# Código de cierre para un cliente que no leyó a tiempo: debe reconectar y
+# recibir el estado completo
+CIERRE_ATRASADO = 4302
+
+_ritmo = None
+
+
+def _ritmo_conexiones():
+    """Ritmo de settings.PUENTE_CONEXIONES_POR_SEGUNDO, o None si no hay límite."""
+    global _ritmo
+    por_segundo = getattr(settings, 'PUENTE_CONEXIONES_POR_SEGUNDO', 0)
+    if not por_segundo:
+        return None
+    if _ritmo is None or _ritmo.intervalo != 1 / por_segundo:
+        _ritmo = Ritmo(por_segundo)
+    return _ritmo
+
 
 class PuenteConsumer(AsyncWebsocketConsumer):
-    # Variables de clase compartidas entre todas las conexiones
-    autos = {}  # id: {info del auto}
-    cola_espera = []  # priority queue: (prioridad, llegada, id_auto)
-    autos_en_puente = None  # id del auto cruzando actualmente
-    auto_id_counter = 1
-    llegada_counter = 0
-    _lock = asyncio.Lock()  # Para evitar condiciones de carrera
+    def get_bucle(self):
+        # Estado compartido entre las conexiones del mismo puente: un único bucle
+        # de comandos por puente los aplica en orden sobre su propio backend
+        return obtener_bucle(self.puente)
 
     async def connect(self):
+        metricas.SOCKETS.inc()
+        self.puente = self.scope['url_route']['kwargs'].get('puente_id', PUENTE_POR_DEFECTO)
+        self.grupo = nombre_grupo(self.puente)
+        self.temas = set()  # vacío: recibe todos los deltas del grupo del puente
+        self.filtro = None
+        self.salida = None
+        self._escritor = None
+        if not puente_valido(self.puente):
+            await self.close()
+            return
+        if not atiende(self.puente):
+            # Con settings.PUENTE_WORKERS cada puente vive en un solo worker
+            await self.accept()
+            await self.send(text_data=dumps({
+                'type': 'redirigir',
+                'puente': self.puente,
+                'servidor': servidor_de(self.puente)
+            }))
+            await self.close(code=CIERRE_REDIRIGIR)
+            return
+        ritmo = _ritmo_conexiones()
+        if ritmo:
+            # Tras un corte miles de clientes reconectan a la vez: se los
+            # atiende repartidos en el tiempo, todavía sin unirlos al grupo
+            await ritmo.esperar()
         try:
-            print(f"Connecting... channel_layer: {self.channel_layer}")
             if self.channel_layer:
-                await self.channel_layer.group_add("puente_grupo", self.channel_name)
+                await self.channel_layer.group_add(self.grupo, self.channel_name)
             await self.accept()
-            estado = self.get_estado_puente()
-            await self.send(text_data=json.dumps({
-                'type': 'estado_inicial',
-                'data': estado
-            }))
-            print("WebSocket connected successfully")
-        except Exception as e:
-            print(f"Error in connect: {e}")
+            await self.enviar_estado_inicial()
+            self.salida = ColaSalida(getattr(settings, 'PUENTE_SALIDA_MAX_MENSAJES', 1000),
+                                     getattr(settings, 'PUENTE_SALIDA_MAX_BYTES', 4 * 1024 * 1024))
+            self._escritor = asyncio.create_task(self._escribir())
+            logger.debug("WebSocket conectado: %s", self.channel_name)
+        except Exception:
+            logger.exception("Error al conectar el WebSocket")
             await self.accept()
 
     async def disconnect(self, close_code):
+        metricas.SOCKETS.dec()
+        if self._escritor:
+            self._escritor.cancel()
         try:
             if self.channel_layer:
-                await self.channel_layer.group_discard("puente_grupo", self.channel_name)
-        except Exception as e:
-            print(f"Error in disconnect: {e}")
+                await self._cambiar_temas(set(), grupo_base=False)
+        except Exception:
+            logger.exception("Error al desconectar el WebSocket")
+
+    async def _encolar(self, event):
+        """Dejar un evento del grupo en la cola de salida del socket.
+
+        El manejador no espera al socket: un cliente lento no frena la lectura
+        de su canal. Si su cola, contando lo enviado que aún no confirmó, pasa
+        el tope se lo desconecta para que se resincronice, en lugar de
+        acumular memoria o perder deltas en silencio.
+        """
+        if self.salida is None:
+            return
+        if not self.salida.agregar(event['type'], event['texto'], event['seq']):
+            logger.warning("WebSocket %s atrasado (%d mensajes pendientes, %d sin confirmar): se desconecta",
+                           self.channel_name, len(self.salida), self.salida.en_vuelo)
+            metricas.ATRASADOS.inc()
+            self.salida.vaciar()
+            self.salida = None
+            self._escritor.cancel()
+            await self.send(text_data=dumps({
+                'type': 'resincronizar',
+                'message': 'El cliente no lee los cambios a tiempo; reconectar para recibir el estado completo'
+            }))
+            await self.close(code=CIERRE_ATRASADO)
+
+    async def _escribir(self):
+        salida = self.salida
+        while True:
+            await self.send(text_data=await salida.siguiente())
+
+    def _grupos(self, temas):
+        if not temas:
+            return {self.grupo}
+        bucle = self.get_bucle()
+        return {bucle.grupo_tema(tema) for tema in temas}
+
+    async def _cambiar_temas(self, temas, grupo_base=True):
+        """Pasar el socket de los grupos de sus temas actuales a los de `temas`."""
+        nuevos = self._grupos(temas) if temas or grupo_base else set()
+        anteriores = self._grupos(self.temas)
+        for grupo in nuevos - anteriores:
+            await self.channel_layer.group_add(grupo, self.channel_name)
+        for grupo in anteriores - nuevos:
+            await self.channel_layer.group_discard(grupo, self.channel_name)
+        if temas or self.temas:
+            bucle = self.get_bucle()
+            bucle.suscribir(temas - self.temas)
+            bucle.desuscribir(self.temas - temas)
+        self.temas = temas
 
     async def receive(self, text_data):
+        inicio = time.perf_counter()
+        tipo = 'invalido'
         try:
-            print(f"Received message: {text_data}")
-            data = json.loads(text_data)
+            logger.debug("Mensaje recibido: %s", text_data)
+            data = loads(text_data)
             message_type = data.get('type')
-            
-            async with self._lock:  # Proteger operaciones críticas
-                if message_type == 'registrar_auto':
-                    await self.handle_registrar_auto(data)
-                elif message_type == 'solicitar_cruce':
-                    await self.handle_solicitar_cruce(data)
-                elif message_type == 'finalizar_cruce':
-                    await self.handle_finalizar_cruce(data)
-                elif message_type == 'resetear_sistema':
-                    await self.handle_resetear_sistema()
-                else:
-                    await self.send(text_data=json.dumps({
-                        'type': 'error',
-                        'message': 'Tipo de mensaje no reconocido'
-                    }))
+            tipo = message_type if message_type in TIPOS_MENSAJE else 'desconocido'
+
+            # Sin lock: el bucle del puente serializa los comandos y las
+            # respuestas se envían después, fuera de la sección crítica
+            if message_type == 'registrar_auto':
+                await self.handle_registrar_auto(data)
+            elif message_type == 'registrar_autos':
+                await self.handle_registrar_autos(data)
+            elif message_type == 'solicitar_cruce':
+                await self.handle_solicitar_cruce(data)
+            elif message_type == 'finalizar_cruce':
+                await self.handle_finalizar_cruce(data)
+            elif message_type == 'resetear_sistema':
+                await self.handle_resetear_sistema()
+            elif message_type == 'metricas':
+                await self.send(text_data=dumps({
+                    'type': 'metricas',
+                    'data': await self.get_bucle().ejecutar('metricas')
+                }))
+            elif message_type == 'suscribir':
+                await self.handle_suscribir(data)
+            elif message_type == 'confirmar':
+                self.handle_confirmar(data)
+            elif message_type == 'estado_inicial':
+                # El cliente detectó un hueco en la secuencia y pide resincronizar
+                await self.enviar_estado_inicial()
+            else:
+                await self.send(text_data=dumps({
+                    'type': 'error',
+                    'message': 'Tipo de mensaje no reconocido'
+                }))
         except json.JSONDecodeError:
-            await self.send(text_data=json.dumps({
+            await self.send(text_data=dumps({
                 'type': 'error',
                 'message': 'JSON inválido'
             }))
         except Exception as e:
-            print(f"Error in receive: {e}")
-            await self.send(text_data=json.dumps({
+            logger.exception("Error al atender un mensaje %s", tipo)
+            await self.send(text_data=dumps({
                 'type': 'error',
                 'message': f'Error interno: {str(e)}'
             }))
+        finally:
+            metricas.MENSAJES.inc(tipo)
+            metricas.MANEJADOR.observar(time.perf_counter() - inicio, tipo)
+
+    async def get_estado_puente(self):
+        return await self.get_bucle().ejecutar('estado')
+
+    async def enviar_estado_inicial(self):
+        if self.filtro:
+            await self.enviar_estado_filtrado()
+            return
+        # Codificado una vez por versión y compartido por todas las conexiones
+        await self.send(text_data=await self.get_bucle().mensaje_estado_inicial())
+
+    async def enviar_estado_filtrado(self):
+        bucle = self.get_bucle()
+        mensaje = {'type': 'suscrito', 'filtro': self.filtro}
+        if self.filtro['direcciones'] or self.filtro['auto_ids']:
+            mensaje['data'] = await bucle.ejecutar('estado_filtrado', self.filtro['direcciones'],
+                                                   self.filtro['auto_ids'])
+        if self.filtro['resumen']:
+            mensaje['resumen'] = await bucle.ejecutar('resumen')
+        await self.send(text_data=dumps(mensaje))
+
+    async def handle_suscribir(self, data):
+        """Limitar el socket a unas direcciones, unos autos o solo el resumen.
+
+        Sin ningún criterio vuelve a recibir todo. En lugar de estado_inicial
+        recibe 'suscrito' con el estado de lo que filtra; sus deltas son un
+        subconjunto de los del puente, así que su seq puede saltar.
+        """
+        direcciones = data.get('direcciones') or []
+        auto_ids = data.get('auto_ids') or []
+        solo_resumen = bool(data.get('resumen'))
+        if (not isinstance(direcciones, list) or not set(direcciones) <= set(DIRECCIONES)
+                or not isinstance(auto_ids, list) or len(auto_ids) > MAX_AUTOS_FILTRO
+                or not all(type(auto_id) is int for auto_id in auto_ids)):
+            await self.send(text_data=dumps({
+                'type': 'error',
+                'message': f'Filtro inválido: direcciones N/S y hasta {MAX_AUTOS_FILTRO} auto_ids enteros'
+            }))
+            return
+        if not self.channel_layer:
+            await self.send(text_data=dumps({
+                'type': 'error',
+                'message': 'No hay una capa de canales configurada'
+            }))
+            return
 
-    def get_estado_puente(self):
-        auto_en_puente = []
-        if PuenteConsumer.autos_en_puente and PuenteConsumer.autos_en_puente in PuenteConsumer.autos:
-            auto_en_puente = [PuenteConsumer.autos[PuenteConsumer.autos_en_puente]]
-        
-        cola_ordenada = sorted(PuenteConsumer.cola_espera)
-        autos_esperando = [PuenteConsumer.autos[aid] for (_, _, aid) in cola_ordenada if aid in PuenteConsumer.autos]
-        return {
-            'autos_en_puente': auto_en_puente,
-            'autos_esperando': autos_esperando,
-            'total_autos': len(PuenteConsumer.autos)
-        }
+        temas = {tema_direccion(d) for d in direcciones} | {tema_auto(a) for a in auto_ids}
+        if temas:
+            temas.add(TEMA_CONTROL)
+        if solo_resumen:
+            temas.add(TEMA_RESUMEN)
+        await self._cambiar_temas(temas)
+        self.filtro = {
+            'direcciones': sorted(set(direcciones)),
+            'auto_ids': sorted(set(auto_ids)),
+            'resumen': solo_resumen
+        } if temas else None
+        await self.enviar_estado_inicial()
 
     async def handle_registrar_auto(self, data):
         try:
-            auto_data = data.get('auto', {})
-            auto_id = PuenteConsumer.auto_id_counter
-            PuenteConsumer.auto_id_counter += 1
-            prioridad = int(auto_data.get('prioridad', 3))
-            llegada = PuenteConsumer.llegada_counter
-            PuenteConsumer.llegada_counter += 1
-            vueltas = int(auto_data.get('vueltas', 1))
-            
-            auto = {
-                'id': auto_id,
-                'nombre': auto_data.get('nombre', f'Auto_{auto_id}'),
-                'velocidad': float(auto_data.get('velocidad', 60)),
-                'tiempo_espera': float(auto_data.get('tiempo_espera', 10)),
-                'direccion': auto_data.get('direccion', 'N'),
-                'prioridad': prioridad,
-                'en_puente': False,
-                'llegada': llegada,
-                'vueltas': vueltas,
-                'vueltas_totales': vueltas,  # Guardar el total original
-                'cruzadas': 0  # Contador de cruces completados
-            }
-            
-            PuenteConsumer.autos[auto_id] = auto
-            heappush(PuenteConsumer.cola_espera, (prioridad, llegada, auto_id))
-            
-            print(f"Auto registrado: {auto['nombre']} (ID: {auto_id})")
-            
-            if self.channel_layer:
-                await self.channel_layer.group_send(
-                    "puente_grupo",
-                    {
-                        "type": "auto_registrado",
-                        "auto": auto
-                    }
-                )
-                # Enviar estado actualizado a todos los clientes
-                await self.channel_layer.group_send(
-                    "puente_grupo",
-                    {
-                        "type": "estado_actualizado",
-                        "estado": self.get_estado_puente()
-                    }
-                )
+            await self.get_bucle().ejecutar('registrar_auto', data.get('auto', {}))
         except Exception as e:
-            print(f"Error en handle_registrar_auto: {e}")
-            await self.send(text_data=json.dumps({
+            logger.warning("Error al registrar auto: %s", e)
+            await self.send(text_data=dumps({
                 'type': 'error',
                 'message': f'Error al registrar auto: {str(e)}'
             }))
 
+    async def handle_registrar_autos(self, data):
+        try:
+            ids = await self.get_bucle().ejecutar('registrar_autos', data.get('autos', []))
+            await self.send(text_data=dumps({
+                'type': 'respuesta_registro',
+                'ids': ids
+            }))
+        except Exception as e:
+            logger.warning("Error al registrar autos: %s", e)
+            await self.send(text_data=dumps({
+                'type': 'error',
+                'message': f'Error al registrar autos: {str(e)}'
+            }))
+
     async def handle_solicitar_cruce(self, data):
         try:
-            auto_id = data.get('auto_id')
-            print(f"Solicitud de cruce para auto ID: {auto_id}")
-            
-            # Verificar que el auto existe
-            if auto_id not in PuenteConsumer.autos:
-                await self.send(text_data=json.dumps({
-                    'type': 'respuesta_cruce',
-                    'data': {
-                        'success': False,
-                        'permiso': False,
-                        'mensaje': 'Auto no encontrado en el sistema',
-                        'auto_id': auto_id
-                    }
-                }))
-                return
-            
-            # Solo el auto al frente de la cola puede cruzar y solo si el puente está libre
-            if PuenteConsumer.cola_espera and PuenteConsumer.cola_espera[0][2] == auto_id:
-                if PuenteConsumer.autos_en_puente is None:
-                    PuenteConsumer.autos_en_puente = auto_id
-                    heappop(PuenteConsumer.cola_espera)
-                    PuenteConsumer.autos[auto_id]['en_puente'] = True
-                    
-                    resultado = {
-                        'success': True,
-                        'permiso': True,
-                        'mensaje': f"Auto {PuenteConsumer.autos[auto_id]['nombre']} puede cruzar el puente",
-                        'auto': PuenteConsumer.autos[auto_id],
-                        'auto_id': auto_id
-                    }
-                    
-                    print(f"Auto {PuenteConsumer.autos[auto_id]['nombre']} comenzando cruce")
-                    
-                    if self.channel_layer:
-                        await self.channel_layer.group_send(
-                            "puente_grupo",
-                            {
-                                "type": "auto_cruzando",
-                                "auto": PuenteConsumer.autos[auto_id]
-                            }
-                        )
-                else:
-                    auto_en_puente = PuenteConsumer.autos.get(PuenteConsumer.autos_en_puente, {})
-                    resultado = {
-                        'success': False,
-                        'permiso': False,
-                        'mensaje': f"Puente ocupado por {auto_en_puente.get('nombre', 'auto desconocido')}",
-                        'auto_id': auto_id
-                    }
-            else:
-                # Encontrar quién está al frente de la cola
-                proximo_auto = None
-                if PuenteConsumer.cola_espera:
-                    proximo_id = PuenteConsumer.cola_espera[0][2]
-                    proximo_auto = PuenteConsumer.autos.get(proximo_id, {})
-                
-                mensaje = 'No es el turno de este auto para cruzar'
-                if proximo_auto:
-                    mensaje += f". Turno actual: {proximo_auto.get('nombre', 'Auto desconocido')}"
-                
-                resultado = {
-                    'success': False,
-                    'permiso': False,
-                    'mensaje': mensaje,
-                    'auto_id': auto_id
-                }
-            
-            await self.send(text_data=json.dumps({
+            resultado = await self.get_bucle().ejecutar('solicitar_cruce', data.get('auto_id'))
+            await self.send(text_data=dumps({
                 'type': 'respuesta_cruce',
                 'data': resultado
             }))
         except Exception as e:
-            print(f"Error en handle_solicitar_cruce: {e}")
-            await self.send(text_data=json.dumps({
+            logger.warning("Error al solicitar cruce: %s", e)
+            await self.send(text_data=dumps({
                 'type': 'error',
                 'message': f'Error al solicitar cruce: {str(e)}'
             }))
 
+    def handle_confirmar(self, data):
+        # El cliente ya recibió hasta ese seq: deja de contar para su tope
+        seq = data.get('seq')
+        if self.salida is not None and type(seq) is int:
+            self.salida.confirmar(seq)
+
     async def handle_finalizar_cruce(self, data):
-        auto_id = data.get('auto_id')
-        if PuenteConsumer.autos_en_puente == auto_id:
-            PuenteConsumer.autos_en_puente = None
-            auto = PuenteConsumer.autos.get(auto_id)
-            
-            if auto:
-                auto['en_puente'] = False
-                auto['cruzadas'] += 1  # Incrementar contador de cruces
-                
-                # Determinar si el auto debe continuar o salir del sistema
-                if auto['cruzadas'] < auto['vueltas_totales']:
-                    # El auto debe hacer más cruces
-                    # Cambiar dirección (ida y vuelta)
-                    auto['direccion'] = 'S' if auto['direccion'] == 'N' else 'N'
-                    auto['vueltas'] = auto['vueltas_totales'] - auto['cruzadas']  # Actualizar vueltas restantes
-                    
-                    # Generar nuevo orden de llegada para la cola (FIFO - se pone al final)
-                    # Encontrar el valor máximo de llegada actual y agregar 1 para ir al final
-                    max_llegada = 0
-                    if PuenteConsumer.cola_espera:
-                        max_llegada = max(item[1] for item in PuenteConsumer.cola_espera)
-                    
-                    llegada = max_llegada + 1
-                    auto['llegada'] = llegada
-                    
-                    # Volver a agregar a la cola con la misma prioridad pero al final
-                    heappush(PuenteConsumer.cola_espera, (auto['prioridad'], llegada, auto_id))
-                    
-                    print(f"Auto {auto['nombre']} regresó a la cola al final (FIFO) - Dirección: {auto['direccion']} - Llegada: {llegada}")
-                    
-                    # Mostrar el estado actual de la cola
-                    cola_actual = sorted(PuenteConsumer.cola_espera)
-                    print("Cola actual después del regreso:")
-                    for i, (prioridad, llegada_cola, auto_id_cola) in enumerate(cola_actual):
-                        auto_cola = PuenteConsumer.autos.get(auto_id_cola, {})
-                        print(f"  {i+1}. {auto_cola.get('nombre', 'Desconocido')} (llegada: {llegada_cola})")
-                    
-                    # Notificar que el auto ha regresado a la cola
-                    if self.channel_layer:
-                        await self.channel_layer.group_send(
-                            "puente_grupo",
-                            {
-                                "type": "auto_regreso_cola",
-                                "auto": auto
-                            }
-                        )
-                else:
-                    # El auto ha completado todas sus vueltas, removerlo del sistema
-                    PuenteConsumer.autos.pop(auto_id, None)
-                    if self.channel_layer:
-                        await self.channel_layer.group_send(
-                            "puente_grupo",
-                            {
-                                "type": "auto_salio",
-                                "auto": auto,
-                                "eliminado": True
-                            }
-                        )
-                
-                # Notificar a todos los clientes el estado actualizado
-                if self.channel_layer:
-                    await self.channel_layer.group_send(
-                        "puente_grupo",
-                        {
-                            "type": "estado_actualizado",
-                            "estado": self.get_estado_puente()
-                        }
-                    )
+        await self.get_bucle().ejecutar('finalizar_cruce', data.get('auto_id'))
 
     async def handle_resetear_sistema(self):
-        # Limpiar completamente el sistema
-        PuenteConsumer.autos.clear()
-        PuenteConsumer.cola_espera.clear()
-        PuenteConsumer.autos_en_puente = None
-        PuenteConsumer.auto_id_counter = 1
-        PuenteConsumer.llegada_counter = 0
-        
-        # Notificar a todos los clientes conectados
-        if self.channel_layer:
-            await self.channel_layer.group_send(
-                "puente_grupo",
-                {
-                    "type": "reset_sistema"
-                }
-            )
-            
-            # Enviar estado limpio inmediatamente
-            await self.channel_layer.group_send(
-                "puente_grupo",
-                {
-                    "type": "estado_actualizado",
-                    "estado": self.get_estado_puente()
-                }
-            )
-
-    # Métodos para manejar eventos del grupo
+        await self.get_bucle().ejecutar('resetear_sistema')
+
+    # Métodos para manejar eventos del grupo: cada evento es un parche (o un
+    # lote de parches) ya codificado por el difusor, se reenvía sin tocarlo
     async def auto_registrado(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'auto_registrado',
-            'auto': event['auto']
-        }))
+        await self._encolar(event)
+
+    async def autos_registrados(self, event):
+        await self._encolar(event)
 
     async def auto_cruzando(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'auto_cruzando',
-            'auto': event['auto']
-        }))
+        await self._encolar(event)
 
     async def auto_salio(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'auto_salio',
-            'auto': event['auto'],
-            'eliminado': True
-        }))
+        await self._encolar(event)
 
     async def auto_regreso_cola(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'auto_regreso_cola',
-            'auto': event['auto']
-        }))
+        await self._encolar(event)
 
     async def reset_sistema(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'reset_sistema'
-        }))
-    
-    async def estado_actualizado(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'estado_actualizado',
-            'estado': event['estado']
-        }))
\ No newline at end of file
+        await self._encolar(event)
+
+    async def resumen(self, event):
+        await self._encolar(event)
+
+    async def lote(self, event):
+        await self._encolar(event)
@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import time
+
+from django.conf import settings
+
+from . import metricas
+from .codec import dumps
+from .planificador import DIRECCIONES
+
+# Temas de los clientes filtrados; cada uno es el grupo <grupo del puente>.<tema>
+TEMA_RESUMEN = 'resumen'
+TEMA_CONTROL = 'control'  # reset_sistema, para quien filtra por dirección o por auto
+
+# Segundos hasta volver a intentar un envío que falló, si antes no llega otro evento
+REINTENTO_ENVIO = 1.0
+
+logger = logging.getLogger(__name__)
+
+
+def tema_direccion(direccion):
+    return f'dir.{direccion}'
+
+
+def tema_auto(auto_id):
+    return f'auto.{auto_id}'
+
+
+def temas_delta(mensaje, suscritos):
+    """(tema, delta) por cada tema de `suscritos` al que le importa el delta.
+
+    Un registro en lote se parte: cada tema recibe solo sus autos, con el
+    mismo seq. Un delta puede llegar por dos temas (su dirección y su auto);
+    el seq permite reconocerlo.
+    """
+    tipo = mensaje['type']
+    if tipo == 'reset_sistema':
+        if TEMA_CONTROL in suscritos:
+            yield TEMA_CONTROL, mensaje
+        return
+    if tipo == 'autos_registrados':
+        partes = {}
+        for auto, posicion in zip(mensaje['autos'], mensaje['posiciones']):
+            for tema in (tema_direccion(auto['direccion']), tema_auto(auto['id'])):
+                if tema in suscritos:
+                    autos, posiciones = partes.setdefault(tema, ([], []))
+                    autos.append(auto)
+                    posiciones.append(posicion)
+        for tema, (autos, posiciones) in partes.items():
+            yield tema, {**mensaje, 'autos': autos, 'posiciones': posiciones}
+        return
+    auto = mensaje['auto']
+    # Al volver a la cola el auto cambió de sentido: les importa a las dos direcciones
+    direcciones = DIRECCIONES if tipo == 'auto_regreso_cola' else (auto['direccion'],)
+    for tema in (*map(tema_direccion, direcciones), tema_auto(auto['id'])):
+        if tema in suscritos:
+            yield tema, mensaje
+
+
+class DifusorPuente:
+    """Agrupa los deltas de un grupo y los envía como mucho `hz` veces por segundo.
+
+    Los deltas que llegan entre dos envíos salen juntos en un mensaje 'lote'.
+    Un evento urgente se envía de inmediato junto con lo que estuviera
+    pendiente, de modo que el orden de seq se mantiene. Con hz <= 0 cada
+    evento se envía apenas se publica.
+
+    Si group_send falla, los deltas vuelven al principio de lo pendiente y
+    salen con el próximo envío, a más tardar en REINTENTO_ENVIO segundos.
+    """
+
+    def __init__(self, channel_layer, grupo, hz=None):
+        self.channel_layer = channel_layer
+        self.grupo = grupo
+        self.hz = getattr(settings, 'PUENTE_BROADCAST_HZ', 0) if hz is None else hz
+        self.mensajes_enviados = 0
+        self._pendientes = []
+        self._ultimo_envio = 0.0
+        self._tarea = None
+        self._envios = set()  # tareas de envío en curso, para no perder sus errores
+        self._envio = asyncio.Lock()
+
+    def publicar(self, mensaje, urgente=False, reemplazar=False):
+        """Encolar un delta para el próximo envío; no espera la E/S de red.
+
+        Con reemplazar, el mensaje ocupa el lugar del último pendiente si es
+        del mismo tipo (un resumen nuevo deja obsoleto al anterior).
+        """
+        if reemplazar and self._pendientes and self._pendientes[-1]['type'] == mensaje['type']:
+            self._pendientes[-1] = mensaje
+        else:
+            self._pendientes.append(mensaje)
+        if urgente or self.hz <= 0:
+            self._lanzar(self.vaciar())
+        elif self._tarea is None:
+            espera = self._ultimo_envio + 1 / self.hz - time.monotonic()
+            self._tarea = self._lanzar(self._vaciar_despues(max(0.0, espera)))
+
+    def _lanzar(self, envio):
+        tarea = asyncio.ensure_future(envio)
+        self._envios.add(tarea)
+        tarea.add_done_callback(self._al_terminar)
+        return tarea
+
+    def _al_terminar(self, tarea):
+        self._envios.discard(tarea)
+        if not tarea.cancelled() and tarea.exception() is not None:
+            logger.error("Error al difundir al grupo %s", self.grupo, exc_info=tarea.exception())
+
+    async def _vaciar_despues(self, espera):
+        await asyncio.sleep(espera)
+        self._tarea = None
+        await self.vaciar()
+
+    async def vaciar(self):
+        """Enviar ya todo lo pendiente, codificado una sola vez."""
+        async with self._envio:
+            if not self._pendientes:
+                return
+            pendientes, self._pendientes = self._pendientes, []
+            if len(pendientes) == 1:
+                mensaje = pendientes[0]
+            else:
+                mensaje = {'type': 'lote', 'eventos': pendientes}
+            self._ultimo_envio = time.monotonic()
+            texto = dumps(mensaje)
+            inicio = time.perf_counter()
+            try:
+                await self.channel_layer.group_send(
+                    self.grupo,
+                    {
+                        'type': mensaje['type'],
+                        'seq': pendientes[-1]['seq'],  # último seq incluido
+                        'texto': texto
+                    }
+                )
+            except Exception:
+                # Delante de lo publicado mientras tanto, para conservar el orden
+                self._pendientes[:0] = pendientes
+                if self._tarea is None:
+                    self._tarea = self._lanzar(self._vaciar_despues(REINTENTO_ENVIO))
+                raise
+            self.mensajes_enviados += 1
+            metricas.GROUP_SEND.observar(time.perf_counter() - inicio)
@@ -0,0 +1,728 @@
+import asyncio
+import gc
+import json
+import logging
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from heapq import heapify, heappop, heappush
+
+from asgiref.sync import sync_to_async
+from channels.layers import InMemoryChannelLayer, get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from django.db import connection
+from django.db.models import Count, Max, Min
+from django.http import JsonResponse
+from django.test import AsyncRequestFactory, Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+
+from puente_app import metricas, views
+from puente_app.backends import EstadoPersistente
+from puente_app.bucle import obtener_bucle
+from puente_app.codec import obtener_backend
+from puente_app.cola import ColaEspera
+from puente_app.difusion import DifusorPuente
+from puente_app.models import Auto, ColaDireccion
+from puente_app.motor import AutoPuente, calcular_tiempo_cruce
+from puente_app.routing import websocket_urlpatterns
+
+
+def _cronometrar(funcion, repeticiones):
+    """Microsegundos promedio por llamada."""
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        funcion()
+    return (time.perf_counter() - inicio) / repeticiones * 1e6
+
+
+def _registrar_por_rest(cantidad):
+    """Proceso hijo del escenario 'turnos': registra autos por la API REST."""
+    random.seed()  # tras el fork todos los hijos heredan el mismo estado
+    cliente = Client()
+    errores = 0
+    for _ in range(cantidad):
+        if cliente.post('/api/registrar-auto/').status_code != 200:
+            errores += 1
+    connection.close()
+    return errores
+
+
+def _estado_colas_sincrona(request):
+    """estado_colas como vista síncrona, para comparar con la async."""
+    return JsonResponse({
+        'cola_norte': [views._datos_en_cola(a) for a in Auto.objects.cola('N')],
+        'cola_sur': [views._datos_en_cola(a) for a in Auto.objects.cola('S')]
+    })
+
+
+def _solicitar_cruce_sincrona(request):
+    """solicitar_cruce como vista síncrona, para comparar con la async."""
+    auto = Auto.objects.get(id=json.loads(request.body)['auto_id'])
+    primero_id = ColaDireccion.objects.filter(direccion=auto.direccion).values_list('cabeza_id', flat=True).first()
+    return JsonResponse({'permiso': primero_id == auto.id})
+
+
+class _CapaContadora:
+    """Capa de canales que solo registra cuándo se difundió cada mensaje."""
+
+    def __init__(self):
+        self.envios = []
+
+    async def group_send(self, grupo, mensaje):
+        self.envios.append(time.monotonic())
+
+
+class Command(BaseCommand):
+    help = 'Microbenchmarks de las estructuras del puente'
+
+    escenarios = ['cola', 'difusion', 'rafaga', 'comandos', 'lote', 'memoria', 'rest', 'turnos', 'async',
+                  'recuperacion', 'filtros', 'lentos', 'tormenta']
+
+    def add_arguments(self, parser):
+        parser.add_argument('escenario', choices=self.escenarios)
+        parser.add_argument('--tamanos', type=int, nargs='+', default=[1000, 10000, 100000],
+                            help='Cantidad de autos en la cola')
+        parser.add_argument('--repeticiones', type=int, default=200)
+        parser.add_argument('--suscriptores', type=int, nargs='+', default=[10, 100, 1000, 2000],
+                            help='Cantidad de sockets conectados al grupo')
+        parser.add_argument('--autos', type=int, default=100,
+                            help='Autos en el estado usado como carga de cada evento')
+        parser.add_argument('--eventos', type=int, default=10)
+        parser.add_argument('--hz', type=int, nargs='+', default=[0, 10, 20, 50],
+                            help='Valores de PUENTE_BROADCAST_HZ a comparar')
+        parser.add_argument('--duracion', type=float, default=2.0, help='Segundos de carga')
+        parser.add_argument('--sockets', type=int, default=1000, help='Clientes WebSocket concurrentes')
+        parser.add_argument('--total', type=int, default=10000, help='Autos a registrar')
+        parser.add_argument('--lote', type=int, default=1000, help='Autos por mensaje registrar_autos')
+        parser.add_argument('--clientes', type=int, default=500, help='Clientes HTTP concurrentes')
+        parser.add_argument('--peticiones', type=int, default=10, help='Peticiones por cliente')
+        parser.add_argument('--procesos', type=int, default=8, help='Procesos registrando a la vez')
+        parser.add_argument('--instantanea-cada', type=int, default=10000,
+                            help='Comandos entre instantáneas de EstadoPersistente')
+        parser.add_argument('--semilla', type=int, default=0)
+
+    def handle(self, *args, **options):
+        random.seed(options['semilla'])
+        # Cada escenario abre sus propios puentes de usar y tirar
+        with override_settings(PUENTES_PERMITIDOS=None):
+            getattr(self, f"bench_{options['escenario']}")(options)
+
+    def bench_cola(self, options):
+        """Cola heapq original contra ColaEspera, por operación y tamaño."""
+        repeticiones = options['repeticiones']
+        self.stdout.write(f"{'autos':>8} {'estructura':>11} {'push':>9} {'pop':>9} "
+                          f"{'remove':>9} {'rank':>9} {'recorrer':>10}  (µs/op)")
+        for n in options['tamanos']:
+            prioridades = [random.randint(1, 5) for _ in range(n)]
+
+            # Implementación anterior: lista heapq + max() para llegar al final + sorted()
+            heap = [(p, i, i) for i, p in enumerate(prioridades)]
+            heapify(heap)
+            siguiente = [n]
+
+            def heap_push():
+                llegada = max(item[1] for item in heap) + 1
+                heappush(heap, (3, llegada, siguiente[0]))
+                siguiente[0] += 1
+
+            def heap_remove():
+                item = heap[random.randrange(len(heap))]
+                heap.remove(item)
+                heapify(heap)
+                heappush(heap, item)
+
+            def heap_rank():
+                objetivo = heap[random.randrange(len(heap))]
+                return sorted(heap).index(objetivo)
+
+            def heap_pop():
+                item = heappop(heap)
+                heappush(heap, (item[0], item[1] + n, item[2]))
+
+            resultados_heap = [
+                _cronometrar(heap_push, repeticiones),
+                _cronometrar(heap_pop, repeticiones),
+                _cronometrar(heap_remove, repeticiones),
+                _cronometrar(heap_rank, max(1, repeticiones // 10)),
+                _cronometrar(lambda: [aid for (_, _, aid) in sorted(heap)], max(1, repeticiones // 10)),
+            ]
+
+            cola = ColaEspera()
+            for i, p in enumerate(prioridades):
+                cola.push(i, p)
+            ids = list(range(n))
+
+            def cola_push():
+                cola.push(siguiente[0], 3)
+                ids.append(siguiente[0])
+                siguiente[0] += 1
+
+            def cola_pop():
+                _, _, aid = cola.pop()
+                cola.push(aid, 3)
+
+            def cola_remove():
+                aid = ids[random.randrange(len(ids))]
+                if cola.remove(aid):
+                    cola.push(aid, 3)
+
+            def cola_rank():
+                return cola.rank(ids[random.randrange(len(ids))])
+
+            resultados_cola = [
+                _cronometrar(cola_push, repeticiones),
+                _cronometrar(cola_pop, repeticiones),
+                _cronometrar(cola_remove, repeticiones),
+                _cronometrar(cola_rank, repeticiones),
+                _cronometrar(lambda: [aid for (_, _, aid) in cola], max(1, repeticiones // 10)),
+            ]
+
+            for nombre, resultados in (('heapq', resultados_heap), ('ColaEspera', resultados_cola)):
+                self.stdout.write(f'{n:>8} {nombre:>11} ' + ' '.join(f'{r:>9.1f}' for r in resultados[:4])
+                                  + f' {resultados[4]:>10.1f}')
+
+    def bench_difusion(self, options):
+        """CPU por evento difundido: codificar en cada consumidor contra codificar una vez."""
+        autos = [{
+            'id': i, 'nombre': f'Auto_{i}', 'velocidad': 60.0, 'tiempo_espera': 10.0,
+            'direccion': random.choice('NS'), 'prioridad': random.randint(1, 5), 'en_puente': False,
+            'llegada': i, 'vueltas': 1, 'vueltas_totales': 1, 'cruzadas': 0,
+        } for i in range(options['autos'])]
+        mensaje = {'type': 'estado_inicial', 'data': {
+            'version': 1, 'autos_en_puente': [], 'autos_esperando': autos, 'total_autos': len(autos)}}
+
+        async def difundir(n, codificar, una_vez):
+            capa = InMemoryChannelLayer(capacity=options['eventos'] + 1)
+            canales = [await capa.new_channel() for _ in range(n)]
+            for canal in canales:
+                await capa.group_add('bench', canal)
+            inicio = time.process_time()
+            for _ in range(options['eventos']):
+                if una_vez:
+                    await capa.group_send('bench', {'type': 'evento', 'texto': codificar(mensaje)})
+                else:
+                    await capa.group_send('bench', {'type': 'evento', 'mensaje': mensaje})
+                # Lo que hace el manejador de cada consumidor antes de self.send()
+                for canal in canales:
+                    _, recibido = capa.channels[canal].get_nowait()
+                    if not una_vez:
+                        codificar(recibido['mensaje'])
+            return (time.process_time() - inicio) / options['eventos'] * 1e3
+
+        self.stdout.write(f"Carga: estado con {len(autos)} autos, "
+                          f"{len(json.dumps(mensaje))} bytes")
+        self.stdout.write(f"{'sockets':>8} {'backend':>8} {'por socket':>11} {'una vez':>9}  (ms CPU/evento)")
+        for n in options['suscriptores']:
+            for nombre in ('json', 'orjson'):
+                codificar = obtener_backend(nombre)[0]
+                por_socket = asyncio.run(difundir(n, codificar, False))
+                una_vez = asyncio.run(difundir(n, codificar, True))
+                self.stdout.write(f'{n:>8} {nombre:>8} {por_socket:>11.2f} {una_vez:>9.2f}')
+
+    def bench_rafaga(self, options):
+        """Mensajes por segundo al grupo durante una ráfaga de registros."""
+
+        async def rafaga(hz):
+            capa = _CapaContadora()
+            difusor = DifusorPuente(capa, 'bench', hz=hz)
+            publicados = urgentes = 0
+            inicio = ultimo_cruce = time.monotonic()
+            while time.monotonic() < inicio + options['duracion']:
+                for _ in range(50):
+                    publicados += 1
+                    difusor.publicar({'type': 'auto_registrado', 'seq': publicados})
+                # Cinco cruces por segundo, que no esperan al siguiente envío
+                if time.monotonic() - ultimo_cruce >= 0.2:
+                    ultimo_cruce = time.monotonic()
+                    publicados += 1
+                    urgentes += 1
+                    difusor.publicar({'type': 'auto_cruzando', 'seq': publicados}, urgente=True)
+                await asyncio.sleep(0)
+            await difusor.vaciar()
+            segundos = [int(t - inicio) for t in capa.envios]
+            return publicados, urgentes, max(segundos.count(s) for s in set(segundos))
+
+        self.stdout.write(f"{'hz':>5} {'eventos/s':>10} {'urgentes/s':>11} {'mensajes/s máx':>15}")
+        for hz in options['hz']:
+            publicados, urgentes, maximo = asyncio.run(rafaga(hz))
+            self.stdout.write(f'{hz:>5} {publicados / options["duracion"]:>10.0f} '
+                              f'{urgentes / options["duracion"]:>11.0f} {maximo:>15}')
+
+    def bench_comandos(self, options):
+        """Throughput de solicitar_cruce/finalizar_cruce con muchos sockets en proceso."""
+        aplicacion = URLRouter(websocket_urlpatterns)
+
+        async def esperar(comunicador, condicion):
+            while True:
+                mensaje = await comunicador.receive_json_from(timeout=60)
+                for evento in mensaje.get('eventos', [mensaje]):
+                    if condicion(evento):
+                        return evento
+
+        async def cliente(i, listos, inicio_carga, totales):
+            comunicador = WebsocketCommunicator(aplicacion, '/ws/puente_app/')
+            await comunicador.connect()
+            nombre = f'bench_{i}'
+            await comunicador.send_json_to({'type': 'registrar_auto', 'auto': {
+                'nombre': nombre, 'prioridad': random.randint(1, 5), 'vueltas': 10 ** 6}})
+            evento = await esperar(comunicador, lambda e: e.get('type') == 'auto_registrado'
+                                   and e['auto']['nombre'] == nombre)
+            auto_id = evento['auto']['id']
+            # Todos los sockets registrados antes de empezar a medir
+            listos.append(auto_id)
+            if len(listos) == options['sockets']:
+                inicio_carga.set()
+            await inicio_carga.wait()
+            fin = time.monotonic() + options['duracion']
+            while time.monotonic() < fin:
+                inicio = time.perf_counter()
+                await comunicador.send_json_to({'type': 'solicitar_cruce', 'auto_id': auto_id})
+                respuesta = await esperar(comunicador, lambda e: e.get('type') == 'respuesta_cruce')
+                totales['latencias'].append(time.perf_counter() - inicio)
+                totales['comandos'] += 1
+                if respuesta['data']['permiso']:
+                    await comunicador.send_json_to({'type': 'finalizar_cruce', 'auto_id': auto_id})
+                    totales['comandos'] += 1
+                    totales['cruces'] += 1
+            await comunicador.disconnect()
+
+        async def carga():
+            totales = {'comandos': 0, 'cruces': 0, 'latencias': []}
+            listos, inicio_carga = [], asyncio.Event()
+            await asyncio.gather(*(cliente(i, listos, inicio_carga, totales) for i in range(options['sockets'])))
+            return totales
+
+        totales = asyncio.run(carga())
+        latencias = sorted(totales['latencias'])
+        duracion = options['duracion']
+        self.stdout.write(f"sockets: {options['sockets']}")
+        self.stdout.write(f"comandos/s: {totales['comandos'] / duracion:.0f}")
+        self.stdout.write(f"cruces/s: {totales['cruces'] / duracion:.0f}")
+        if latencias:
+            self.stdout.write(f"solicitar_cruce p50: {latencias[len(latencias) // 2] * 1e3:.1f} ms, "
+                              f"p99: {latencias[int(len(latencias) * 0.99)] * 1e3:.1f} ms")
+
+    def bench_lote(self, options):
+        """Registrar autos de a uno contra registrarlos en lotes por el WebSocket."""
+        aplicacion = URLRouter(websocket_urlpatterns)
+        total, tamano = options['total'], options['lote']
+        autos = [{'nombre': f'bench_{i}', 'prioridad': random.randint(1, 5)} for i in range(total)]
+
+        async def registrar(en_lote):
+            comunicador = WebsocketCommunicator(aplicacion, '/ws/puente_app/')
+            await comunicador.connect()
+            await comunicador.receive_json_from()
+            await comunicador.send_json_to({'type': 'resetear_sistema'})
+            await comunicador.receive_json_from()
+
+            inicio = time.perf_counter()
+            if en_lote:
+                for i in range(0, total, tamano):
+                    await comunicador.send_json_to({'type': 'registrar_autos', 'autos': autos[i:i + tamano]})
+            else:
+                for auto in autos:
+                    await comunicador.send_json_to({'type': 'registrar_auto', 'auto': auto})
+            # Hasta que el socket haya visto todos los autos en los deltas
+            mensajes = registrados = 0
+            while registrados < total:
+                mensaje = await comunicador.receive_json_from(timeout=60)
+                mensajes += 1
+                for evento in mensaje.get('eventos', [mensaje]):
+                    registrados += len(evento.get('autos', [])) + ('auto' in evento)
+            duracion = time.perf_counter() - inicio
+            await comunicador.disconnect()
+            return duracion, mensajes
+
+        self.stdout.write(f"{'modo':>12} {'segundos':>9} {'autos/s':>9} {'mensajes':>9}")
+        logging.getLogger('puente_app').setLevel(logging.WARNING)
+        for nombre, en_lote in ((f'1 x {total}', False), (f'{tamano} x {total // tamano}', True)):
+            duracion, mensajes = asyncio.run(registrar(en_lote))
+            self.stdout.write(f'{nombre:>12} {duracion:>9.2f} {total / duracion:>9.0f} {mensajes:>9}')
+
+    def bench_memoria(self, options):
+        """Bytes por auto: dict de 11 claves contra AutoPuente, con y sin su JSON guardado."""
+        self.stdout.write(f"{'autos':>8} {'dict':>10} {'AutoPuente':>12} {'+ JSON':>10}")
+        for n in options['tamanos']:
+            def con_dicts():
+                return {i: {
+                    'id': i, 'nombre': f'Auto_{i}', 'velocidad': 60.0 + i % 40,
+                    'tiempo_espera': 10.0, 'direccion': 'N', 'prioridad': i % 5 + 1,
+                    'en_puente': False, 'llegada': i, 'vueltas': 2,
+                    'vueltas_totales': 2, 'cruzadas': 0
+                } for i in range(n)}
+
+            def con_registros():
+                return {i: AutoPuente(
+                    id=i, nombre=f'Auto_{i}', velocidad=60.0 + i % 40,
+                    tiempo_espera=10.0, direccion='N', prioridad=i % 5 + 1,
+                    llegada=i, vueltas_totales=2
+                ) for i in range(n)}
+
+            def con_json():
+                autos = con_registros()
+                for auto in autos.values():
+                    auto.a_json()
+                return autos
+
+            resultados = []
+            for construir in (con_dicts, con_registros, con_json):
+                gc.collect()
+                tracemalloc.start()
+                autos = construir()
+                usado = tracemalloc.get_traced_memory()[0]
+                tracemalloc.stop()
+                del autos
+                resultados.append(usado / n)
+            self.stdout.write(f"{n:>8} {resultados[0]:>9.0f}B {resultados[1]:>11.0f}B {resultados[2]:>9.0f}B")
+
+    def bench_rest(self, options):
+        """Latencia de POST /api/finalizar-cruce/ según el largo de la cola, en una base de prueba."""
+        nombre_original = connection.settings_dict['NAME']
+        setup_test_environment()
+        connection.creation.create_test_db(verbosity=0)
+        try:
+            cliente = Client()
+            self.stdout.write(f"{'cola':>8} {'ms/cruce':>9} {'consultas':>10}")
+            for n in options['tamanos']:
+                Auto.objects.all().delete()
+                velocidades = [random.uniform(20, 60) for _ in range(n)]
+                Auto.objects.bulk_create(
+                    [Auto(direccion='N', velocidad=v, turno=i + 1, tiempo_cruce=calcular_tiempo_cruce(v),
+                          tiempo_espera=0) for i, v in enumerate(velocidades)],
+                    batch_size=1000
+                )
+                ColaDireccion.objects.update_or_create(direccion='N', defaults={
+                    'cantidad': n,
+                    'tiempo_total': sum(calcular_tiempo_cruce(v) for v in velocidades),
+                    'cabeza': Auto.objects.filter(direccion='N').order_by('turno').first(),
+                })
+                cruces = min(options['repeticiones'], n)
+                ids = list(Auto.objects.cola('N').values_list('id', flat=True)[:cruces])
+                with CaptureQueriesContext(connection) as consultas:
+                    inicio = time.perf_counter()
+                    for auto_id in ids:
+                        cliente.post('/api/finalizar-cruce/', {'auto_id': auto_id}, content_type='application/json')
+                    duracion = time.perf_counter() - inicio
+                self.stdout.write(f'{n:>8} {duracion / cruces * 1e3:>9.2f} {len(consultas) / cruces:>10.1f}')
+        finally:
+            connection.creation.destroy_test_db(nombre_original, verbosity=0)
+            teardown_test_environment()
+
+    def bench_turnos(self, options):
+        """Registros concurrentes desde varios procesos contra un archivo SQLite con la
+        configuración de settings: los turnos de cada dirección deben ser 1..n sin repetir."""
+        procesos, total = options['procesos'], options['total']
+        with tempfile.TemporaryDirectory() as directorio:
+            nombre_original = connection.settings_dict['NAME']
+            connection.close()
+            connection.settings_dict['NAME'] = os.path.join(directorio, 'turnos.sqlite3')
+            setup_test_environment()
+            try:
+                call_command('migrate', verbosity=0)
+                connection.close()  # los hijos abren su propia conexión
+                contexto = multiprocessing.get_context('fork')
+                por_proceso = [total // procesos + (i < total % procesos) for i in range(procesos)]
+                inicio = time.perf_counter()
+                with contexto.Pool(procesos) as pool:
+                    errores = sum(pool.map(_registrar_por_rest, por_proceso))
+                duracion = time.perf_counter() - inicio
+
+                self.stdout.write(f'{total} registros en {procesos} procesos: '
+                                  f'{duracion:.2f} s, {total / duracion:.0f} registros/s, {errores} errores')
+                colas = Auto.objects.values('direccion').annotate(
+                    cantidad=Count('id'), distintos=Count('turno', distinct=True),
+                    minimo=Min('turno'), maximo=Max('turno'))
+                fallas = []
+                for cola in colas:
+                    self.stdout.write(f"  {cola['direccion']}: {cola['cantidad']} autos, "
+                                      f"turnos {cola['minimo']}..{cola['maximo']}, {cola['distintos']} distintos")
+                    if not (cola['distintos'] == cola['cantidad'] == cola['maximo'] and cola['minimo'] == 1):
+                        fallas.append(cola['direccion'])
+                if errores or fallas:
+                    raise CommandError(f'Turnos repetidos o con huecos en {fallas or "-"}; {errores} registros fallidos')
+                self.stdout.write('Turnos únicos y sin huecos')
+            finally:
+                connection.close()
+                connection.settings_dict['NAME'] = nombre_original
+                teardown_test_environment()
+
+    def bench_async(self, options):
+        """Latencia de estado_colas y solicitar_cruce con muchos clientes concurrentes:
+        vistas async contra vistas síncronas llamadas como las llama Django bajo
+        ASGI (sync_to_async, todas en el mismo hilo)."""
+        nombre_original = connection.settings_dict['NAME']
+        setup_test_environment()
+        connection.creation.create_test_db(verbosity=0)
+        try:
+            for _ in range(options['autos']):
+                views._crear_auto(random.choice('NS'), 40.0, calcular_tiempo_cruce(40.0))
+            ids = list(Auto.objects.values_list('id', flat=True))
+            fabrica = AsyncRequestFactory()
+
+            async def cliente(vistas, latencias):
+                for i in range(options['peticiones']):
+                    if i % 2:
+                        peticion = fabrica.post('/api/solicitar-cruce/', {'auto_id': random.choice(ids)},
+                                                content_type='application/json')
+                    else:
+                        peticion = fabrica.get('/api/estado-colas/')
+                    inicio = time.perf_counter()
+                    await vistas[i % 2](peticion)
+                    latencias.append(time.perf_counter() - inicio)
+
+            async def carga(vistas):
+                latencias = []
+                inicio = time.perf_counter()
+                await asyncio.gather(*(cliente(vistas, latencias) for _ in range(options['clientes'])))
+                return time.perf_counter() - inicio, sorted(latencias)
+
+            sincronas = (sync_to_async(_estado_colas_sincrona), sync_to_async(_solicitar_cruce_sincrona))
+            asincronas = (views.estado_colas, views.solicitar_cruce)
+            self.stdout.write(f"{options['clientes']} clientes x {options['peticiones']} peticiones, "
+                              f"{len(ids)} autos en cola")
+            self.stdout.write(f"{'vistas':>8} {'pet/s':>8} {'p50 ms':>8} {'p99 ms':>8}")
+            for nombre, vistas in (('sync', sincronas), ('async', asincronas)):
+                duracion, latencias = asyncio.run(carga(vistas))
+                self.stdout.write(f'{nombre:>8} {len(latencias) / duracion:>8.0f} '
+                                  f'{latencias[len(latencias) // 2] * 1e3:>8.1f} '
+                                  f'{latencias[int(len(latencias) * 0.99)] * 1e3:>8.1f}')
+        finally:
+            connection.creation.destroy_test_db(nombre_original, verbosity=0)
+            teardown_test_environment()
+
+    def bench_recuperacion(self, options):
+        """Escribir --total comandos con EstadoPersistente y medir cuánto tarda un
+        proceso nuevo en reconstruir el estado desde la instantánea y el log."""
+        total, cada = options['total'], options['instantanea_cada']
+        logging.getLogger('puente_app').setLevel(logging.WARNING)
+
+        async def escribir(backend):
+            # Una cola estable de 1000 autos: cada ciclo registra uno y hace cruzar al primero
+            for _ in range(1000):
+                await backend.ejecutar('registrar_auto', ({'prioridad': random.randint(1, 5)},))
+            escritos = 1000
+            inicio = time.perf_counter()
+            while escritos < total:
+                await backend.ejecutar('registrar_auto', ({'prioridad': random.randint(1, 5)},))
+                primero = backend.motor.cola_espera.peek()
+                await backend.ejecutar('solicitar_cruce', (primero,))
+                await backend.ejecutar('finalizar_cruce', (primero,))
+                escritos += 3
+            await backend.vaciar()
+            return escritos, time.perf_counter() - inicio
+
+        async def recuperar(backend):
+            inicio = time.perf_counter()
+            await backend.ejecutar('obtener_version', ())
+            return time.perf_counter() - inicio
+
+        with tempfile.TemporaryDirectory() as directorio:
+            original = EstadoPersistente(directorio, instantanea_cada=cada)
+            escritos, duracion = asyncio.run(escribir(original))
+            self.stdout.write(f'{escritos} comandos escritos en {duracion:.1f} s '
+                              f'({escritos / duracion:.0f} comandos/s, instantánea cada {cada})')
+            for archivo in sorted(os.listdir(directorio)):
+                self.stdout.write(f'  {archivo}: {os.path.getsize(os.path.join(directorio, archivo)) / 1024:.0f} KiB')
+
+            recuperado = EstadoPersistente(directorio, instantanea_cada=cada)
+            segundos = asyncio.run(recuperar(recuperado))
+            self.stdout.write(f'Recuperación: {segundos * 1e3:.0f} ms, '
+                              f'{recuperado._desde_instantanea} comandos reaplicados desde el log')
+            if recuperado.motor.estado_json() != original.motor.estado_json():
+                raise CommandError('El estado recuperado no coincide con el original')
+            self.stdout.write('Estado recuperado idéntico al original')
+
+    def bench_filtros(self, options):
+        """Bytes que recibe cada socket por evento del puente según su suscripción:
+        todo, una dirección, un auto o solo el resumen."""
+        aplicacion = URLRouter(websocket_urlpatterns)
+        puente = 'bench_filtros'
+        filtros = {
+            'todo': None,
+            'dirección N': {'direcciones': ['N']},
+            'un auto': {'auto_ids': [1]},
+            'resumen': {'resumen': True},
+        }
+        logging.getLogger('puente_app').setLevel(logging.WARNING)
+
+        async def leer(comunicador, recibido):
+            while True:
+                texto = await comunicador.receive_from(timeout=3600)
+                recibido[0] += 1
+                recibido[1] += len(texto.encode('utf-8'))
+
+        async def medir():
+            bucle = obtener_bucle(puente)
+            await bucle.ejecutar('resetear_sistema')
+            sockets = {}
+            for nombre, filtro in filtros.items():
+                comunicador = WebsocketCommunicator(aplicacion, f'/ws/puente_app/{puente}/')
+                await comunicador.connect()
+                await comunicador.receive_from()
+                if filtro:
+                    await comunicador.send_json_to({'type': 'suscribir', **filtro})
+                    await comunicador.receive_from()
+                recibido = [0, 0]
+                sockets[nombre] = (comunicador, recibido, asyncio.create_task(leer(comunicador, recibido)))
+
+            # Registrar --autos de a uno y hacerlos cruzar hasta vaciar el puente
+            motor = bucle.backend.motor
+            version = motor.version
+            for _ in range(options['autos']):
+                await bucle.ejecutar('registrar_auto', {'direccion': random.choice('NS'), 'vueltas': 2,
+                                                        'prioridad': random.randint(1, 5)})
+            while motor.autos:
+                candidato = motor.planificador.candidato()
+                await bucle.ejecutar('solicitar_cruce', candidato)
+                await bucle.ejecutar('finalizar_cruce', candidato)
+            eventos = motor.version - version
+            await bucle.difusor.vaciar()
+            for difusor, _ in bucle._temas.values():
+                await difusor.vaciar()
+            await asyncio.sleep(0.2)
+
+            resultados = {}
+            for nombre, (comunicador, recibido, lector) in sockets.items():
+                lector.cancel()
+                await comunicador.disconnect()
+                resultados[nombre] = recibido
+            return eventos, resultados
+
+        eventos, resultados = asyncio.run(medir())
+        total = resultados['todo'][1]
+        self.stdout.write(f"{options['autos']} autos, {eventos} eventos del puente")
+        self.stdout.write(f"{'filtro':>12} {'mensajes':>9} {'KiB':>8} {'bytes/evento':>13} {'vs todo':>8}")
+        for nombre, (mensajes, bytes_) in resultados.items():
+            self.stdout.write(f'{nombre:>12} {mensajes:>9} {bytes_ / 1024:>8.1f} {bytes_ / eventos:>13.1f} '
+                              f'{bytes_ / total:>8.1%}')
+
+    def bench_lentos(self, options):
+        """Clientes rápidos junto a unos pocos lentos (--procesos) que leen 20 mensajes
+        por segundo, con y sin 'confirmar': lo que los lentos tienen sin leer,
+        demora de los rápidos y sockets cerrados con 4302.
+
+        Como con daphne, self.send() no espera al cliente: lo no leído se acumula
+        del lado del transporte (aquí, la cola de salida del comunicador)."""
+        aplicacion = URLRouter(websocket_urlpatterns)
+        logging.getLogger('puente_app').setLevel(logging.ERROR)  # sin el aviso de cada cierre
+
+        async def leer(comunicador, visto, publicados, demoras, demora, confirmar):
+            confirmado, leidos = time.perf_counter(), 0  # como Confirmador en estado_puente.js
+            while True:
+                mensaje = await comunicador.receive_output(timeout=3600)
+                if mensaje['type'] == 'websocket.close':
+                    return
+                ahora = time.perf_counter()
+                evento = json.loads(mensaje['text'])
+                visto[1] += len(mensaje['text'])
+                for delta in evento.get('eventos', [evento]):
+                    if 'seq' in delta:
+                        visto[0] = delta['seq']
+                        if demoras is not None:
+                            demoras.append(ahora - publicados[delta['seq']])
+                leidos += 1
+                if confirmar and (leidos >= 100 or ahora - confirmado >= 0.25):
+                    await comunicador.send_to(text_data=json.dumps({'type': 'confirmar', 'seq': visto[0]}))
+                    confirmado, leidos = ahora, 0
+                if demora:
+                    await asyncio.sleep(demora)
+
+        async def carga(puente, confirmar):
+            bucle = obtener_bucle(puente)
+            motor = bucle.backend.motor
+            publicados, rapidas, lectores, comunicadores, lentos = {}, [], [], [], []
+            atrasados = metricas.ATRASADOS._valores[()]
+            for i in range(options['sockets'] + options['procesos']):
+                lento = i >= options['sockets']
+                comunicador = WebsocketCommunicator(aplicacion, f'/ws/puente_app/{puente}/')
+                await comunicador.connect()
+                await comunicador.receive_from()
+                visto = [motor.version, 0]  # último seq leído y caracteres
+                if lento:
+                    lentos.append(comunicador)
+                comunicadores.append(comunicador)
+                lectores.append(asyncio.create_task(leer(
+                    comunicador, visto, publicados, None if lento else rapidas,
+                    0.05 if lento else 0, confirmar)))
+
+            sin_leer = 0
+            fin = time.perf_counter() + options['duracion']
+            while time.perf_counter() < fin:
+                for _ in range(options['lote']):
+                    await bucle.ejecutar('registrar_auto', {'prioridad': random.randint(1, 5)})
+                    publicados[motor.version] = time.perf_counter()
+                await asyncio.sleep(0.01)
+                # Lo enviado que el cliente todavía no leyó: con daphne, el buffer del transporte
+                sin_leer = max([sin_leer] + [comunicador.output_queue.qsize() for comunicador in lentos])
+            await asyncio.sleep(0.5)
+            for lector in lectores:
+                lector.cancel()
+            for comunicador in comunicadores:
+                await comunicador.disconnect()
+            # El lento ve el cierre recién al terminar de leer lo acumulado: se cuenta en el servidor
+            return len(publicados), sorted(rapidas), sin_leer, metricas.ATRASADOS._valores[()] - atrasados
+
+        self.stdout.write(f"{options['sockets']} sockets rápidos, {options['procesos']} lentos "
+                          f"(20 mensajes/s), un mensaje por evento, tope de 1000 mensajes")
+        self.stdout.write(f"{'clientes':>15} {'eventos':>8} {'sin leer máx':>13} "
+                          f"{'p50 ms':>7} {'p99 ms':>7} {'cierres 4302':>13}")
+        with override_settings(PUENTE_SALIDA_MAX_MENSAJES=1000, PUENTE_SALIDA_MAX_BYTES=10 ** 12,
+                               PUENTE_BROADCAST_HZ=0):
+            for nombre, confirmar in (('sin confirmar', False), ('confirmando', True)):
+                eventos, rapidas, sin_leer, cierres = asyncio.run(carga(f'bench_lentos_{confirmar}', confirmar))
+                self.stdout.write(f'{nombre:>15} {eventos:>8} {sin_leer:>13} '
+                                  f'{rapidas[len(rapidas) // 2] * 1e3:>7.1f} '
+                                  f'{rapidas[int(len(rapidas) * 0.99)] * 1e3:>7.1f} {cierres:>13}')
+
+    def bench_tormenta(self, options):
+        """CPU de --sockets conexiones simultáneas según el largo de la cola: con el
+        snapshot compartido por versión contra armarlo y codificarlo en cada conexión."""
+        aplicacion = URLRouter(websocket_urlpatterns)
+        logging.getLogger('puente_app').setLevel(logging.WARNING)
+
+        async def tormenta(puente, tamano, compartido):
+            bucle = obtener_bucle(puente)
+            motor = bucle.backend.motor
+            for i in range(0, tamano, 1000):
+                await bucle.ejecutar('registrar_autos', [{'prioridad': random.randint(1, 5)}
+                                                         for _ in range(min(1000, tamano - i))])
+            if not compartido:
+                async def por_conexion():
+                    # Como antes: un comando y un snapshot nuevo por cada socket
+                    motor._estado_json = None
+                    texto = await bucle.ejecutar('estado_json')
+                    return '{"type": "estado_inicial", "data": ' + texto + ', "cruce_automatico": false}'
+                bucle.mensaje_estado_inicial = por_conexion
+
+            async def conectar():
+                comunicador = WebsocketCommunicator(aplicacion, f'/ws/puente_app/{puente}/')
+                await comunicador.connect(timeout=600)
+                await comunicador.receive_from(timeout=600)
+                return comunicador
+
+            gc.collect()
+            cpu, inicio = time.process_time(), time.perf_counter()
+            comunicadores = await asyncio.gather(*(conectar() for _ in range(options['sockets'])))
+            cpu, duracion = time.process_time() - cpu, time.perf_counter() - inicio
+            await asyncio.gather(*(comunicador.disconnect() for comunicador in comunicadores))
+            # La capa en memoria recorre todos sus canales en cada receive: que la
+            # corrida siguiente no pague los que quedaron de esta
+            await get_channel_layer().flush()
+            return cpu, duracion
+
+        self.stdout.write(f"{options['sockets']} conexiones simultáneas")
+        self.stdout.write(f"{'cola':>8} {'snapshot':>14} {'CPU s':>7} {'ms/conexión':>12} {'segundos':>9}")
+        with override_settings(PUENTE_CONEXIONES_POR_SEGUNDO=0):
+            for tamano in options['tamanos']:
+                for nombre, compartido in (('por conexión', False), ('compartido', True)):
+                    cpu, duracion = asyncio.run(tormenta(f'bench_tormenta_{tamano}_{compartido}', tamano,
+                                                         compartido))
+                    self.stdout.write(f'{tamano:>8} {nombre:>14} {cpu:>7.2f} '
+                                      f'{cpu / options["sockets"] * 1e3:>12.2f} {duracion:>9.2f}')
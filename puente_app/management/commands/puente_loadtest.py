@@ -0,0 +1,339 @@
+import asyncio
+import contextlib
+import json
+import logging
+import random
+import time
+
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from puente_app.routing import websocket_urlpatterns
+from puente_app.simulador import percentil
+
+OPERACIONES = ('registrar', 'solicitar', 'finalizar')
+
+
+class _ConexionInterna:
+    """Socket en el mismo proceso, contra la aplicación ASGI con WebsocketCommunicator."""
+
+    def __init__(self, aplicacion, ruta):
+        self.comunicador = WebsocketCommunicator(aplicacion, ruta)
+
+    async def abrir(self):
+        conectado, _ = await self.comunicador.connect(timeout=30)
+        if not conectado:
+            raise ConnectionError('El consumidor rechazó la conexión')
+
+    async def enviar(self, texto):
+        await self.comunicador.send_to(text_data=texto)
+
+    async def recibir(self):
+        return await self.comunicador.receive_from(timeout=3600)
+
+    async def cerrar(self):
+        await self.comunicador.disconnect()
+
+
+class _ConexionRed:
+    """Socket real contra un servidor en marcha. Necesita el paquete websockets."""
+
+    def __init__(self, url):
+        self.url = url
+        self.socket = None
+
+    async def abrir(self):
+        try:
+            import websockets
+        except ImportError:
+            raise CommandError('Para --url hace falta instalar el paquete websockets')
+        self.socket = await websockets.connect(self.url, max_queue=None)
+
+    async def enviar(self, texto):
+        await self.socket.send(texto)
+
+    async def recibir(self):
+        return await self.socket.recv()
+
+    async def cerrar(self):
+        await self.socket.close()
+
+
+class _Medicion:
+    """Muestras compartidas por todos los clientes de una corrida."""
+
+    def __init__(self):
+        self.latencias = {op: [] for op in OPERACIONES}
+        self.errores = {op: 0 for op in OPERACIONES}
+        self.conexion = []
+        self.difusion = []  # envío del comando → llegada del delta a cada socket
+        self.enviados = {}  # clave del delta esperado: instante en que se envió su comando
+        self.mensajes = 0
+        self.comandos = 0
+        self.huecos = 0  # saltos en el seq vistos por algún socket
+        self.midiendo = False
+
+
+class _Cliente:
+    """Un socket que manda comandos de a uno y espera el efecto de cada uno.
+
+    El lector atiende todos los mensajes del socket: anota las demoras de
+    difusión y despierta al comando que espera una respuesta o un delta.
+    """
+
+    def __init__(self, numero, conexion, medicion, azar, timeout, puente=None):
+        self.numero = numero
+        self.puente = puente
+        self.conexion = conexion
+        self.medicion = medicion
+        self.azar = azar
+        self.timeout = timeout
+        self.auto_id = None
+        self.en_puente = False
+        self.registrados = 0
+        self.ultimo_seq = None
+        self._esperando = None  # (condicion, futuro)
+        self._lector = None
+
+    def _clave(self, evento):
+        # Con varios puentes los ids de auto se repiten: la clave lleva el puente
+        tipo = evento.get('type')
+        if tipo == 'auto_registrado':
+            return evento['auto']['nombre']
+        if tipo == 'auto_cruzando':
+            return ('cruce', self.puente, evento['auto']['id'])
+        if tipo in ('auto_regreso_cola', 'auto_salio'):
+            return ('fin', self.puente, evento['auto']['id'])
+        return None
+
+    def _atender(self, evento, ahora):
+        medicion = self.medicion
+        seq = evento.get('seq')
+        if seq is not None:
+            if self.ultimo_seq is not None and seq > self.ultimo_seq + 1:
+                medicion.huecos += 1
+            self.ultimo_seq = max(seq, self.ultimo_seq or 0)
+            enviado = medicion.enviados.get(self._clave(evento))
+            if enviado is not None and medicion.midiendo:
+                medicion.difusion.append(ahora - enviado)
+        elif evento.get('type') == 'estado_inicial':
+            self.ultimo_seq = evento['data']['version']
+
+        if self._esperando is not None:
+            condicion, futuro = self._esperando
+            if not futuro.done() and condicion(evento):
+                futuro.set_result(evento)
+
+    async def _leer(self):
+        while True:
+            texto = await self.conexion.recibir()
+            ahora = time.perf_counter()
+            self.medicion.mensajes += self.medicion.midiendo
+            mensaje = json.loads(texto)
+            for evento in mensaje.get('eventos', [mensaje]):
+                self._atender(evento, ahora)
+
+    async def abrir(self):
+        inicio = time.perf_counter()
+        await self.conexion.abrir()
+        self.medicion.conexion.append(time.perf_counter() - inicio)
+        self._lector = asyncio.create_task(self._leer())
+
+    async def cerrar(self):
+        if self._lector:
+            self._lector.cancel()
+            with contextlib.suppress(asyncio.CancelledError, Exception):
+                await self._lector
+        await self.conexion.cerrar()
+
+    async def _comando(self, operacion, mensaje, condicion, clave=None):
+        """Enviar un comando y esperar el evento que cumple `condicion`."""
+        futuro = asyncio.get_running_loop().create_future()
+        self._esperando = (condicion, futuro)
+        inicio = time.perf_counter()
+        if clave is not None:
+            self.medicion.enviados[clave] = inicio
+        await self.conexion.enviar(json.dumps(mensaje))
+        try:
+            evento = await asyncio.wait_for(futuro, self.timeout)
+        except asyncio.TimeoutError:
+            if self.medicion.midiendo:
+                self.medicion.errores[operacion] += 1
+            return None
+        finally:
+            self._esperando = None
+        if self.medicion.midiendo:
+            self.medicion.latencias[operacion].append(time.perf_counter() - inicio)
+            self.medicion.comandos += 1
+        return evento
+
+    async def registrar(self, principal=False):
+        # El auto principal del socket cruza indefinidamente; los extra tienen
+        # la prioridad más baja y nunca piden cruzar, así no bloquean la cola
+        self.registrados += 1
+        nombre = f'carga_{self.numero}_{self.registrados}'
+        auto = {'nombre': nombre, 'prioridad': self.azar.randint(1, 4), 'vueltas': 10 ** 6} if principal \
+            else {'nombre': nombre, 'prioridad': 5}
+        evento = await self._comando(
+            'registrar', {'type': 'registrar_auto', 'auto': auto},
+            lambda e: e.get('type') == 'auto_registrado' and e['auto']['nombre'] == nombre, nombre
+        )
+        if principal and evento is not None:
+            self.auto_id = evento['auto']['id']
+        return evento
+
+    async def solicitar(self):
+        auto_id = self.auto_id
+        evento = await self._comando(
+            'solicitar', {'type': 'solicitar_cruce', 'auto_id': auto_id},
+            lambda e: e.get('type') == 'respuesta_cruce' and e['data'].get('auto_id') == auto_id,
+            ('cruce', self.puente, auto_id)
+        )
+        self.en_puente = bool(evento and evento['data']['permiso'])
+
+    async def finalizar(self):
+        auto_id = self.auto_id
+        await self._comando(
+            'finalizar', {'type': 'finalizar_cruce', 'auto_id': auto_id},
+            lambda e: e.get('type') in ('auto_regreso_cola', 'auto_salio') and e['auto']['id'] == auto_id,
+            ('fin', self.puente, auto_id)
+        )
+        self.en_puente = False
+
+    async def correr(self, fin, proporcion_registrar, pausa):
+        while time.perf_counter() < fin:
+            # Como app.js: quien obtuvo el puente lo libera antes de otra cosa
+            if self.en_puente:
+                await self.finalizar()
+            elif self.azar.random() < proporcion_registrar:
+                await self.registrar()
+            else:
+                await self.solicitar()
+            if pausa:
+                await asyncio.sleep(pausa)
+        if self.en_puente:
+            await self.finalizar()
+
+
+def _leer_mezcla(valores):
+    pesos = {}
+    for valor in valores:
+        operacion, _, peso = valor.partition('=')
+        if operacion not in ('registrar', 'solicitar'):
+            raise CommandError(f'Operación desconocida en --mezcla: {operacion} '
+                               '(finalizar_cruce se envía tras cada cruce concedido)')
+        try:
+            pesos[operacion] = float(peso)
+        except ValueError:
+            raise CommandError(f'Peso inválido en --mezcla: {valor}')
+    total = pesos.get('registrar', 0) + pesos.get('solicitar', 0)
+    if total <= 0:
+        raise CommandError('La mezcla necesita algún peso positivo')
+    return pesos.get('registrar', 0) / total
+
+
+def _resumir(muestras):
+    ordenadas = sorted(muestras)
+    return {
+        'n': len(ordenadas),
+        'p50_ms': percentil(ordenadas, 50) * 1e3,
+        'p95_ms': percentil(ordenadas, 95) * 1e3,
+        'p99_ms': percentil(ordenadas, 99) * 1e3,
+        'max_ms': (ordenadas[-1] if ordenadas else 0.0) * 1e3,
+    }
+
+
+class Command(BaseCommand):
+    help = 'Prueba de carga del WebSocket del puente: latencias, demora de difusión y mensajes/s'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clientes', type=int, default=200, help='Sockets concurrentes')
+        parser.add_argument('--duracion', type=float, default=10.0, help='Segundos de carga medida')
+        parser.add_argument('--mezcla', nargs='+', default=['registrar=1', 'solicitar=9'],
+                            help='Pesos de registrar_auto y solicitar_cruce; finalizar_cruce sigue '
+                                 'a cada cruce concedido')
+        parser.add_argument('--pausa', type=float, default=0.0,
+                            help='Segundos que espera cada cliente entre comandos')
+        parser.add_argument('--timeout', type=float, default=30.0, help='Segundos máximos por comando')
+        parser.add_argument('--url', default=None,
+                            help='ws://host:puerto/ws/puente_app/ de un servidor en marcha; '
+                                 'sin --url se prueba la aplicación en este proceso')
+        parser.add_argument('--puentes', type=int, default=1,
+                            help='Repartir los clientes entre N puentes (carga0, carga1, ...); '
+                                 'con 1 se usa el puente principal')
+        parser.add_argument('--salida', default=None, help='Archivo donde guardar el JSON')
+        parser.add_argument('--semilla', type=int, default=0)
+
+    def handle(self, *args, **options):
+        proporcion_registrar = _leer_mezcla(options['mezcla'])
+        if options['puentes'] < 1:
+            raise CommandError('--puentes debe ser al menos 1')
+        if options['verbosity'] < 2:
+            # En proceso, el registro de cada comando entraría en la medición
+            logging.getLogger('puente_app').setLevel(logging.WARNING)
+        permitidos = getattr(settings, 'PUENTES_PERMITIDOS', None)
+        if not options['url'] and permitidos is not None:
+            # En proceso los puentes carga0, carga1, ... se abren aquí mismo
+            permitidos = [*permitidos, *(f'carga{i}' for i in range(options['puentes']))]
+        with override_settings(PUENTES_PERMITIDOS=permitidos):
+            resultado = asyncio.run(self._carga(options, proporcion_registrar))
+
+        texto = json.dumps(resultado, indent=2)
+        if options['salida']:
+            with open(options['salida'], 'w') as archivo:
+                archivo.write(texto + '\n')
+        self.stdout.write(texto)
+
+    def _puente(self, numero, options):
+        return f"carga{numero % options['puentes']}" if options['puentes'] > 1 else None
+
+    def _conexion(self, puente, options):
+        sufijo = f'{puente}/' if puente else ''
+        if options['url']:
+            return _ConexionRed(options['url'].rstrip('/') + '/' + sufijo)
+        return _ConexionInterna(self._aplicacion, '/ws/puente_app/' + sufijo)
+
+    async def _carga(self, options, proporcion_registrar):
+        self._aplicacion = URLRouter(websocket_urlpatterns)
+        medicion = _Medicion()
+        azar = random.Random(options['semilla'])
+        clientes = []
+        for i in range(options['clientes']):
+            puente = self._puente(i, options)
+            clientes.append(_Cliente(i, self._conexion(puente, options), medicion,
+                                     random.Random(azar.random()), options['timeout'], puente))
+
+        # Preparación sin medir: todos conectados y con su auto antes de la carga
+        await asyncio.gather(*(cliente.abrir() for cliente in clientes))
+        await asyncio.gather(*(cliente.registrar(principal=True) for cliente in clientes))
+        activos = [cliente for cliente in clientes if cliente.auto_id is not None]
+
+        medicion.midiendo = True
+        inicio = time.perf_counter()
+        await asyncio.gather(*(
+            cliente.correr(inicio + options['duracion'], proporcion_registrar, options['pausa'])
+            for cliente in activos
+        ))
+        duracion = time.perf_counter() - inicio
+        medicion.midiendo = False
+        await asyncio.gather(*(cliente.cerrar() for cliente in clientes))
+
+        return {
+            'modo': options['url'] or 'en proceso',
+            'clientes': len(clientes),
+            'clientes_activos': len(activos),
+            'puentes': options['puentes'],
+            'duracion_s': duracion,
+            'mezcla': {'registrar': proporcion_registrar, 'solicitar': 1 - proporcion_registrar},
+            'pausa_s': options['pausa'],
+            'comandos_por_segundo': medicion.comandos / duracion,
+            'mensajes_por_segundo': medicion.mensajes / duracion,
+            'conexion': _resumir(medicion.conexion),
+            'ida_y_vuelta': {op: _resumir(muestras) for op, muestras in medicion.latencias.items()},
+            'errores': medicion.errores,
+            'difusion': _resumir(medicion.difusion),
+            'huecos_de_secuencia': medicion.huecos,
+        }
@@ -0,0 +1,71 @@
+import json
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+
+from puente_app.planificador import LotesAlternados
+from puente_app.simulador import SimuladorPuente
+
+
+class Command(BaseCommand):
+    help = 'Simular el tráfico del puente en tiempo simulado y comparar políticas de cruce'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--politicas', nargs='+', default=['PrioridadEstricta', 'LotesAlternados'],
+                            help='Clases de puente_app.planificador (o rutas completas) a comparar')
+        parser.add_argument('--tasa', type=float, nargs='+', default=[1.0, 2.0],
+                            help='Autos que llegan por minuto')
+        parser.add_argument('--duracion', type=float, default=2 * 3600, help='Segundos simulados')
+        parser.add_argument('--capacidad', type=int, default=1, help='Autos del mismo sentido a la vez')
+        parser.add_argument('--lote', type=int, default=5, help='Autos por lote en LotesAlternados')
+        parser.add_argument('--envejecimiento', type=int, default=None,
+                            help='Cruces de espera para ganar un nivel de prioridad')
+        parser.add_argument('--fraccion-norte', type=float, default=0.5)
+        parser.add_argument('--vueltas', type=int, nargs=2, default=[1, 3], metavar=('MIN', 'MAX'))
+        parser.add_argument('--semilla', type=int, default=0)
+        parser.add_argument('--cruce-automatico', action='store_true',
+                            help='El servidor admite y termina los cruces (PUENTE_CRUCE_AUTOMATICO), sin sondeos')
+        parser.add_argument('--json', action='store_true', help='Imprimir los resúmenes como JSON')
+
+    def _config(self, politica, options):
+        ruta = politica if '.' in politica else f'puente_app.planificador.{politica}'
+        try:
+            clase = import_string(ruta)
+        except ImportError as e:
+            raise CommandError(f'Política desconocida: {politica} ({e})')
+        opciones = {'capacidad': options['capacidad'], 'envejecimiento': options['envejecimiento']}
+        if issubclass(clase, LotesAlternados):
+            opciones['lote'] = options['lote']
+        return {'BACKEND': ruta, 'OPTIONS': opciones}
+
+    def handle(self, *args, **options):
+        if options['verbosity'] < 2:
+            # El registro de cada cruce simulado costaría más que el cruce
+            logging.getLogger('puente_app').setLevel(logging.WARNING)
+        resultados = []
+        for tasa in options['tasa']:
+            for politica in options['politicas']:
+                # Misma semilla para todas las políticas: el mismo tráfico de llegada
+                simulador = SimuladorPuente(
+                    tasa=tasa, duracion=options['duracion'], planificador=self._config(politica, options),
+                    semilla=options['semilla'], fraccion_norte=options['fraccion_norte'],
+                    vueltas=tuple(options['vueltas']), cruce_automatico=options['cruce_automatico']
+                )
+                resultados.append({'tasa': tasa, **simulador.ejecutar()})
+
+        if options['json']:
+            self.stdout.write(json.dumps(resultados, indent=2))
+            return
+
+        self.stdout.write(f"{'tasa':>5} {'política':>18} {'autos/h':>8} {'ocup.':>6} {'cola':>6} "
+                          f"{'máx':>5} {'p50':>7} {'p90':>7} {'p99':>7} {'equidad':>8} {'eventos/s':>10}")
+        for r in resultados:
+            espera, politica = r['espera'], r['politica']
+            self.stdout.write(
+                f"{r['tasa']:>5g} {politica['politica']:>18} {r['autos_por_hora']:>8.1f} "
+                f"{r['ocupacion']:>6.0%} {r['cola_media']:>6.1f} {r['cola_maxima']:>5} "
+                f"{espera['p50']:>7.0f} {espera['p90']:>7.0f} {espera['p99']:>7.0f} "
+                f"{politica['equidad']:>8.2f} {r['eventos_por_segundo']:>10.0f}"
+            )
+        self.stdout.write('(esperas en segundos simulados, desde que el auto entra a la cola hasta que cruza)')
@@ -0,0 +1,139 @@
+import functools
+import threading
+import time
+from bisect import bisect_left
+
+# Segundos: de medio milisegundo a 5 s
+LIMITES_LATENCIA = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_registro = []
+
+
+def _etiquetas(nombres, valores):
+    if not nombres:
+        return ''
+    pares = ','.join(f'{n}="{v}"' for n, v in zip(nombres, valores))
+    return '{' + pares + '}'
+
+
+class _Metrica:
+    tipo = None
+
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._valores = {}  # tupla de valores de etiquetas: valor
+        self._lock = threading.Lock()  # las vistas síncronas corren en otros hilos
+        if not self.etiquetas:
+            self._valores[()] = self._vacio()
+        _registro.append(self)
+
+    def _vacio(self):
+        return 0
+
+    def exportar(self):
+        lineas = [f'# HELP {self.nombre} {self.ayuda}', f'# TYPE {self.nombre} {self.tipo}']
+        with self._lock:
+            valores = list(self._valores.items())
+        for etiquetas, valor in sorted(valores):
+            lineas.extend(self._lineas(etiquetas, valor))
+        return lineas
+
+    def _lineas(self, etiquetas, valor):
+        return [f'{self.nombre}{_etiquetas(self.etiquetas, etiquetas)} {valor}']
+
+
+class Contador(_Metrica):
+    tipo = 'counter'
+
+    def inc(self, *etiquetas, cantidad=1):
+        with self._lock:
+            self._valores[etiquetas] = self._valores.get(etiquetas, 0) + cantidad
+
+
+class Indicador(_Metrica):
+    tipo = 'gauge'
+
+    def set(self, valor, *etiquetas):
+        with self._lock:
+            self._valores[etiquetas] = valor
+
+    def inc(self, *etiquetas, cantidad=1):
+        with self._lock:
+            self._valores[etiquetas] = self._valores.get(etiquetas, 0) + cantidad
+
+    def dec(self, *etiquetas, cantidad=1):
+        self.inc(*etiquetas, cantidad=-cantidad)
+
+
+class Histograma(_Metrica):
+    tipo = 'histogram'
+
+    def __init__(self, nombre, ayuda, etiquetas=(), limites=LIMITES_LATENCIA):
+        self.limites = tuple(limites)
+        super().__init__(nombre, ayuda, etiquetas)
+
+    def _vacio(self):
+        # Cuentas por cubeta (la última es +Inf), suma y cantidad
+        return [[0] * (len(self.limites) + 1), 0.0, 0]
+
+    def observar(self, valor, *etiquetas):
+        with self._lock:
+            datos = self._valores.get(etiquetas)
+            if datos is None:
+                datos = self._valores[etiquetas] = self._vacio()
+            datos[0][bisect_left(self.limites, valor)] += 1
+            datos[1] += valor
+            datos[2] += 1
+
+    def _lineas(self, etiquetas, datos):
+        cubetas, suma, cantidad = datos
+        lineas, acumulado = [], 0
+        for limite, n in zip(self.limites + ('+Inf',), cubetas):
+            acumulado += n
+            le = _etiquetas(self.etiquetas + ('le',), etiquetas + (limite,))
+            lineas.append(f'{self.nombre}_bucket{le} {acumulado}')
+        sufijo = _etiquetas(self.etiquetas, etiquetas)
+        lineas.append(f'{self.nombre}_sum{sufijo} {suma}')
+        lineas.append(f'{self.nombre}_count{sufijo} {cantidad}')
+        return lineas
+
+
+def exportar():
+    """Todas las métricas en el formato de texto de Prometheus 0.0.4.
+
+    Son las de este proceso: con varios workers cada uno expone las suyas.
+    """
+    lineas = []
+    for metrica in _registro:
+        lineas.extend(metrica.exportar())
+    return '\n'.join(lineas) + '\n'
+
+
+def medir_vista(vista):
+    """Decorador de vistas async: observa su duración en VISTAS."""
+    @functools.wraps(vista)
+    async def envoltura(request, *args, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            return await vista(request, *args, **kwargs)
+        finally:
+            VISTAS.observar(time.perf_counter() - inicio, vista.__name__)
+    return envoltura
+
+
+MENSAJES = Contador('puente_mensajes_total', 'Mensajes WebSocket recibidos por tipo', ['tipo'])
+MANEJADOR = Histograma('puente_manejador_segundos', 'Tiempo de atención de un mensaje WebSocket', ['tipo'])
+ESPERA_COMANDO = Histograma('puente_comando_espera_segundos',
+                            'Tiempo que un comando espera su turno en el bucle del puente')
+COMANDO = Histograma('puente_comando_segundos', 'Tiempo de ejecución de un comando del motor', ['comando'])
+GROUP_SEND = Histograma('puente_group_send_segundos', 'Duración de group_send de los deltas al grupo')
+VISTAS = Histograma('puente_vista_segundos', 'Duración de las vistas de la API REST', ['vista'])
+SOCKETS = Indicador('puente_sockets_conectados', 'WebSockets conectados a este proceso')
+ATRASADOS = Contador('puente_sockets_atrasados_total',
+                     'WebSockets desconectados por superar el tope de su cola de salida')
+REEMPLAZADOS = Contador('puente_salida_reemplazados_total',
+                        'Resúmenes pendientes reemplazados por uno más nuevo antes de salir')
+COLA = Indicador('puente_cola_autos', 'Autos esperando en la cola del puente', ['puente'])
+EN_PUENTE = Indicador('puente_autos_en_puente', 'Autos cruzando el puente', ['puente'])
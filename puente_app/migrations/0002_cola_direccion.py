@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def llenar_colas(apps, schema_editor):
+    Auto = apps.get_model('puente_app', 'Auto')
+    ColaDireccion = apps.get_model('puente_app', 'ColaDireccion')
+    for direccion in ('N', 'S'):
+        cola = Auto.objects.filter(direccion=direccion)
+        resumen = cola.aggregate(cantidad=Count('id'), tiempo_total=Sum('tiempo_cruce'))
+        ColaDireccion.objects.create(
+            direccion=direccion,
+            cantidad=resumen['cantidad'],
+            tiempo_total=resumen['tiempo_total'] or 0,
+            cabeza=cola.order_by('turno').first(),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('puente_app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ColaDireccion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('direccion', models.CharField(choices=[('N', 'Norte a Sur'), ('S', 'Sur a Norte')], max_length=1, unique=True)),
+                ('cantidad', models.PositiveIntegerField(default=0)),
+                ('tiempo_total', models.FloatField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='auto',
+            index=models.Index(fields=['direccion', 'turno'], name='auto_direccion_turno_idx'),
+        ),
+        migrations.AddField(
+            model_name='coladireccion',
+            name='cabeza',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='puente_app.auto'),
+        ),
+        migrations.RunPython(llenar_colas, migrations.RunPython.noop),
+    ]
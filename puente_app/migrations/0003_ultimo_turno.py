@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:05
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def llenar_ultimo_turno(apps, schema_editor):
+    Auto = apps.get_model('puente_app', 'Auto')
+    ColaDireccion = apps.get_model('puente_app', 'ColaDireccion')
+    for cola in ColaDireccion.objects.all():
+        ultimo = Auto.objects.filter(direccion=cola.direccion).aggregate(ultimo=Max('turno'))['ultimo']
+        cola.ultimo_turno = ultimo or 0
+        cola.save(update_fields=['ultimo_turno'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('puente_app', '0002_cola_direccion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='coladireccion',
+            name='ultimo_turno',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(llenar_ultimo_turno, migrations.RunPython.noop),
+    ]
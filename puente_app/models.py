@@ -1,8 +1,31 @@
 from django.db import models
+from django.db.models import F, Sum, Value, Window
+from django.db.models.functions import Coalesce, RowNumber
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
 import random
 
 # Create your models here.
 
+class AutoQuerySet(models.QuerySet):
+    def colas(self):
+        """Las colas de ambas direcciones en una consulta, ordenadas por dirección y
+        turno, con la posición (desde 1) y el tiempo de espera de cada auto en su
+        cola calculados por la base de datos."""
+        ventana = {'partition_by': F('direccion'), 'order_by': F('turno').asc()}
+        return self.annotate(
+            posicion=Window(RowNumber(), **ventana),
+            espera=Coalesce(
+                Window(Sum('tiempo_cruce'), frame=models.RowRange(start=None, end=-1), **ventana),
+                Value(0.0)
+            ),
+        ).order_by('direccion', 'turno')
+
+    def cola(self, direccion):
+        """La cola de una sola dirección, como colas()."""
+        return self.filter(direccion=direccion).colas()
+
+
 class Auto(models.Model):
     DIRECCIONES = [
         ('N', 'Norte a Sur'),
@@ -10,10 +33,89 @@ class Auto(models.Model):
     ]
     direccion = models.CharField(max_length=1, choices=DIRECCIONES)
     velocidad = models.FloatField()  # km/h
-    turno = models.PositiveIntegerField()
+    turno = models.PositiveIntegerField()  # orden de llegada en su dirección; no se renumera
     tiempo_cruce = models.FloatField()  # segundos
-    tiempo_espera = models.FloatField()  # segundos
+    tiempo_espera = models.FloatField()  # segundos, al registrarse; la espera actual la da cola()
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    objects = AutoQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['direccion', 'turno'], name='auto_direccion_turno_idx'),
+        ]
+
     def __str__(self):
         return f"Auto {self.id} ({self.get_direccion_display()})"
+
+
+class ColaDireccion(models.Model):
+    """Resumen de la cola de una dirección: cantidad de autos, suma de sus
+    tiempos de cruce, auto al frente y último turno asignado. Se actualiza
+    en la misma transacción que crea o elimina el auto, así registrar y
+    consultar el primero de la cola no recorren la tabla Auto. Los borrados
+    lo descuentan con la señal post_delete, también los del admin y los de
+    QuerySet.delete()."""
+    direccion = models.CharField(max_length=1, choices=Auto.DIRECCIONES, unique=True)
+    ultimo_turno = models.PositiveIntegerField(default=0)
+    cantidad = models.PositiveIntegerField(default=0)
+    tiempo_total = models.FloatField(default=0)  # segundos
+    cabeza = models.ForeignKey(Auto, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+
+    def __str__(self):
+        return f"Cola {self.get_direccion_display()} ({self.cantidad} autos)"
+
+    @classmethod
+    def resumen(cls, direccion):
+        return cls.objects.get_or_create(direccion=direccion)[0]
+
+    @classmethod
+    def reservar_turno(cls, direccion, tiempo_cruce):
+        """Asignar el siguiente turno de la dirección y sumar el auto a la cola.
+
+        Devuelve (turno, posicion, tiempo_espera). El UPDATE va primero: toma
+        el lock de la fila (o de la base en SQLite) y lo que se lee después
+        dentro de la transacción ya incluye el incremento, como un UPDATE ...
+        RETURNING. Dos registros concurrentes nunca reciben el mismo turno.
+        Debe llamarse dentro de transaction.atomic().
+        """
+        actualizadas = cls.objects.filter(direccion=direccion).update(
+            ultimo_turno=F('ultimo_turno') + 1,
+            cantidad=F('cantidad') + 1,
+            tiempo_total=F('tiempo_total') + tiempo_cruce,
+        )
+        if not actualizadas:
+            cls.objects.create(direccion=direccion, ultimo_turno=1, cantidad=1, tiempo_total=tiempo_cruce)
+        cola = cls.objects.get(direccion=direccion)
+        return cola.ultimo_turno, cola.cantidad, cola.tiempo_total - tiempo_cruce
+
+    @classmethod
+    def agregar(cls, auto):
+        """Poner al auto recién creado al frente si la cola estaba vacía.
+        Debe llamarse dentro de la misma transacción que reservar_turno()."""
+        cls.objects.filter(direccion=auto.direccion, cabeza__isnull=True).update(cabeza=auto)
+
+    @classmethod
+    def quitar(cls, auto):
+        """Descontar un auto ya eliminado, dentro de la transacción del borrado.
+
+        Si era el primero, el borrado ya dejó cabeza en NULL (SET_NULL) y pasa
+        al frente el de menor turno que queda. Al llegar aquí ya no existe
+        ningún auto del mismo borrado, así que QuerySet.delete() sobre varios
+        del frente tampoco deja la cabeza apuntando a uno eliminado.
+        """
+        cola = cls.resumen(auto.direccion)
+        if cola.cantidad <= 1:
+            # Cola vacía: se descarta el error de redondeo acumulado en tiempo_total
+            cambios = {'cantidad': 0, 'tiempo_total': 0, 'cabeza': None}
+        else:
+            cambios = {'cantidad': F('cantidad') - 1, 'tiempo_total': F('tiempo_total') - auto.tiempo_cruce}
+            if cola.cabeza_id is None:
+                # El primero por el índice (direccion, turno)
+                cambios['cabeza'] = Auto.objects.filter(direccion=auto.direccion).order_by('turno').first()
+        cls.objects.filter(pk=cola.pk).update(**cambios)
+
+
+@receiver(post_delete, sender=Auto)
+def descontar_auto(sender, instance, **kwargs):
+    ColaDireccion.quitar(instance)
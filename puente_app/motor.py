@@ -0,0 +1,470 @@
+import logging
+import math
+from dataclasses import dataclass, field
+
+from .codec import dumps
+from .cola import ColaEspera
+from .planificador import DIRECCIONES, crear_planificador
+
+logger = logging.getLogger(__name__)
+
+LONGITUD_PUENTE = 500  # metros
+
+
+def calcular_tiempo_cruce(velocidad):
+    """Segundos que tarda en cruzar el puente un auto a velocidad km/h."""
+    velocidad_m_s = velocidad * 1000 / 3600  # convertir km/h a m/s
+    return LONGITUD_PUENTE / velocidad_m_s
+
+
+@dataclass(slots=True)
+class AutoPuente:
+    """Registro compacto de un auto del puente.
+
+    a_dict() es su forma en el protocolo; a_json() la guarda ya codificada
+    hasta que se asigna cualquier otro campo.
+    """
+
+    id: int
+    nombre: str
+    velocidad: float
+    tiempo_espera: float
+    direccion: str
+    prioridad: int
+    llegada: int
+    vueltas_totales: int  # Total original de vueltas
+    en_puente: bool = False
+    cruzadas: int = 0  # Contador de cruces completados
+    _json: str | None = field(default=None, repr=False, compare=False)
+
+    def __setattr__(self, nombre, valor):
+        object.__setattr__(self, nombre, valor)
+        if nombre != '_json':
+            object.__setattr__(self, '_json', None)
+
+    @property
+    def vueltas(self):
+        """Vueltas que le quedan por hacer."""
+        return self.vueltas_totales - self.cruzadas
+
+    @property
+    def tiempo_cruce(self):
+        return calcular_tiempo_cruce(self.velocidad)
+
+    def a_dict(self):
+        return {
+            'id': self.id,
+            'nombre': self.nombre,
+            'velocidad': self.velocidad,
+            'tiempo_espera': self.tiempo_espera,
+            'direccion': self.direccion,
+            'prioridad': self.prioridad,
+            'en_puente': self.en_puente,
+            'llegada': self.llegada,
+            'vueltas': self.vueltas,
+            'vueltas_totales': self.vueltas_totales,
+            'cruzadas': self.cruzadas,
+            'tiempo_cruce': self.tiempo_cruce
+        }
+
+    def a_json(self):
+        if self._json is None:
+            self._json = dumps(self.a_dict())
+        return self._json
+
+
+class MotorPuente:
+    """Máquina de estados del puente: autos registrados, cola de espera y auto cruzando.
+
+    Los comandos son síncronos y no hacen E/S de red. Cada uno devuelve
+    (respuesta, deltas): la respuesta para el cliente que lo pidió y la lista
+    de deltas (mensaje, urgente) que hay que difundir al grupo. Ambos llevan
+    los autos como dicts nuevos de a_dict(), porque se codifican más tarde y
+    quizá en otro hilo.
+
+    Qué auto entra al puente lo decide el planificador (settings.PUENTE_PLANIFICADOR);
+    cola_espera mantiene el orden global por (prioridad, llegada) que ven los
+    clientes y con el que se estiman las esperas.
+    """
+
+    def __init__(self, planificador=None):
+        self.autos = {}  # id: AutoPuente
+        self.cola_espera = ColaEspera()  # ordenada por (prioridad, llegada)
+        self.autos_en_puente = []  # ids de los autos cruzando, en orden de entrada
+        self.planificador = planificador if planificador is not None else crear_planificador()
+        self.auto_id_counter = 1
+        self.version = 0  # número de secuencia del último cambio de estado
+        self._estado_json = None  # (version, texto) del último snapshot codificado
+        self.registrar = True  # False mientras se reaplica un log: cada comando ya se registró
+
+    def _registrar(self, mensaje, *args):
+        if self.registrar:
+            logger.debug(mensaje, *args)
+
+    def _delta(self, tipo, op, urgente=False, **cambio):
+        """Parche numerado: op es 'insert', 'move', 'remove' o 'reset'."""
+        self.version += 1
+        return {
+            "type": tipo,
+            "seq": self.version,
+            "op": op,
+            **cambio
+        }, urgente
+
+    def _autos_estado(self):
+        auto_en_puente = [self.autos[aid] for aid in self.autos_en_puente if aid in self.autos]
+        autos_esperando = [self.autos[aid] for (_, _, aid) in self.cola_espera if aid in self.autos]
+        return auto_en_puente, autos_esperando
+
+    def _espera_puente(self):
+        # El motor no sabe cuándo empezaron los cruces en curso: se cuenta
+        # entero el más largo
+        return max((self.autos[aid].tiempo_cruce for aid in self.autos_en_puente if aid in self.autos),
+                   default=0.0)
+
+    def _esperas(self, autos_esperando):
+        """Espera estimada de cada auto de la cola, en el mismo orden."""
+        esperas = []
+        acumulado = self._espera_puente()
+        for auto in autos_esperando:
+            esperas.append(acumulado)
+            acumulado += auto.tiempo_cruce
+        return esperas
+
+    def espera_estimada(self, auto_id):
+        """(posicion, segundos) de un auto en la cola, en O(log n).
+
+        Supone que cruzan de a uno en el orden global de la cola: con lotes o
+        capacidad mayor que 1 es una cota superior aproximada.
+        """
+        posicion, espera = self.cola_espera.posicion(auto_id)
+        return posicion, self._espera_puente() + espera
+
+    def estado(self):
+        auto_en_puente, autos_esperando = self._autos_estado()
+        return {
+            'version': self.version,
+            'autos_en_puente': [auto.a_dict() for auto in auto_en_puente],
+            'autos_esperando': [auto.a_dict() for auto in autos_esperando],
+            'esperas': self._esperas(autos_esperando),
+            'total_autos': len(self.autos)
+        }, []
+
+    def obtener_version(self):
+        return self.version, []
+
+    def resumen(self):
+        """Cantidades y autos en el puente, para los clientes suscritos solo al resumen."""
+        return {
+            'version': self.version,
+            'total_autos': len(self.autos),
+            'en_cola': len(self.cola_espera),
+            'autos_en_puente': [
+                {'id': aid, 'nombre': self.autos[aid].nombre, 'direccion': self.autos[aid].direccion}
+                for aid in self.autos_en_puente if aid in self.autos
+            ],
+        }, []
+
+    def estado_filtrado(self, direcciones, auto_ids):
+        """estado() con solo los autos de esas direcciones o con esos ids."""
+        direcciones, auto_ids = set(direcciones), set(auto_ids)
+        auto_en_puente, autos_esperando = self._autos_estado()
+        esperas = self._esperas(autos_esperando)
+
+        def incluido(auto):
+            return auto.direccion in direcciones or auto.id in auto_ids
+
+        esperando = [(auto, espera) for auto, espera in zip(autos_esperando, esperas) if incluido(auto)]
+        return {
+            'version': self.version,
+            'autos_en_puente': [auto.a_dict() for auto in auto_en_puente if incluido(auto)],
+            'autos_esperando': [auto.a_dict() for auto, _ in esperando],
+            'esperas': [espera for _, espera in esperando],
+            'total_autos': len(self.autos)
+        }, []
+
+    def metricas(self):
+        """Rendimiento (autos/hora) y equidad de la política de cruce."""
+        return {**self.planificador.describir(), **self.planificador.metricas.resumen()}, []
+
+    def estado_json(self):
+        """El snapshot de estado() ya codificado, armado con el JSON guardado en cada auto.
+
+        Se arma a lo sumo una vez por versión: todo cambio de estado la incrementa.
+        """
+        if self._estado_json is None or self._estado_json[0] != self.version:
+            auto_en_puente, autos_esperando = self._autos_estado()
+            self._estado_json = self.version, (
+                f'{{"version": {self.version}, '
+                f'"autos_en_puente": [{", ".join(auto.a_json() for auto in auto_en_puente)}], '
+                f'"autos_esperando": [{", ".join(auto.a_json() for auto in autos_esperando)}], '
+                f'"esperas": {dumps(self._esperas(autos_esperando))}, '
+                f'"total_autos": {len(self.autos)}}}'
+            )
+        return self._estado_json[1], []
+
+    def estado_versionado(self):
+        """(version, estado_json) juntos, para que el bucle guarde el snapshot por versión."""
+        return (self.version, self.estado_json()[0]), []
+
+    def _leer_auto(self, auto_data):
+        """Validar los datos de un auto sin tocar el estado."""
+        # float() acepta 'nan' e 'inf', que no caben en JSON válido
+        velocidad = float(auto_data.get('velocidad', 60))
+        if not math.isfinite(velocidad) or velocidad <= 0:
+            raise ValueError('La velocidad debe ser un número mayor que 0')
+        # Una velocidad subnormal (1e-310) pasa la validación anterior pero su
+        # tiempo de cruce desborda a inf
+        if not math.isfinite(calcular_tiempo_cruce(velocidad)):
+            raise ValueError('La velocidad es demasiado baja para cruzar el puente')
+        tiempo_espera = float(auto_data.get('tiempo_espera', 10))
+        if not math.isfinite(tiempo_espera):
+            raise ValueError('El tiempo de espera debe ser un número finito')
+        direccion = auto_data.get('direccion', 'N')
+        if direccion not in DIRECCIONES:
+            raise ValueError(f"Dirección inválida: {direccion}")
+        return {
+            'nombre': auto_data.get('nombre'),
+            'velocidad': velocidad,
+            'tiempo_espera': tiempo_espera,
+            'direccion': direccion,
+            'prioridad': int(auto_data.get('prioridad', 3)),
+            'vueltas': int(auto_data.get('vueltas', 1)),
+        }
+
+    def _agregar_auto(self, datos):
+        auto_id = self.auto_id_counter
+        self.auto_id_counter += 1
+        llegada = self.cola_espera.push(auto_id, datos['prioridad'], calcular_tiempo_cruce(datos['velocidad']))
+
+        auto = AutoPuente(
+            id=auto_id,
+            nombre=datos['nombre'] if datos['nombre'] is not None else f'Auto_{auto_id}',
+            velocidad=datos['velocidad'],
+            tiempo_espera=datos['tiempo_espera'],
+            direccion=datos['direccion'],
+            prioridad=datos['prioridad'],
+            llegada=llegada,
+            vueltas_totales=datos['vueltas']
+        )
+        self.autos[auto_id] = auto
+        self.planificador.encolar(auto)
+        return auto
+
+    def registrar_auto(self, auto_data):
+        auto = self._agregar_auto(self._leer_auto(auto_data))
+
+        self._registrar("Auto registrado: %s (ID: %s)", auto.nombre, auto.id)
+
+        posicion, espera = self.espera_estimada(auto.id)
+        return auto.a_dict(), [self._delta(
+            "auto_registrado", 'insert',
+            auto=auto.a_dict(), destino='cola',
+            posicion=posicion, espera_estimada=espera
+        )]
+
+    def registrar_autos(self, lista):
+        """Registrar varios autos con un solo delta.
+
+        Se validan todos antes de modificar el estado: si uno es inválido no
+        se registra ninguno. Devuelve los ids en el orden de la lista.
+        """
+        if not isinstance(lista, list):
+            raise ValueError('Se esperaba una lista de autos')
+        datos = []
+        for i, auto_data in enumerate(lista):
+            try:
+                datos.append(self._leer_auto(auto_data))
+            except (TypeError, ValueError, AttributeError) as e:
+                raise ValueError(f'Auto #{i}: {e}')
+
+        autos = [self._agregar_auto(d) for d in datos]
+        if not autos:
+            return [], []
+
+        self._registrar("%d autos registrados (IDs %s-%s)", len(autos), autos[0].id, autos[-1].id)
+
+        # Ordenados por posición final: el cliente los inserta uno a uno en ese orden
+        posiciones = sorted((self.cola_espera.rank(auto.id), auto.id) for auto in autos)
+        return [auto.id for auto in autos], [self._delta(
+            "autos_registrados", 'insert',
+            autos=[self.autos[aid].a_dict() for _, aid in posiciones], destino='cola',
+            posiciones=[posicion for posicion, _ in posiciones]
+        )]
+
+    def solicitar_cruce(self, auto_id):
+        self._registrar("Solicitud de cruce para auto ID: %s", auto_id)
+
+        # Verificar que el auto existe
+        if auto_id not in self.autos:
+            return {
+                'success': False,
+                'permiso': False,
+                'mensaje': 'Auto no encontrado en el sistema',
+                'auto_id': auto_id
+            }, []
+
+        if self.autos[auto_id].en_puente:
+            # Repetir la solicitud no cambia nada: p. ej. el servidor ya lo admitió
+            auto = self.autos[auto_id]
+            return {
+                'success': True,
+                'permiso': True,
+                'mensaje': f"Auto {auto.nombre} ya está cruzando el puente",
+                'auto': auto.a_dict(),
+                'auto_id': auto_id
+            }, []
+
+        # Solo puede cruzar el auto que elige el planificador, y solo si cabe
+        # en el puente junto a los que ya están cruzando
+        candidato = self.planificador.candidato()
+        if candidato == auto_id:
+            auto = self.autos[auto_id]
+            en_puente = [self.autos[aid] for aid in self.autos_en_puente if aid in self.autos]
+            if self.planificador.puede_entrar(auto, en_puente):
+                self.autos_en_puente.append(auto_id)
+                self.cola_espera.remove(auto_id)
+                self.planificador.entrar(auto)
+                auto.en_puente = True
+
+                self._registrar("Auto %s comenzando cruce", auto.nombre)
+
+                return {
+                    'success': True,
+                    'permiso': True,
+                    'mensaje': f"Auto {auto.nombre} puede cruzar el puente",
+                    'auto': auto.a_dict(),
+                    'auto_id': auto_id
+                }, [self._delta(
+                    "auto_cruzando", 'move', urgente=True,
+                    auto=auto.a_dict(), destino='puente'
+                )]
+
+            ocupantes = ', '.join(a.nombre for a in en_puente) or 'auto desconocido'
+            return {
+                'success': False,
+                'permiso': False,
+                'mensaje': f"Puente ocupado por {ocupantes}",
+                'auto_id': auto_id,
+                'posicion': 0,
+                'espera_estimada': self._espera_puente()
+            }, []
+
+        # Encontrar a quién le toca según el planificador
+        proximo_auto = self.autos.get(candidato)
+
+        mensaje = 'No es el turno de este auto para cruzar'
+        if proximo_auto:
+            mensaje += f". Turno actual: {proximo_auto.nombre}"
+
+        respuesta = {
+            'success': False,
+            'permiso': False,
+            'mensaje': mensaje,
+            'auto_id': auto_id
+        }
+        if auto_id in self.cola_espera:
+            respuesta['posicion'], respuesta['espera_estimada'] = self.espera_estimada(auto_id)
+        return respuesta, []
+
+    def finalizar_cruce(self, auto_id, cruzadas=None):
+        """Terminar el cruce en curso de un auto.
+
+        Con `cruzadas` solo termina el cruce que empezó con ese contador: un
+        temporizador vencido tarde no corta un cruce posterior del mismo auto.
+        """
+        if auto_id not in self.autos_en_puente:
+            return None, []
+        auto = self.autos.get(auto_id)
+        if auto and cruzadas is not None and auto.cruzadas != cruzadas:
+            return None, []
+        self.autos_en_puente.remove(auto_id)
+        if not auto:
+            return None, []
+
+        auto.en_puente = False
+        self.planificador.salir(auto)
+        auto.cruzadas += 1  # Incrementar contador de cruces (las vueltas restantes se derivan)
+
+        # Determinar si el auto debe continuar o salir del sistema
+        if auto.cruzadas < auto.vueltas_totales:
+            # El auto debe hacer más cruces
+            # Cambiar dirección (ida y vuelta)
+            auto.direccion = 'S' if auto.direccion == 'N' else 'N'
+
+            # Volver a agregar a la cola con la misma prioridad pero al final (FIFO):
+            # la cola asigna la siguiente llegada de su contador monótono
+            llegada = self.cola_espera.push(auto_id, auto.prioridad, auto.tiempo_cruce)
+            auto.llegada = llegada
+            self.planificador.encolar(auto)
+
+            posicion, espera = self.espera_estimada(auto_id)
+            self._registrar("Auto %s regresó a la cola al final (FIFO) - Dirección: %s - Llegada: %s - Posición: %d",
+                            auto.nombre, auto.direccion, llegada, posicion + 1)
+
+            # Notificar que el auto ha regresado a la cola
+            return None, [self._delta(
+                "auto_regreso_cola", 'move',
+                auto=auto.a_dict(), destino='cola', posicion=posicion,
+                espera_estimada=espera
+            )]
+
+        # El auto ha completado todas sus vueltas, removerlo del sistema
+        self.autos.pop(auto_id, None)
+        return None, [self._delta(
+            "auto_salio", 'remove',
+            auto=auto.a_dict(), eliminado=True
+        )]
+
+    def admitir_siguientes(self):
+        """Dar el puente a los autos que elige el planificador mientras quepan.
+
+        Con el fin de cruce automático el servidor lo llama cuando cambia la
+        cola o se libera el puente, en lugar de esperar el sondeo de los clientes.
+        """
+        deltas = []
+        while True:
+            candidato = self.planificador.candidato()
+            if candidato not in self.autos:
+                break
+            _, cambios = self.solicitar_cruce(candidato)
+            if not cambios:
+                break
+            deltas.extend(cambios)
+        return len(deltas), deltas
+
+    # Campos de AutoPuente en el orden de las filas de instantanea()
+    CAMPOS_AUTO = ('id', 'nombre', 'velocidad', 'tiempo_espera', 'direccion', 'prioridad',
+                   'llegada', 'vueltas_totales', 'en_puente', 'cruzadas')
+
+    def instantanea(self):
+        """Estado completo del motor como datos JSON, para persistirlo."""
+        return {
+            'version': self.version,
+            'auto_id_counter': self.auto_id_counter,
+            'autos': [[getattr(auto, campo) for campo in self.CAMPOS_AUTO] for auto in self.autos.values()],
+            'autos_en_puente': list(self.autos_en_puente),
+            'cola': self.cola_espera.instantanea(),
+            'planificador': self.planificador.instantanea(),
+        }
+
+    def restaurar(self, datos):
+        """Reemplazar el estado por el de una instantanea(). Conserva el planificador."""
+        self.version = datos['version']
+        self.auto_id_counter = datos['auto_id_counter']
+        self.autos = {fila[0]: AutoPuente(*fila) for fila in datos['autos']}
+        self.autos_en_puente = list(datos['autos_en_puente'])
+        self.cola_espera = ColaEspera.desde_instantanea(datos['cola'])
+        self.planificador.restaurar(datos['planificador'])
+        self._estado_json = None
+
+    def resetear_sistema(self):
+        # Limpiar completamente el sistema; la versión sigue creciendo
+        self.autos.clear()
+        self.cola_espera.clear()
+        self.autos_en_puente = []
+        self.planificador.reiniciar()
+        self.auto_id_counter = 1
+
+        # El parche 'reset' deja vacío el estado de los clientes
+        return None, [self._delta("reset_sistema", 'reset', urgente=True)]
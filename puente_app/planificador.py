@@ -0,0 +1,224 @@
+import time
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .cola import ColaEspera
+
+DIRECCIONES = ('N', 'S')
+OPUESTA = {'N': 'S', 'S': 'N'}
+
+
+class MetricasPlanificador:
+    """Rendimiento y equidad de una política, medidos con `reloj` (segundos).
+
+    Solo guarda agregados (cantidad, suma, suma de cuadrados y máximo de las
+    esperas por dirección), así que su tamaño no crece con el tráfico.
+    """
+
+    def __init__(self, reloj=None):
+        self.reloj = reloj or time.monotonic
+        self.reiniciar()
+
+    def reiniciar(self):
+        self.cruces = 0
+        self.cambios_sentido = 0
+        self._inicio = None
+        self._ultima_direccion = None
+        self._encolado = {}  # auto_id: instante en que entró a la cola
+        self._esperas = {d: [0, 0.0, 0.0, 0.0] for d in DIRECCIONES}  # n, suma, cuadrados, máximo
+
+    def encolado(self, auto):
+        ahora = self.reloj()
+        if self._inicio is None:
+            self._inicio = ahora
+        self._encolado[auto.id] = ahora
+
+    def entro(self, auto):
+        espera = self.reloj() - self._encolado.pop(auto.id)
+        agregado = self._esperas[auto.direccion]
+        agregado[0] += 1
+        agregado[1] += espera
+        agregado[2] += espera * espera
+        agregado[3] = max(agregado[3], espera)
+        if self._ultima_direccion is not None and auto.direccion != self._ultima_direccion:
+            self.cambios_sentido += 1
+        self._ultima_direccion = auto.direccion
+
+    def salio(self, auto):
+        self.cruces += 1
+
+    def encolados(self, ids):
+        """Contar desde ahora la espera de autos que ya estaban en la cola (al restaurar)."""
+        ahora = self.reloj()
+        if ids and self._inicio is None:
+            self._inicio = ahora
+        for auto_id in ids:
+            self._encolado[auto_id] = ahora
+
+    @staticmethod
+    def _jain(suma, cuadrados, n):
+        # Índice de Jain: 1 si todos los valores son iguales, 1/n si uno se lleva todo
+        return suma * suma / (n * cuadrados) if cuadrados > 0 else 1.0
+
+    def resumen(self):
+        horas = (self.reloj() - self._inicio) / 3600 if self._inicio is not None else 0.0
+        medias = {d: (a[1] / a[0] if a[0] else 0.0) for d, a in self._esperas.items()}
+        n = sum(a[0] for a in self._esperas.values())
+        con_trafico = [medias[d] for d, a in self._esperas.items() if a[0]]
+        return {
+            'cruces': self.cruces,
+            'autos_por_hora': self.cruces / horas if horas > 0 else 0.0,
+            'cambios_sentido': self.cambios_sentido,
+            'espera_media': medias,
+            'espera_maxima': {d: a[3] for d, a in self._esperas.items()},
+            # Equidad entre autos (esperas individuales) y entre direcciones (esperas medias)
+            'equidad': self._jain(sum(a[1] for a in self._esperas.values()),
+                                  sum(a[2] for a in self._esperas.values()), n) if n else 1.0,
+            'equidad_direcciones': self._jain(sum(con_trafico), sum(m * m for m in con_trafico),
+                                              len(con_trafico)) if con_trafico else 1.0,
+        }
+
+
+class Planificador:
+    """Decide qué auto de la cola entra al puente.
+
+    Mantiene una ColaEspera por dirección, ordenada por prioridad efectiva y
+    llegada. Pueden cruzar hasta `capacidad` autos a la vez si van en la
+    misma dirección; para cambiar de sentido el puente tiene que vaciarse.
+    Con `envejecimiento` = k, un auto gana un nivel de prioridad por cada k
+    cruces que empiezan mientras espera, así ninguno espera indefinidamente.
+    El reloj del envejecimiento es la cantidad de cruces, no la hora, para
+    que todas las réplicas del motor tomen las mismas decisiones.
+    """
+
+    def __init__(self, capacidad=1, envejecimiento=None, reloj=None):
+        if capacidad < 1:
+            raise ValueError('La capacidad debe ser al menos 1')
+        self.capacidad = capacidad
+        self.envejecimiento = envejecimiento
+        self.metricas = MetricasPlanificador(reloj)
+        self.reiniciar()
+
+    def reiniciar(self):
+        self.colas = {d: ColaEspera() for d in DIRECCIONES}
+        self.entradas = 0  # cruces empezados
+        self.metricas.reiniciar()
+
+    def _prioridad(self, auto):
+        # Con envejecimiento lineal el orden relativo de dos autos no cambia
+        # mientras esperan, así que la prioridad efectiva se fija al encolar
+        if self.envejecimiento:
+            return (auto.prioridad * self.envejecimiento + self.entradas, auto.llegada)
+        return (auto.prioridad, auto.llegada)
+
+    def _frente(self, direccion):
+        return self.colas[direccion].frente()
+
+    def encolar(self, auto):
+        self.colas[auto.direccion].push(auto.id, self._prioridad(auto))
+        self.metricas.encolado(auto)
+
+    def candidato(self):
+        """Id del auto al que le toca entrar, o None si no hay autos esperando."""
+        frentes = [f for f in map(self._frente, DIRECCIONES) if f is not None]
+        return min(frentes)[2] if frentes else None
+
+    def puede_entrar(self, auto, en_puente):
+        """Si `auto` cabe en el puente junto a los autos `en_puente`."""
+        return len(en_puente) < self.capacidad and all(a.direccion == auto.direccion for a in en_puente)
+
+    def entrar(self, auto):
+        self.colas[auto.direccion].remove(auto.id)
+        self.entradas += 1
+        self.metricas.entro(auto)
+
+    def salir(self, auto):
+        self.metricas.salio(auto)
+
+    def describir(self):
+        return {
+            'politica': type(self).__name__,
+            'capacidad': self.capacidad,
+            'envejecimiento': self.envejecimiento,
+        }
+
+    def instantanea(self):
+        """Estado de las decisiones como datos JSON. Las métricas no se guardan."""
+        return {
+            'entradas': self.entradas,
+            'colas': {d: cola.instantanea() for d, cola in self.colas.items()},
+        }
+
+    def restaurar(self, datos):
+        self.reiniciar()
+        self.entradas = datos['entradas']
+        self.colas = {d: ColaEspera.desde_instantanea(cola) for d, cola in datos['colas'].items()}
+        self.metricas.encolados([aid for cola in self.colas.values() for (_, _, aid) in cola])
+
+
+class PrioridadEstricta(Planificador):
+    """Siempre el auto de mayor prioridad y, entre iguales, el que llegó antes.
+
+    Con capacidad 1 y sin envejecimiento es el orden de la cola del motor.
+    """
+
+
+class LotesAlternados(Planificador):
+    """Hasta `lote` autos seguidos en un sentido antes de darle el turno al otro.
+
+    Si el otro sentido no tiene autos esperando, el lote se extiende. Agrupar
+    los cruces en un mismo sentido evita vaciar el puente en cada auto.
+    """
+
+    def __init__(self, lote=5, **opciones):
+        if lote < 1:
+            raise ValueError('El lote debe ser de al menos 1 auto')
+        self.lote = lote
+        super().__init__(**opciones)
+
+    def reiniciar(self):
+        super().reiniciar()
+        self.sentido = None
+        self.servidos = 0  # autos que entraron en el lote actual
+
+    def candidato(self):
+        actual = self.sentido
+        if actual is not None:
+            otra = OPUESTA[actual]
+            if self.colas[actual] and (self.servidos < self.lote or not self.colas[otra]):
+                return self._frente(actual)[2]
+            if self.colas[otra]:
+                return self._frente(otra)[2]
+        return super().candidato()
+
+    def entrar(self, auto):
+        super().entrar(auto)
+        if auto.direccion == self.sentido:
+            self.servidos += 1
+        else:
+            self.sentido = auto.direccion
+            self.servidos = 1
+
+    def describir(self):
+        return {**super().describir(), 'lote': self.lote}
+
+    def instantanea(self):
+        return {**super().instantanea(), 'sentido': self.sentido, 'servidos': self.servidos}
+
+    def restaurar(self, datos):
+        super().restaurar(datos)
+        self.sentido = datos.get('sentido')
+        self.servidos = datos.get('servidos', 0)
+
+
+def crear_planificador(config=None, **opciones):
+    """Instanciar la política de `config` o, si no se da, la de settings.PUENTE_PLANIFICADOR.
+
+    Las `opciones` se agregan a las de la configuración (por ejemplo el reloj
+    de un simulador).
+    """
+    if config is None:
+        config = getattr(settings, 'PUENTE_PLANIFICADOR', {})
+    clase = import_string(config.get('BACKEND', 'puente_app.planificador.PrioridadEstricta'))
+    return clase(**{**config.get('OPTIONS', {}), **opciones})
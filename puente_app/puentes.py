@@ -0,0 +1,71 @@
+import hashlib
+import re
+from bisect import bisect
+
+from django.conf import settings
+
+PUENTE_POR_DEFECTO = 'principal'
+PATRON_PUENTE = r'[A-Za-z0-9_-]{1,50}'  # también sirve como nombre de grupo y de archivo
+
+_patron = re.compile(PATRON_PUENTE + r'\Z')
+_anillo = None
+
+
+def puente_valido(puente):
+    """Si el id tiene el formato permitido y, si hay lista en settings.PUENTES_PERMITIDOS, está en ella."""
+    if not isinstance(puente, str) or not _patron.match(puente):
+        return False
+    permitidos = getattr(settings, 'PUENTES_PERMITIDOS', None)
+    return permitidos is None or puente in permitidos
+
+
+def nombre_grupo(puente):
+    """Grupo de la capa de canales de un puente. El principal conserva el nombre de siempre."""
+    return 'puente_grupo' if puente == PUENTE_POR_DEFECTO else f'puente_grupo.{puente}'
+
+
+def _hash(texto):
+    return int.from_bytes(hashlib.blake2b(texto.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class AnilloConsistente:
+    """Reparte claves entre nodos con hashing consistente.
+
+    Cada nodo ocupa `replicas` puntos del anillo; una clave pertenece al
+    primer punto que le sigue. Al agregar o quitar un nodo solo cambian de
+    dueño las claves de sus puntos, cerca de 1/n del total.
+    """
+
+    def __init__(self, nodos, replicas=100):
+        self._puntos = sorted((_hash(f'{nodo}#{i}'), nodo) for nodo in nodos for i in range(replicas))
+        self._hashes = [h for h, _ in self._puntos]
+
+    def nodo(self, clave):
+        if not self._puntos:
+            return None
+        return self._puntos[bisect(self._hashes, _hash(clave)) % len(self._puntos)][1]
+
+
+def worker_de(puente):
+    """Nombre del worker de settings.PUENTE_WORKERS que atiende el puente.
+
+    None si no hay reparto configurado y cada proceso atiende todos los puentes.
+    """
+    global _anillo
+    workers = getattr(settings, 'PUENTE_WORKERS', {})
+    if not workers or not getattr(settings, 'PUENTE_WORKER', None):
+        return None
+    if _anillo is None:
+        _anillo = AnilloConsistente(sorted(workers))
+    return _anillo.nodo(puente)
+
+
+def atiende(puente):
+    """Si este proceso es el dueño del puente."""
+    worker = worker_de(puente)
+    return worker is None or worker == settings.PUENTE_WORKER
+
+
+def servidor_de(puente):
+    """URL base (ws://host:puerto) del worker que atiende el puente."""
+    return settings.PUENTE_WORKERS[worker_de(puente)]
@@ -1,6 +1,8 @@
 from django.urls import re_path
 from . import consumers
+from .puentes import PATRON_PUENTE
 
 websocket_urlpatterns = [
     re_path(r'^ws/puente_app/$', consumers.PuenteConsumer.as_asgi()),
+    re_path(rf'^ws/puente_app/(?P<puente_id>{PATRON_PUENTE})/$', consumers.PuenteConsumer.as_asgi()),
 ] 
\ No newline at end of file
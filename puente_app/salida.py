@@ -0,0 +1,88 @@
+import asyncio
+from collections import deque
+
+from . import metricas
+
+# Mensajes que describen un estado entero: basta enviar el más nuevo
+REEMPLAZABLES = {'resumen'}
+
+
+class ColaSalida:
+    """Mensajes ya codificados que esperan salir por un socket, con tope.
+
+    Un mensaje reemplazable todavía pendiente se sobrescribe con el más nuevo
+    en su lugar de la cola; los deltas se conservan todos y en orden.
+
+    self.send() no espera al cliente: daphne deja lo enviado en el buffer del
+    transporte, así que la cola se vacía al instante aunque nadie lea. Por
+    eso, cuando el cliente confirma el último seq que recibió (mensaje
+    'confirmar'), lo enviado y aún no confirmado cuenta para el tope igual
+    que lo pendiente. agregar() devuelve False cuando todo eso pasa
+    max_mensajes o max_bytes: el cliente no lee a tiempo y conviene que se
+    resincronice. Con un cliente que nunca confirma solo se cuenta lo
+    pendiente, y el tope protege únicamente frente a servidores ASGI con
+    control de flujo.
+    """
+
+    def __init__(self, max_mensajes, max_bytes):
+        self.max_mensajes = max_mensajes
+        self.max_bytes = max_bytes
+        self.bytes = 0  # caracteres pendientes, como aproximación
+        self.bytes_en_vuelo = 0  # caracteres enviados sin confirmar
+        self.confirma = False  # si el cliente envía 'confirmar'
+        self._pendientes = deque()  # [tipo, texto, seq]
+        self._en_vuelo = deque()  # (seq, caracteres) enviados sin confirmar
+        self._reemplazables = {}  # tipo: su entrada pendiente
+        self._hay = asyncio.Event()
+
+    def __len__(self):
+        return len(self._pendientes)
+
+    @property
+    def en_vuelo(self):
+        return len(self._en_vuelo)
+
+    def _dentro_del_tope(self):
+        return (len(self._pendientes) + len(self._en_vuelo) <= self.max_mensajes
+                and self.bytes + self.bytes_en_vuelo <= self.max_bytes)
+
+    def agregar(self, tipo, texto, seq):
+        anterior = self._reemplazables.get(tipo)
+        if anterior is not None:
+            self.bytes += len(texto) - len(anterior[1])
+            anterior[1], anterior[2] = texto, seq
+            metricas.REEMPLAZADOS.inc()
+            return self._dentro_del_tope()
+        entrada = [tipo, texto, seq]
+        if tipo in REEMPLAZABLES:
+            self._reemplazables[tipo] = entrada
+        self._pendientes.append(entrada)
+        self.bytes += len(texto)
+        self._hay.set()
+        return self._dentro_del_tope()
+
+    def confirmar(self, seq):
+        """El cliente ya recibió todo hasta `seq`."""
+        self.confirma = True
+        while self._en_vuelo and self._en_vuelo[0][0] <= seq:
+            self.bytes_en_vuelo -= self._en_vuelo.popleft()[1]
+
+    def vaciar(self):
+        self._pendientes.clear()
+        self._reemplazables.clear()
+        self._en_vuelo.clear()
+        self.bytes = self.bytes_en_vuelo = 0
+
+    async def siguiente(self):
+        """Esperar el próximo mensaje y sacarlo de la cola."""
+        while not self._pendientes:
+            self._hay.clear()
+            await self._hay.wait()
+        tipo, texto, seq = entrada = self._pendientes.popleft()
+        if self._reemplazables.get(tipo) is entrada:
+            del self._reemplazables[tipo]
+        self.bytes -= len(texto)
+        if self.confirma:
+            self._en_vuelo.append((seq, len(texto)))
+            self.bytes_en_vuelo += len(texto)
+        return texto
@@ -0,0 +1,164 @@
+import random
+import time
+from heapq import heappop, heappush
+
+from .motor import MotorPuente
+from .planificador import crear_planificador
+
+# Tipos de evento, en el orden en que se atienden si coinciden en el tiempo
+FIN, LLEGADA, SOLICITUD = range(3)
+
+
+def percentil(ordenados, q):
+    """Percentil q (0-100) de una lista ya ordenada, por el método del rango más cercano."""
+    if not ordenados:
+        return 0.0
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * q / 100))]
+
+
+class SimuladorPuente:
+    """Simulación de eventos discretos del puente, sin navegadores ni sockets.
+
+    Los autos llegan como un proceso de Poisson de `tasa` autos por minuto y
+    se comportan como los clientes de static/js/app.js: piden el cruce al
+    registrarse y luego cada tiempo_espera + U(0, 5) segundos hasta obtenerlo,
+    cruzan durante su tiempo_cruce, envían finalizar_cruce y, si les quedan
+    vueltas, vuelven a pedir el cruce. Cada paso es el mismo comando del motor
+    que ejecuta PuenteConsumer; el reloj es simulado, así que una hora de
+    tráfico corre en lo que tarde la CPU en procesar sus eventos.
+
+    Con cruce_automatico se simula PUENTE_CRUCE_AUTOMATICO: nadie sondea, el
+    servidor admite a los autos apenas cabe alguno y termina sus cruces.
+    """
+
+    def __init__(self, tasa=6.0, duracion=3600.0, planificador=None, semilla=0,
+                 fraccion_norte=0.5, velocidad=(30, 120), prioridad=(1, 5),
+                 vueltas=(1, 3), tiempo_espera=(5, 30), cruce_automatico=False):
+        self.tasa = tasa
+        self.cruce_automatico = cruce_automatico
+        self.duracion = duracion
+        self.fraccion_norte = fraccion_norte
+        self.velocidad = velocidad
+        self.prioridad = prioridad
+        self.vueltas = vueltas
+        self.tiempo_espera = tiempo_espera
+        self.azar = random.Random(semilla)
+        self.ahora = 0.0
+        self.motor = MotorPuente(crear_planificador(planificador, reloj=lambda: self.ahora))
+
+        self._eventos = []  # heap de (tiempo, tipo, orden, auto_id, sondeo)
+        self._orden = 0
+        self._sondeos = {}  # auto_id: número del sondeo vigente, los anteriores se descartan
+        self._encolado = {}  # auto_id: instante en que entró a la cola
+        self.esperas = []
+        self.procesados = 0
+        self.cruces = 0
+        self._cola_area = 0.0  # integral de la longitud de la cola en el tiempo
+        self._ocupado = 0.0  # tiempo con al menos un auto en el puente
+        self.cola_maxima = 0
+
+    def _programar(self, tiempo, tipo, auto_id=None, sondeo=None):
+        self._orden += 1
+        heappush(self._eventos, (tiempo, tipo, self._orden, auto_id, sondeo))
+
+    def _proxima_llegada(self):
+        self._programar(self.ahora + self.azar.expovariate(self.tasa / 60), LLEGADA)
+
+    def _empezar_sondeo(self, auto_id):
+        # Como iniciarSimulacionAuto(): un intento inmediato y luego periódicos
+        self._encolado[auto_id] = self.ahora
+        if self.cruce_automatico:
+            return
+        self._sondeos[auto_id] = self._sondeos.get(auto_id, 0) + 1
+        self._programar(self.ahora, SOLICITUD, auto_id, self._sondeos[auto_id])
+
+    def _cruzar(self, auto_id):
+        self.esperas.append(self.ahora - self._encolado.pop(auto_id))
+        self._programar(self.ahora + self.motor.autos[auto_id].tiempo_cruce, FIN, auto_id)
+
+    def _admitir(self):
+        for mensaje, _ in self.motor.admitir_siguientes()[1]:
+            self._cruzar(mensaje['auto']['id'])
+
+    def _llegada(self):
+        auto = self.motor.registrar_auto({
+            'velocidad': self.azar.uniform(*self.velocidad),
+            'tiempo_espera': self.azar.uniform(*self.tiempo_espera),
+            'direccion': 'N' if self.azar.random() < self.fraccion_norte else 'S',
+            'prioridad': self.azar.randint(*self.prioridad),
+            'vueltas': self.azar.randint(*self.vueltas),
+        })[0]
+        self._empezar_sondeo(auto['id'])
+        if self.cruce_automatico:
+            self._admitir()
+        self._proxima_llegada()
+
+    def _solicitud(self, auto_id, sondeo):
+        if self._sondeos.get(auto_id) != sondeo:
+            return  # el cliente ya canceló este intervalo
+        respuesta = self.motor.solicitar_cruce(auto_id)[0]
+        auto = self.motor.autos[auto_id]
+        if respuesta['permiso']:
+            del self._sondeos[auto_id]
+            self._cruzar(auto_id)
+        else:
+            self._programar(self.ahora + auto.tiempo_espera + self.azar.uniform(0, 5),
+                            SOLICITUD, auto_id, sondeo)
+
+    def _fin(self, auto_id):
+        deltas = self.motor.finalizar_cruce(auto_id)[1]
+        self.cruces += 1
+        if deltas and deltas[0][0]['type'] == 'auto_regreso_cola':
+            self._empezar_sondeo(auto_id)
+        if self.cruce_automatico:
+            self._admitir()
+
+    def _avanzar(self, hasta):
+        transcurrido = hasta - self.ahora
+        self._cola_area += len(self.motor.cola_espera) * transcurrido
+        if self.motor.autos_en_puente:
+            self._ocupado += transcurrido
+        self.ahora = hasta
+
+    def ejecutar(self):
+        """Procesar los eventos hasta `duracion` segundos simulados y devolver resumen()."""
+        inicio = time.perf_counter()
+        self._proxima_llegada()
+        while self._eventos and self._eventos[0][0] <= self.duracion:
+            tiempo, tipo, _, auto_id, sondeo = heappop(self._eventos)
+            self._avanzar(tiempo)
+            if tipo == FIN:
+                self._fin(auto_id)
+            elif tipo == LLEGADA:
+                self._llegada()
+            else:
+                self._solicitud(auto_id, sondeo)
+            self.procesados += 1
+            self.cola_maxima = max(self.cola_maxima, len(self.motor.cola_espera))
+        self._avanzar(self.duracion)
+        self.segundos_cpu = time.perf_counter() - inicio
+        return self.resumen()
+
+    def resumen(self):
+        esperas = sorted(self.esperas)
+        horas = self.ahora / 3600
+        return {
+            'politica': self.motor.metricas()[0],
+            'segundos_simulados': self.ahora,
+            'eventos': self.procesados,
+            'eventos_por_segundo': self.procesados / self.segundos_cpu if self.segundos_cpu else 0.0,
+            'autos_registrados': self.motor.auto_id_counter - 1,
+            'cruces': self.cruces,
+            'autos_por_hora': self.cruces / horas if horas else 0.0,
+            'ocupacion': self._ocupado / self.ahora if self.ahora else 0.0,
+            'cola_media': self._cola_area / self.ahora if self.ahora else 0.0,
+            'cola_maxima': self.cola_maxima,
+            'cola_final': len(self.motor.cola_espera),
+            'espera': {
+                'media': sum(esperas) / len(esperas) if esperas else 0.0,
+                'p50': percentil(esperas, 50),
+                'p90': percentil(esperas, 90),
+                'p99': percentil(esperas, 99),
+                'maxima': esperas[-1] if esperas else 0.0,
+            },
+        }
@@ -0,0 +1,79 @@
+import asyncio
+import logging
+import time
+from heapq import heappop, heappush
+
+logger = logging.getLogger(__name__)
+
+
+class Temporizador:
+    """Muchos plazos con un solo timer de asyncio.
+
+    Los plazos esperan en un heap y solo el más próximo tiene un call_at en
+    el loop, así que programar cuesta O(log n) aunque haya miles pendientes.
+    Cancelar marca el plazo y se descarta cuando vence.
+    """
+
+    def __init__(self):
+        self._plazos = []  # heap de [instante, orden, callback, args]
+        self._orden = 0
+        self._loop = None
+        self._handle = None
+
+    def __len__(self):
+        return len(self._plazos)
+
+    def programar(self, demora, callback, *args):
+        """Llamar callback(*args) dentro de `demora` segundos. Devuelve el plazo para cancelar()."""
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # Otro loop (p. ej. un nuevo asyncio.run): los plazos del anterior ya no corren
+            self._loop, self._plazos, self._handle = loop, [], None
+        self._orden += 1
+        plazo = [loop.time() + demora, self._orden, callback, args]
+        heappush(self._plazos, plazo)
+        if self._plazos[0] is plazo:
+            self._armar()
+        return plazo
+
+    @staticmethod
+    def cancelar(plazo):
+        plazo[2] = None
+
+    def _armar(self):
+        if self._handle is not None:
+            self._handle.cancel()
+        self._handle = self._loop.call_at(self._plazos[0][0], self._vencer) if self._plazos else None
+
+    def _vencer(self):
+        self._handle = None
+        ahora = self._loop.time()
+        while self._plazos and self._plazos[0][0] <= ahora:
+            _, _, callback, args = heappop(self._plazos)
+            if callback is None:
+                continue
+            try:
+                callback(*args)
+            except Exception:
+                logger.exception("Error en un plazo del temporizador")
+        self._armar()
+
+
+class Ritmo:
+    """Deja pasar a lo sumo `por_segundo` eventos por segundo, en orden de llegada.
+
+    Los primeros `rafaga` pasan sin esperar; el resto queda repartido en el
+    tiempo en lugar de caer todo en el mismo instante.
+    """
+
+    def __init__(self, por_segundo, rafaga=None):
+        self.intervalo = 1 / por_segundo
+        self.rafaga = por_segundo / 10 if rafaga is None else rafaga
+        self._turno = 0.0  # instante en que se habría liberado el último lugar
+
+    async def esperar(self):
+        ahora = time.monotonic()
+        self._turno = max(self._turno, ahora) + self.intervalo
+        espera = self._turno - ahora - self.rafaga * self.intervalo
+        if espera > 0:
+            await asyncio.sleep(espera)
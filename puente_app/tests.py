@@ -1,3 +1,836 @@
-from django.test import TestCase
+import asyncio
+import json
+import math
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from bisect import insort
+from unittest import mock
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
 
-# Create your tests here.
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Sum
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from . import difusion, views
+from .backends import EstadoMemoria, EstadoPersistente, EstadoSQLite
+from .bucle import BuclePuente, obtener_bucle
+from .cola import ColaEspera
+from .consumers import CIERRE_ATRASADO, MAX_AUTOS_FILTRO
+from .models import Auto, ColaDireccion
+from .routing import websocket_urlpatterns
+from .motor import MotorPuente
+from .planificador import LotesAlternados, PrioridadEstricta
+from .salida import ColaSalida
+
+
+class ColaEsperaTests(SimpleTestCase):
+    """ColaEspera contra una lista ordenada que hace lo mismo en O(n)."""
+
+    def comprobar(self, cola, referencia, azar):
+        self.assertEqual(list(cola), referencia)
+        self.assertEqual(len(cola), len(referencia))
+        self.assertEqual(cola.frente(), referencia[0] if referencia else None)
+        for posicion in azar.sample(range(len(referencia)), min(10, len(referencia))):
+            self.assertEqual(cola.rank(referencia[posicion][2]), posicion)
+
+    def test_operaciones_al_azar(self):
+        azar = random.Random(1)
+        cola = ColaEspera()
+        referencia = []  # (prioridad, llegada, auto_id) en orden
+        fuera = list(range(200))  # ids que no están en la cola
+        for paso in range(5000):
+            operacion = azar.random()
+            if operacion < 0.45 and fuera:
+                auto_id = fuera.pop(azar.randrange(len(fuera)))
+                prioridad = azar.randint(1, 5)
+                llegada = cola.push(auto_id, prioridad)
+                insort(referencia, (prioridad, llegada, auto_id))
+            elif operacion < 0.6 and referencia:
+                sacado = referencia.pop(0)
+                self.assertEqual(cola.pop(), sacado)
+                fuera.append(sacado[2])
+            elif referencia:
+                auto_id = referencia.pop(azar.randrange(len(referencia)))[2]
+                self.assertTrue(cola.remove(auto_id))
+                self.assertFalse(cola.remove(auto_id))
+                fuera.append(auto_id)
+            if paso % 50 == 0:
+                self.comprobar(cola, referencia, azar)
+        self.comprobar(cola, referencia, azar)
+
+    def test_posicion_y_pesos_al_azar(self):
+        azar = random.Random(2)
+        cola = ColaEspera()
+        referencia = []  # (prioridad, llegada, auto_id, peso) en orden
+        for auto_id in range(3000):
+            if referencia and azar.random() < 0.4:
+                self.assertTrue(cola.remove(referencia.pop(azar.randrange(len(referencia)))[2]))
+            else:
+                prioridad, peso = azar.randint(1, 5), azar.uniform(10, 60)
+                llegada = cola.push(auto_id, prioridad, peso)
+                insort(referencia, (prioridad, llegada, auto_id, peso))
+            if auto_id % 50 == 0:
+                self.assertAlmostEqual(cola.peso_total, sum(item[3] for item in referencia), places=6)
+                for posicion in azar.sample(range(len(referencia)), min(10, len(referencia))):
+                    rank, espera = cola.posicion(referencia[posicion][2])
+                    self.assertEqual(rank, posicion)
+                    self.assertAlmostEqual(espera, sum(item[3] for item in referencia[:posicion]), places=6)
+
+    def test_vuelve_al_final_de_su_prioridad(self):
+        cola = ColaEspera()
+        for auto_id in range(3):
+            cola.push(auto_id, 1)
+        cola.remove(0)
+        cola.push(0, 1)
+        self.assertEqual([auto_id for _, _, auto_id in cola], [1, 2, 0])
+        with self.assertRaises(ValueError):
+            cola.push(1, 2)
+
+
+@override_settings(PUENTE_BROADCAST_HZ=20, PUENTES_PERMITIDOS=None, PUENTE_CONEXIONES_POR_SEGUNDO=0)
+class DifusionTests(SimpleTestCase):
+    """Cada prueba usa su propio puente: los bucles viven mientras dura el proceso."""
+
+    async def conectar(self, puente):
+        comunicador = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/puente_app/{puente}/')
+        conectado, _ = await comunicador.connect()
+        self.assertTrue(conectado)
+        return comunicador, json.loads(await comunicador.receive_from())
+
+    async def test_rafaga_limitada_a_broadcast_hz(self):
+        comunicador, inicial = await self.conectar('prueba_rafaga')
+        version = inicial['data']['version']
+        n = 200
+        inicio = time.perf_counter()
+        for i in range(n):
+            await comunicador.send_to(text_data=json.dumps({'type': 'registrar_auto', 'auto': {'nombre': f'a{i}'}}))
+        seqs, mensajes = [], 0
+        while len(seqs) < n:
+            mensaje = json.loads(await comunicador.receive_from(timeout=5))
+            mensajes += 1
+            seqs.extend(delta['seq'] for delta in mensaje.get('eventos', [mensaje]))
+        duracion = time.perf_counter() - inicio
+        await comunicador.disconnect()
+
+        # Todos los deltas, en orden y sin huecos, en a lo sumo un mensaje por ventana
+        self.assertEqual(seqs, list(range(version + 1, version + n + 1)))
+        self.assertLessEqual(mensajes, math.ceil(duracion * 20) + 1)
+
+    async def recibir_deltas(self, comunicador, n):
+        """Leer hasta juntar `n` deltas; devuelve los deltas y los caracteres recibidos."""
+        deltas, caracteres = [], 0
+        while len(deltas) < n:
+            texto = await comunicador.receive_from(timeout=5)
+            caracteres += len(texto)
+            mensaje = json.loads(texto)
+            deltas.extend(mensaje.get('eventos', [mensaje]))
+        return deltas, caracteres
+
+    async def registrar(self, comunicador, direcciones):
+        for i, direccion in enumerate(direcciones):
+            await comunicador.send_to(text_data=json.dumps({
+                'type': 'registrar_auto',
+                'auto': {'nombre': f'{direccion}{i}', 'direccion': direccion}
+            }))
+
+    async def test_filtro_por_direccion(self):
+        completo, _ = await self.conectar('prueba_filtros')
+        filtrado, _ = await self.conectar('prueba_filtros')
+        await filtrado.send_to(text_data=json.dumps({'type': 'suscribir', 'direcciones': ['N']}))
+        suscrito = json.loads(await filtrado.receive_from())
+        self.assertEqual(suscrito['type'], 'suscrito')
+        self.assertEqual(suscrito['filtro']['direcciones'], ['N'])
+
+        await self.registrar(completo, ['N', 'S'] * 10)
+        todos, caracteres_completo = await self.recibir_deltas(completo, 20)
+        norte, caracteres_filtrado = await self.recibir_deltas(filtrado, 10)
+        self.assertTrue(await filtrado.receive_nothing(timeout=0.2))
+
+        # Solo los deltas del norte, con el mismo seq que en el flujo completo
+        self.assertEqual({delta['auto']['direccion'] for delta in norte}, {'N'})
+        self.assertEqual([delta['seq'] for delta in norte],
+                         [delta['seq'] for delta in todos if delta['auto']['direccion'] == 'N'])
+        # Por cada evento del puente, el socket filtrado recibe menos
+        self.assertLess(caracteres_filtrado / len(todos), caracteres_completo / len(todos))
+
+        # Sin criterios vuelve al flujo completo, con estado_inicial
+        await filtrado.send_to(text_data=json.dumps({'type': 'suscribir'}))
+        inicial = json.loads(await filtrado.receive_from())
+        self.assertEqual(inicial['type'], 'estado_inicial')
+        await self.registrar(completo, ['N', 'S'])
+        deltas, _ = await self.recibir_deltas(filtrado, 2)
+        self.assertEqual([delta['auto']['direccion'] for delta in deltas], ['N', 'S'])
+        await completo.disconnect()
+        await filtrado.disconnect()
+
+    async def test_filtro_invalido(self):
+        comunicador, _ = await self.conectar('prueba_filtro_invalido')
+        for filtro in ({'auto_ids': ['x']},
+                       {'auto_ids': list(range(MAX_AUTOS_FILTRO + 1))},
+                       {'direcciones': ['E']}):
+            await comunicador.send_to(text_data=json.dumps({'type': 'suscribir', **filtro}))
+            respuesta = json.loads(await comunicador.receive_from())
+            self.assertEqual(respuesta['type'], 'error', filtro)
+
+        # El socket sigue recibiendo todo
+        await self.registrar(comunicador, ['S'])
+        deltas, _ = await self.recibir_deltas(comunicador, 1)
+        self.assertEqual(deltas[0]['auto']['direccion'], 'S')
+        await comunicador.disconnect()
+
+    @override_settings(PUENTE_BROADCAST_HZ=0, PUENTE_SALIDA_MAX_MENSAJES=5)
+    async def test_cliente_que_deja_de_confirmar(self):
+        lento, inicial = await self.conectar('prueba_atrasado')
+        otro, _ = await self.conectar('prueba_atrasado')
+        # Confirma una vez, como el cliente JS al recibir el estado, y nunca más
+        await lento.send_to(text_data=json.dumps({'type': 'confirmar', 'seq': inicial['data']['version']}))
+        await lento.send_to(text_data=json.dumps({'type': 'metricas'}))
+        self.assertEqual(json.loads(await lento.receive_from())['type'], 'metricas')
+
+        deltas = []
+        with self.assertLogs('puente_app.consumers', 'WARNING'):
+            await self.registrar(otro, ['N'] * 10)
+            while True:
+                mensaje = json.loads(await lento.receive_from(timeout=5))
+                if 'seq' not in mensaje:
+                    break
+                deltas.append(mensaje)
+        # Lo enviado sin confirmar llena el tope: resincronizar y cierre 4302
+        self.assertLessEqual(len(deltas), 5)
+        self.assertEqual(mensaje['type'], 'resincronizar')
+        self.assertEqual(await lento.receive_output(timeout=1), {'type': 'websocket.close', 'code': CIERRE_ATRASADO})
+
+        # Un cliente que nunca confirmó no se desconecta: recibe los diez deltas
+        recibidos, _ = await self.recibir_deltas(otro, 10)
+        self.assertEqual(len(recibidos), 10)
+        await otro.disconnect()
+
+
+class EstadoSQLiteTests(SimpleTestCase):
+    def setUp(self):
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        self.ruta = os.path.join(directorio.name, 'estado.sqlite3')
+
+    def worker(self):
+        estado = EstadoSQLite(self.ruta, timeout=1, instantanea_cada=20)
+        self.addCleanup(lambda: estado._conexion and estado._conexion.close())
+        return estado
+
+    def registrar(self, estado, n):
+        return [estado._ejecutar('registrar_auto', [{'prioridad': i % 5 + 1}])[0]['id'] for i in range(n)]
+
+    def consultar(self, sql):
+        conexion = sqlite3.connect(self.ruta)
+        try:
+            return conexion.execute(sql).fetchone()
+        finally:
+            conexion.close()
+
+    def test_replicas_con_los_mismos_deltas(self):
+        a, b = self.worker(), self.worker()
+        seqs_a = []
+        for i in range(10):
+            _, deltas = a._ejecutar('registrar_auto', [{}])
+            seqs_a.extend(delta['seq'] for delta, _ in deltas)
+        self.assertEqual([delta['seq'] for delta, _ in b._sincronizar()], seqs_a)
+        self.assertEqual(b.motor.instantanea(), a.motor.instantanea())
+
+    def test_instantanea_y_log_truncado(self):
+        a = self.worker()
+        self.registrar(a, 50)
+        # Instantáneas en 20 y 40: del log se borra hasta la anterior
+        self.assertEqual(self.consultar('SELECT seq FROM instantanea'), (40,))
+        self.assertEqual(self.consultar('SELECT min(seq), max(seq) FROM comandos'), (21, 50))
+
+        nuevo = self.worker()
+        nuevo._ejecutar('estado', [])
+        self.assertEqual(nuevo.motor.instantanea(), a.motor.instantanea())
+
+    def test_worker_rezagado_parte_de_la_instantanea(self):
+        a, lento = self.worker(), self.worker()
+        self.registrar(a, 10)
+        lento._sincronizar()
+        self.registrar(a, 60)
+        # Lo que le falta ya no está en el log
+        self.assertGreater(self.consultar('SELECT min(seq) FROM comandos')[0], 11)
+        lento._sincronizar()
+        self.assertEqual(lento.motor.instantanea(), a.motor.instantanea())
+
+    def test_comando_sin_cambios_no_escribe(self):
+        a = self.worker()
+        self.registrar(a, 3)
+        otro = sqlite3.connect(self.ruta, isolation_level=None)
+        self.addCleanup(otro.close)
+        otro.execute('BEGIN IMMEDIATE')
+        # Con el lock de escritura tomado por otro, un sondeo sin permiso responde igual
+        respuesta, deltas = a._ejecutar('solicitar_cruce', [99999])
+        self.assertFalse(respuesta['success'])
+        self.assertEqual(deltas, [])
+        with self.assertRaises(sqlite3.OperationalError):
+            a._ejecutar('registrar_auto', [{}])
+        otro.execute('ROLLBACK')
+        self.assertEqual(self.consultar('SELECT count(*) FROM comandos'), (3,))
+
+    def test_escritura_concurrente_se_repite_en_orden(self):
+        a, b = self.worker(), self.worker()
+        registrar_auto = a.motor.registrar_auto
+
+        def intercalado(datos):
+            # b escribe mientras la transacción de a todavía es de lectura
+            b._ejecutar('registrar_auto', [{'nombre': 'b'}])
+            a.motor.registrar_auto = registrar_auto
+            return registrar_auto(datos)
+
+        a.motor.registrar_auto = intercalado
+        respuesta, deltas = a._ejecutar('registrar_auto', [{'nombre': 'a'}])
+        self.assertEqual(respuesta['nombre'], 'a')
+        self.assertEqual([(delta['seq'], delta['auto']['nombre']) for delta, _ in deltas], [(1, 'b'), (2, 'a')])
+        b._sincronizar()
+        self.assertEqual(b.motor.instantanea(), a.motor.instantanea())
+
+
+class EstadoPersistenteTests(SimpleTestCase):
+    def setUp(self):
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        self.directorio = directorio.name
+
+    async def reiniciar(self):
+        """Un proceso nuevo sobre el mismo directorio, ya recuperado."""
+        estado = EstadoPersistente(self.directorio, intervalo_escritura=0.01, instantanea_cada=7)
+        self.addCleanup(lambda: estado._log and estado._log.close())
+        with self.assertLogs('puente_app.backends', 'INFO'), self.assertNoLogs('puente_app.motor', 'DEBUG'):
+            await estado.ejecutar('estado', [])
+        return estado
+
+    async def test_recupera_instantanea_y_log(self):
+        estado = await self.reiniciar()
+        for i in range(10):
+            await estado.ejecutar('registrar_auto', [{'prioridad': i % 5 + 1}])
+        await estado.vaciar()
+        # Instantánea en el comando 7; el log tiene los tres siguientes
+        with open(estado.ruta_log, 'rb') as archivo:
+            self.assertEqual([json.loads(linea)[0] for linea in archivo], [8, 9, 10])
+
+        nuevo = await self.reiniciar()
+        self.assertEqual(nuevo.seq, 10)
+        self.assertEqual(nuevo.motor.instantanea(), estado.motor.instantanea())
+        # Después de reaplicar, el motor vuelve a registrar sus eventos
+        self.assertTrue(nuevo.motor.registrar)
+        with self.assertLogs('puente_app.motor', 'DEBUG'):
+            await nuevo.ejecutar('registrar_auto', [{}])
+
+    async def test_ignora_la_ultima_linea_a_medias(self):
+        estado = await self.reiniciar()
+        for _ in range(3):
+            await estado.ejecutar('registrar_auto', [{}])
+        await estado.vaciar()
+        estado._log.close()
+        with open(estado.ruta_log, 'ab') as archivo:
+            archivo.write(b'[4, "registrar_auto", [{')
+
+        nuevo = await self.reiniciar()
+        self.assertEqual(nuevo.seq, 3)
+        self.assertEqual(nuevo.motor.instantanea(), estado.motor.instantanea())
+        # La línea rota se descarta y lo siguiente se escribe en su lugar
+        await nuevo.ejecutar('registrar_auto', [{}])
+        await nuevo.vaciar()
+        otro = await self.reiniciar()
+        self.assertEqual(otro.seq, 4)
+        self.assertEqual(otro.motor.instantanea(), nuevo.motor.instantanea())
+
+
+class EstadoHttpTests(TransactionTestCase):
+    """ETag de estado_puente y estado_colas: 304 mientras las colas no cambian."""
+
+    def setUp(self):
+        cache.clear()
+
+    def registrar(self):
+        return self.client.post(reverse('puente:registrar_auto')).json()['auto_id']
+
+    def consultar(self, etag=None, vista='puente:estado_colas', **params):
+        cabeceras = {'If-None-Match': etag} if etag else {}
+        return self.client.get(reverse(vista), params, headers=cabeceras)
+
+    def assertCambio(self, etag):
+        respuesta = self.consultar(etag)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertNotEqual(respuesta['ETag'], etag)
+        return respuesta['ETag']
+
+    def test_304_hasta_que_cambian_las_colas(self):
+        respuesta = self.consultar()
+        self.assertEqual(respuesta.status_code, 200)
+        etag = respuesta['ETag']
+        for vista in ('puente:estado_colas', 'puente:estado_puente'):
+            self.assertEqual(self.consultar(etag, vista).status_code, 304)
+
+        ids = [self.registrar() for _ in range(4)]
+        etag = self.assertCambio(etag)
+        self.assertEqual(self.consultar(etag).status_code, 304)
+
+        self.client.post(reverse('puente:finalizar_cruce'), {'auto_id': ids[0]}, content_type='application/json')
+        etag = self.assertCambio(etag)
+
+        # Borrados fuera de la API, como los del admin
+        Auto.objects.filter(id__in=ids[1:3]).delete()
+        etag = self.assertCambio(etag)
+        Auto.objects.get(id=ids[3]).delete()
+        etag = self.assertCambio(etag)
+
+        # Con las colas vacías, un registro vuelve a cambiarla
+        self.registrar()
+        self.assertCambio(etag)
+
+    def test_espera_rechaza_timeouts_invalidos(self):
+        for timeout in ('nan', 'inf', '-1', 'x'):
+            respuesta = self.client.get(reverse('puente:esperar_cambio'), {'timeout': timeout})
+            self.assertEqual(respuesta.status_code, 400, timeout)
+        version = json.loads(self.client.get(reverse('puente:esperar_cambio')).content)['version']
+        respuesta = self.client.get(reverse('puente:esperar_cambio'), {'version': version, 'timeout': 0})
+        self.assertEqual(respuesta.status_code, 204)
+
+    def test_paginacion_en_la_clave_del_cuerpo(self):
+        for _ in range(6):
+            self.registrar()
+        todas = self.consultar().json()
+        total = len(todas['cola_norte']) + len(todas['cola_sur'])
+        self.assertEqual(total, 6)
+        etag = None
+        for limit, after in ((1, 0), (2, 0), (2, 1), (None, 1)):
+            params = {'limit': limit or '', 'after': after}
+            respuesta = self.consultar(**params)
+            # Misma versión para todas las páginas, cada una con su cuerpo
+            etag = etag or respuesta['ETag']
+            self.assertEqual(respuesta['ETag'], etag)
+            for nombre in ('cola_norte', 'cola_sur'):
+                esperados = [a for a in todas[nombre] if a['turno'] > after]
+                self.assertEqual(respuesta.json()[nombre], esperados[:limit])
+        self.assertEqual(self.consultar(limit=0).status_code, 400)
+
+
+class BuclePuenteTests(SimpleTestCase):
+    async def test_error_al_publicar_no_detiene_el_bucle(self):
+        bucle = BuclePuente(EstadoMemoria())
+        publicar = bucle._publicar
+
+        def fallar(deltas):
+            bucle._publicar = publicar
+            raise RuntimeError('capa de canales caída')
+
+        bucle._publicar = fallar
+        with self.assertLogs('puente_app.bucle', 'ERROR'):
+            primero = await asyncio.wait_for(bucle.ejecutar('registrar_auto', {}), 1)
+        tarea = bucle._tarea
+        segundo = await asyncio.wait_for(bucle.ejecutar('registrar_auto', {}), 1)
+        self.assertEqual(segundo['id'], primero['id'] + 1)
+        self.assertIs(bucle._tarea, tarea)
+
+    def registrar_publicados(self, bucle):
+        """Anotar (tipo, autos en el puente) de cada delta que publica el bucle."""
+        publicados = []
+        publicar = bucle._publicar
+
+        def anotar(deltas):
+            en_puente = len(bucle.backend.motor.autos_en_puente)
+            publicados.extend((mensaje['type'], en_puente) for mensaje, _ in deltas)
+            publicar(deltas)
+
+        bucle._publicar = anotar
+        return publicados
+
+    @override_settings(PUENTE_CRUCE_AUTOMATICO={'ESCALA': 0.001}, PUENTES_PERMITIDOS=None)
+    async def test_cruces_automaticos_terminan_y_admiten_al_siguiente(self):
+        bucle = obtener_bucle('prueba_cruces_automaticos')
+        publicados = self.registrar_publicados(bucle)
+        # 120 km/h: 15 s de cruce, 15 ms con la escala
+        await bucle.ejecutar('registrar_autos', [{'velocidad': 120, 'direccion': d} for d in 'NSN'])
+        limite = time.monotonic() + 2
+        while bucle.backend.motor.autos and time.monotonic() < limite:
+            await asyncio.sleep(0.01)
+
+        self.assertEqual(bucle.backend.motor.autos, {})
+        tipos = [tipo for tipo, _ in publicados]
+        self.assertEqual(tipos.count('auto_cruzando'), 3)
+        self.assertEqual(tipos.count('auto_salio'), 3)
+        # Capacidad 1: cada auto entra recién cuando salió el anterior
+        self.assertTrue(all(en_puente <= 1 for _, en_puente in publicados))
+        self.assertEqual(bucle._cruces, {})
+
+    async def test_temporizador_vencido_no_corta_un_cruce_posterior(self):
+        # Escala 1: los plazos (30 s) no vencen durante la prueba
+        bucle = BuclePuente(EstadoMemoria(), escala_cruces=1.0)
+        auto_id = (await bucle.ejecutar('registrar_auto', {'vueltas': 2}))['id']
+        await bucle.ejecutar('estado')  # después de la admisión
+        primer_plazo = bucle._cruces[auto_id]
+
+        # El cliente termina antes el primer cruce; el auto vuelve a entrar en el otro sentido
+        await bucle.ejecutar('finalizar_cruce', auto_id)
+        await bucle.ejecutar('estado')
+        self.assertIsNone(primer_plazo[2])  # su plazo se canceló
+        self.assertIn(auto_id, bucle.backend.motor.autos_en_puente)
+
+        # Un plazo del primer cruce que llega tarde (cruzadas=0) no termina el segundo
+        self.assertIsNone(await bucle.ejecutar('finalizar_cruce', auto_id, 0))
+        self.assertIn(auto_id, bucle.backend.motor.autos_en_puente)
+        await bucle.ejecutar('finalizar_cruce', auto_id, 1)
+        self.assertNotIn(auto_id, bucle.backend.motor.autos)
+        self.assertEqual(bucle._cruces, {})
+
+    async def test_resetear_cancela_los_plazos(self):
+        bucle = BuclePuente(EstadoMemoria(), escala_cruces=1.0)
+        await bucle.ejecutar('registrar_autos', [{'direccion': 'N'}, {'direccion': 'S'}])
+        await bucle.ejecutar('estado')
+        plazos = list(bucle._cruces.values())
+        self.assertEqual(len(plazos), 1)
+        await bucle.ejecutar('resetear_sistema')
+        self.assertEqual(bucle._cruces, {})
+        self.assertTrue(all(plazo[2] is None for plazo in plazos))
+
+
+class ColaDireccionTests(TestCase):
+    """El resumen de cada cola contra lo que hay en la tabla Auto."""
+
+    def crear(self, direccion, tiempo_cruce=10.0):
+        return views._crear_auto(direccion, 60.0, tiempo_cruce)
+
+    def comprobar(self, direccion):
+        cola = ColaDireccion.objects.get(direccion=direccion)
+        autos = Auto.objects.filter(direccion=direccion)
+        self.assertEqual(cola.cantidad, autos.count())
+        self.assertAlmostEqual(cola.tiempo_total, autos.aggregate(total=Sum('tiempo_cruce'))['total'] or 0)
+        self.assertEqual(cola.cabeza, autos.order_by('turno').first())
+        return cola
+
+    def test_turnos_unicos_y_sin_huecos(self):
+        for i in range(5):
+            for direccion in ('N', 'S'):
+                auto, posicion = self.crear(direccion, tiempo_cruce=i + 1.0)
+                self.assertEqual((auto.turno, posicion), (i + 1, i + 1))
+                # Espera: la suma de los tiempos de cruce de los de adelante
+                self.assertAlmostEqual(auto.tiempo_espera, sum(range(1, i + 1)))
+        for direccion in ('N', 'S'):
+            self.assertEqual(self.comprobar(direccion).ultimo_turno, 5)
+
+    def test_quitar_el_primero_y_uno_del_medio(self):
+        autos = [self.crear('N', tiempo_cruce=t)[0] for t in (1.0, 2.0, 4.0, 8.0)]
+        autos[2].delete()
+        self.assertEqual(self.comprobar('N').cabeza, autos[0])
+        autos[0].delete()
+        cola = self.comprobar('N')
+        self.assertEqual(cola.cabeza, autos[1])
+        self.assertEqual(cola.cantidad, 2)
+        self.assertAlmostEqual(cola.tiempo_total, 10.0)
+        # El siguiente turno no reutiliza los de los autos que salieron
+        self.assertEqual(self.crear('N')[0].turno, 5)
+        self.comprobar('N')
+
+    def test_borrar_varios_del_frente_con_queryset(self):
+        autos = [self.crear('S')[0] for _ in range(5)]
+        self.crear('N')
+        Auto.objects.filter(id__in=[autos[0].id, autos[1].id, autos[3].id]).delete()
+        self.assertEqual(self.comprobar('S').cabeza, autos[2])
+        self.assertEqual(self.comprobar('N').cantidad, 1)
+
+    def test_registrar_despues_de_vaciar_la_cola(self):
+        for _ in range(3):
+            self.crear('N')
+        Auto.objects.filter(direccion='N').delete()
+        cola = self.comprobar('N')
+        self.assertEqual((cola.cantidad, cola.tiempo_total, cola.cabeza), (0, 0, None))
+        auto, posicion = self.crear('N', tiempo_cruce=7.0)
+        self.assertEqual((auto.turno, posicion, auto.tiempo_espera), (4, 1, 0))
+        self.assertEqual(self.comprobar('N').cabeza, auto)
+
+
+class ColasConVentanaTests(TestCase):
+    """posicion y espera de Auto.objects.colas(), calculadas con funciones de ventana."""
+
+    def test_posicion_y_espera_por_direccion(self):
+        tiempos = {'N': [3.0, 5.0, 7.0, 11.0, 13.0], 'S': [2.0, 4.0, 6.0]}
+        autos = {d: [views._crear_auto(d, 60.0, t)[0] for t in ts] for d, ts in tiempos.items()}
+        # Salen el primero y uno del medio del norte: los turnos no se renumeran
+        autos['N'][0].delete()
+        autos['N'][2].delete()
+        esperados = {'N': [5.0, 11.0, 13.0], 'S': [2.0, 4.0, 6.0]}
+
+        filas = list(Auto.objects.colas())
+        self.assertEqual([a.direccion for a in filas], ['N'] * 3 + ['S'] * 3)
+        for direccion, tiempos_cola in esperados.items():
+            cola = [a for a in filas if a.direccion == direccion]
+            self.assertEqual([a.tiempo_cruce for a in cola], tiempos_cola)
+            self.assertEqual([a.posicion for a in cola], [1, 2, 3])
+            # Espera: suma de los tiempos de cruce de los de adelante en su cola
+            self.assertEqual([a.espera for a in cola], [sum(tiempos_cola[:i]) for i in range(3)])
+        self.assertEqual([a.id for a in Auto.objects.cola('S')], [a.id for a in autos['S']])
+
+    def test_filtrar_por_posicion(self):
+        for t in range(1, 6):
+            views._crear_auto('N', 60.0, float(t))
+        # El filtro sobre la ventana se aplica después de numerar toda la cola
+        cola = Auto.objects.cola('N').filter(posicion__gt=2)
+        self.assertEqual([(a.posicion, a.espera) for a in cola], [(3, 3.0), (4, 6.0), (5, 10.0)])
+
+
+class RegistroConcurrenteTests(TransactionTestCase):
+    """Versión chica del escenario 'turnos' de puente_bench."""
+
+    def test_turnos_unicos_con_registros_concurrentes(self):
+        def registrar(cantidad):
+            try:
+                return [views._crear_auto(direccion, 60.0, 1.0)[0]
+                        for direccion in random.Random(cantidad).choices('NS', k=cantidad)]
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=8) as ejecutor:
+            autos = sum(ejecutor.map(registrar, range(20, 28)), [])
+        for direccion in ('N', 'S'):
+            turnos = sorted(a.turno for a in autos if a.direccion == direccion)
+            self.assertEqual(turnos, list(range(1, len(turnos) + 1)))
+            cola = ColaDireccion.objects.get(direccion=direccion)
+            self.assertEqual((cola.ultimo_turno, cola.cantidad), (len(turnos), len(turnos)))
+            self.assertEqual(cola.cabeza.turno, 1)
+
+
+class ApiRestTests(TestCase):
+    """Vistas async de registro y cruce, llamadas con AsyncClient."""
+
+    async def registrar(self):
+        respuesta = await self.async_client.post(reverse('puente:registrar_auto'))
+        self.assertEqual(respuesta.status_code, 200)
+        return respuesta.json()
+
+    async def cruce(self, vista, auto_id):
+        return await self.async_client.post(reverse(vista), {'auto_id': auto_id}, content_type='application/json')
+
+    async def test_registrar(self):
+        datos = [await self.registrar() for _ in range(6)]
+        for direccion in ('Norte a Sur', 'Sur a Norte'):
+            cola = [d for d in datos if d['direccion'] == direccion]
+            self.assertEqual([d['turno'] for d in cola], list(range(1, len(cola) + 1)))
+            # Cada uno espera lo que tardan en cruzar los de adelante
+            esperas = [sum(d['tiempo_cruce'] for d in cola[:i]) for i in range(len(cola))]
+            for d, espera in zip(cola, esperas):
+                self.assertAlmostEqual(d['tiempo_espera'], espera, delta=0.05)
+        self.assertEqual(await Auto.objects.acount(), 6)
+        self.assertEqual((await self.async_client.get(reverse('puente:registrar_auto'))).status_code, 405)
+
+    async def test_solicitar_y_finalizar_cruce(self):
+        # La dirección es al azar: se registra hasta tener dos autos en la misma cola
+        colas = {}
+        while not any(len(ids) == 2 for ids in colas.values()):
+            datos = await self.registrar()
+            colas.setdefault(datos['direccion'], []).append(datos['auto_id'])
+        primero, segundo = next(ids for ids in colas.values() if len(ids) == 2)
+        self.assertTrue((await self.cruce('puente:solicitar_cruce', primero)).json()['permiso'])
+        self.assertFalse((await self.cruce('puente:solicitar_cruce', segundo)).json()['permiso'])
+
+        respuesta = await self.cruce('puente:finalizar_cruce', primero)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertFalse(await Auto.objects.filter(id=primero).aexists())
+        # Al salir el primero, la señal post_delete pasa al frente al siguiente
+        self.assertTrue((await self.cruce('puente:solicitar_cruce', segundo)).json()['permiso'])
+
+    async def test_cruce_de_un_auto_inexistente(self):
+        for vista in ('puente:solicitar_cruce', 'puente:finalizar_cruce'):
+            respuesta = await self.cruce(vista, 12345)
+            self.assertEqual(respuesta.status_code, 400)
+            self.assertFalse(respuesta.json()['success'])
+
+
+class ColaSalidaTests(SimpleTestCase):
+    async def sacar(self, salida, n):
+        return [await asyncio.wait_for(salida.siguiente(), 1) for _ in range(n)]
+
+    def test_tope_de_mensajes_y_bytes(self):
+        salida = ColaSalida(max_mensajes=3, max_bytes=10)
+        self.assertTrue(salida.agregar('auto_registrado', 'aaaa', 1))
+        self.assertTrue(salida.agregar('auto_registrado', 'bbbb', 2))
+        self.assertFalse(salida.agregar('auto_registrado', 'cccc', 3))  # 12 bytes
+        self.assertEqual((len(salida), salida.bytes), (3, 12))
+        salida.vaciar()
+        self.assertEqual((len(salida), salida.bytes), (0, 0))
+        for seq in range(3):
+            self.assertTrue(salida.agregar('auto_registrado', 'a', seq))
+        self.assertFalse(salida.agregar('auto_registrado', 'a', 3))
+
+    async def test_sin_confirmaciones_solo_cuenta_lo_pendiente(self):
+        salida = ColaSalida(max_mensajes=2, max_bytes=1000)
+        for seq in range(1, 6):
+            self.assertTrue(salida.agregar('auto_registrado', f'd{seq}', seq))
+            self.assertEqual(await self.sacar(salida, 1), [f'd{seq}'])
+        self.assertEqual((salida.en_vuelo, salida.bytes_en_vuelo), (0, 0))
+
+    async def test_lo_enviado_sin_confirmar_cuenta_para_el_tope(self):
+        salida = ColaSalida(max_mensajes=3, max_bytes=1000)
+        salida.confirmar(0)
+        for seq in (1, 2, 3):
+            self.assertTrue(salida.agregar('auto_registrado', 'xx', seq))
+        self.assertEqual(await self.sacar(salida, 3), ['xx'] * 3)
+        self.assertEqual((len(salida), salida.en_vuelo, salida.bytes_en_vuelo), (0, 3, 6))
+        self.assertFalse(salida.agregar('auto_registrado', 'xx', 4))
+
+        # Confirmar hasta 2 libera esos dos
+        salida.confirmar(2)
+        self.assertEqual((salida.en_vuelo, salida.bytes_en_vuelo), (1, 2))
+        self.assertTrue(salida.agregar('auto_registrado', 'xx', 5))
+        # Una confirmación vieja no cambia nada
+        salida.confirmar(1)
+        self.assertEqual(salida.en_vuelo, 1)
+
+    async def test_resumen_se_reemplaza_en_su_lugar(self):
+        salida = ColaSalida(max_mensajes=10, max_bytes=1000)
+        salida.agregar('resumen', 'r1', 1)
+        salida.agregar('auto_registrado', 'delta', 2)
+        salida.agregar('resumen', 'r3-nuevo', 3)
+        self.assertEqual((len(salida), salida.bytes), (2, len('r3-nuevo') + len('delta')))
+        self.assertEqual(await self.sacar(salida, 2), ['r3-nuevo', 'delta'])
+        # Ya enviado, el siguiente resumen va al final
+        salida.agregar('auto_registrado', 'otro', 4)
+        salida.agregar('resumen', 'r5', 5)
+        self.assertEqual(await self.sacar(salida, 2), ['otro', 'r5'])
+        self.assertEqual(salida.bytes, 0)
+
+
+class PlanificadorTests(SimpleTestCase):
+    def setUp(self):
+        self.llegadas = 0
+
+    def auto(self, direccion, prioridad=3):
+        self.llegadas += 1
+        return SimpleNamespace(id=self.llegadas, direccion=direccion, prioridad=prioridad, llegada=self.llegadas)
+
+    def encolar(self, planificador, direcciones, prioridad=3):
+        autos = [self.auto(d, prioridad) for d in direcciones]
+        for auto in autos:
+            planificador.encolar(auto)
+        return autos
+
+    def entrar_todos(self, planificador, autos):
+        """Dirección de cada auto en el orden en que entra (un auto a la vez)."""
+        por_id = {a.id: a for a in autos}
+        orden = []
+        while (auto_id := planificador.candidato()) is not None:
+            planificador.entrar(por_id[auto_id])
+            orden.append(por_id[auto_id].direccion)
+        return ''.join(orden)
+
+    def test_capacidad_y_sentido(self):
+        planificador = PrioridadEstricta(capacidad=2)
+        norte, otro_norte, tercero, sur = (self.auto(d) for d in 'NNNS')
+        self.assertTrue(planificador.puede_entrar(norte, []))
+        self.assertTrue(planificador.puede_entrar(otro_norte, [norte]))
+        self.assertFalse(planificador.puede_entrar(tercero, [norte, otro_norte]))
+        self.assertFalse(planificador.puede_entrar(sur, [norte]))
+        with self.assertRaises(ValueError):
+            PrioridadEstricta(capacidad=0)
+
+    def test_lotes_alternados(self):
+        planificador = LotesAlternados(lote=2)
+        autos = self.encolar(planificador, 'NSNSNSNS')
+        self.assertEqual(self.entrar_todos(planificador, autos), 'NNSSNNSS')
+        # El último lote (S) está completo: el próximo auto del norte pasa primero
+        autos = self.encolar(planificador, 'SSN')
+        self.assertEqual(self.entrar_todos(planificador, autos), 'NSS')
+
+        # Sin autos en el otro sentido el lote se extiende
+        planificador = LotesAlternados(lote=2)
+        autos = self.encolar(planificador, 'SSSSSN')
+        self.assertEqual(self.entrar_todos(planificador, autos), 'SSNSSS')
+
+    def esperar_bajo_trafico(self, planificador, cruces):
+        """Cruces hasta que entra un auto de prioridad 5 con otro de prioridad 1 siempre esperando."""
+        lento = self.auto('N', prioridad=5)
+        planificador.encolar(lento)
+        for cruce in range(cruces):
+            rapido = self.auto('N', prioridad=1)
+            planificador.encolar(rapido)
+            if planificador.candidato() == lento.id:
+                return cruce
+            planificador.entrar(rapido)
+        return None
+
+    def test_envejecimiento(self):
+        self.assertIsNone(self.esperar_bajo_trafico(PrioridadEstricta(), 50))
+        # k = 2: gana un nivel cada dos cruces, 4 niveles en 8 cruces
+        self.assertEqual(self.esperar_bajo_trafico(PrioridadEstricta(envejecimiento=2), 50), 8)
+
+    def test_restaurar_continua_las_mismas_decisiones(self):
+        original = LotesAlternados(lote=3, envejecimiento=4)
+        autos = self.encolar(original, 'NSNSNSNSNS')
+        autos += self.encolar(original, 'SN', prioridad=1)
+        por_id = {a.id: a for a in autos}
+        for _ in range(4):
+            original.entrar(por_id[original.candidato()])
+
+        copia = LotesAlternados(lote=3, envejecimiento=4)
+        copia.restaurar(json.loads(json.dumps(original.instantanea())))
+        self.assertEqual((copia.sentido, copia.servidos, copia.entradas),
+                         (original.sentido, original.servidos, original.entradas))
+        self.assertEqual(self.entrar_todos(copia, autos), self.entrar_todos(original, autos))
+
+
+class MotorPuenteTests(SimpleTestCase):
+    def test_rechaza_velocidades_sin_tiempo_de_cruce_finito(self):
+        motor = MotorPuente()
+        for velocidad in (0, -5, 'nan', 'inf', '-inf', 1e-310):
+            with self.assertRaises(ValueError, msg=velocidad):
+                motor.registrar_auto({'velocidad': velocidad})
+        self.assertEqual(motor.autos, {})
+        auto, _ = motor.registrar_auto({'velocidad': 1e-300})
+        self.assertTrue(math.isfinite(auto['tiempo_cruce']))
+
+
+class CapaQueFalla:
+    """Capa de canales cuyo group_send falla las primeras `fallas` veces."""
+
+    def __init__(self, fallas):
+        self.fallas = fallas
+        self.enviados = []
+
+    async def group_send(self, grupo, mensaje):
+        if self.fallas:
+            self.fallas -= 1
+            raise ConnectionError('capa de canales caída')
+        self.enviados.append(json.loads(mensaje['texto']))
+
+
+class DifusorPuenteTests(SimpleTestCase):
+    def seqs(self, capa):
+        return [delta['seq'] for mensaje in capa.enviados for delta in mensaje.get('eventos', [mensaje])]
+
+    async def test_un_envio_fallido_sale_con_el_siguiente(self):
+        capa = CapaQueFalla(fallas=1)
+        difusor = difusion.DifusorPuente(capa, 'grupo', hz=0)
+        with mock.patch.object(difusion, 'REINTENTO_ENVIO', 0.01):
+            with self.assertLogs('puente_app.difusion', 'ERROR'):
+                difusor.publicar({'type': 'auto_registrado', 'seq': 1})
+                await asyncio.sleep(0.001)
+            difusor.publicar({'type': 'auto_registrado', 'seq': 2})
+            await asyncio.sleep(0.05)  # también termina el reintento, sin nada pendiente
+        # El delta que falló sale antes que el nuevo, en el mismo mensaje
+        self.assertEqual(capa.enviados[0]['type'], 'lote')
+        self.assertEqual(self.seqs(capa), [1, 2])
+        self.assertEqual(difusor.mensajes_enviados, 1)
+        self.assertEqual(difusor._envios, set())
+
+    async def test_reintenta_sin_nuevos_eventos(self):
+        capa = CapaQueFalla(fallas=2)
+        difusor = difusion.DifusorPuente(capa, 'grupo', hz=0)
+        with mock.patch.object(difusion, 'REINTENTO_ENVIO', 0.01), self.assertLogs('puente_app.difusion', 'ERROR'):
+            difusor.publicar({'type': 'auto_cruzando', 'seq': 7}, urgente=True)
+            limite = time.monotonic() + 1
+            while not capa.enviados and time.monotonic() < limite:
+                await asyncio.sleep(0.01)
+        self.assertEqual(self.seqs(capa), [7])
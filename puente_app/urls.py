@@ -11,4 +11,7 @@ urlpatterns = [
     path('api/finalizar-cruce/', views.finalizar_cruce, name='finalizar_cruce'),
     path('api/estado-puente/', views.estado_puente, name='estado_puente'),
     path('api/estado-colas/', views.estado_colas, name='estado_colas'),
+    path('api/eventos/', views.eventos, name='eventos'),
+    path('api/eventos/espera/', views.esperar_cambio, name='esperar_cambio'),
+    path('metrics', views.exportar_metricas, name='metricas'),
 ] 
\ No newline at end of file
@@ -1,51 +1,74 @@
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 import json
+import math
 import random
 import asyncio
+import time
 from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
-from .models import Auto
-
-LONGITUD_PUENTE = 500  # metros
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Q
+from . import metricas
+from .bucle import obtener_bucle
+from .models import Auto, ColaDireccion
+from .motor import LONGITUD_PUENTE
+from .puentes import PUENTE_POR_DEFECTO, atiende, nombre_grupo, puente_valido, servidor_de
 
 def index(request):
     """Vista principal del sistema del puente"""
     return render(request, 'index.html')
 
+# Las vistas de la API son async y usan el ORM async. Las partes que deben
+# ser una sola transacción van en funciones síncronas con transaction.atomic,
+# que no funciona en código async, y se llaman con sync_to_async.
+
+@transaction.atomic
+def _crear_auto(direccion, velocidad, tiempo_cruce):
+    # El turno es el siguiente de la secuencia de la dirección: los turnos
+    # no se renumeran al salir un auto, la posición se deriva de su orden.
+    # El tiempo de espera es la suma de los tiempos de cruce de los autos delante
+    turno, posicion, tiempo_espera = ColaDireccion.reservar_turno(direccion, tiempo_cruce)
+    auto = Auto.objects.create(
+        direccion=direccion,
+        velocidad=velocidad,
+        turno=turno,
+        tiempo_cruce=tiempo_cruce,
+        tiempo_espera=tiempo_espera
+    )
+    ColaDireccion.agregar(auto)
+    return auto, posicion
+
+@transaction.atomic
+def _eliminar_auto(auto_id):
+    # El resumen de la cola lo descuenta la señal post_delete de Auto
+    Auto.objects.get(id=auto_id).delete()
+
 @csrf_exempt
 @require_http_methods(["POST"])
-def registrar_auto(request):
+@metricas.medir_vista
+async def registrar_auto(request):
     """Registrar un nuevo auto en el sistema, asignando dirección, velocidad, turno y tiempos automáticamente"""
     try:
         # Dirección aleatoria
         direccion = random.choice(['N', 'S'])
         # Velocidad aleatoria entre 20 y 60 km/h
         velocidad = random.uniform(20, 60)
-        # Obtener la cola correspondiente
-        cola = Auto.objects.filter(direccion=direccion).order_by('turno')
-        turno = cola.count() + 1
         # Calcular tiempo de cruce (en segundos)
         velocidad_m_s = velocidad * 1000 / 3600  # convertir km/h a m/s
         tiempo_cruce = LONGITUD_PUENTE / velocidad_m_s
-        # Calcular tiempo de espera: suma de los tiempos de cruce de los autos delante
-        tiempo_espera = sum([a.tiempo_cruce for a in cola])
         # Crear el auto
-        auto = Auto.objects.create(
-            direccion=direccion,
-            velocidad=velocidad,
-            turno=turno,
-            tiempo_cruce=tiempo_cruce,
-            tiempo_espera=tiempo_espera
-        )
+        auto, posicion = await sync_to_async(_crear_auto)(direccion, velocidad, tiempo_cruce)
         return JsonResponse({
             'success': True,
             'auto_id': auto.id,
             'direccion': auto.get_direccion_display(),
             'velocidad': round(auto.velocidad, 2),
-            'turno': auto.turno,
+            'turno': posicion,
             'tiempo_cruce': round(auto.tiempo_cruce, 2),
             'tiempo_espera': round(auto.tiempo_espera, 2),
             'message': f'Auto registrado exitosamente en la cola {auto.get_direccion_display()}'
@@ -58,15 +81,16 @@ def registrar_auto(request):
 
 @csrf_exempt
 @require_http_methods(["POST"])
-def solicitar_cruce(request):
+@metricas.medir_vista
+async def solicitar_cruce(request):
     """Permitir el cruce solo al auto con turno 1 en su cola"""
     try:
         data = json.loads(request.body)
         auto_id = data.get('auto_id')
-        auto = Auto.objects.get(id=auto_id)
+        auto = await Auto.objects.aget(id=auto_id)
         # Buscar el auto con turno 1 en la cola correspondiente
-        primero = Auto.objects.filter(direccion=auto.direccion).order_by('turno').first()
-        if primero and primero.id == auto.id:
+        primero_id = await ColaDireccion.objects.filter(direccion=auto.direccion).values_list('cabeza_id', flat=True).afirst()
+        if primero_id == auto.id:
             return JsonResponse({
                 'success': True,
                 'permiso': True,
@@ -87,26 +111,15 @@ def solicitar_cruce(request):
 
 @csrf_exempt
 @require_http_methods(["POST"])
-def finalizar_cruce(request):
-    """Eliminar el auto que cruzó y actualizar turnos y tiempos de espera de la cola"""
+@metricas.medir_vista
+async def finalizar_cruce(request):
+    """Eliminar el auto que cruzó. Las posiciones y tiempos de espera de los
+    autos restantes se derivan del turno al consultarlos, no hay que reescribirlos"""
     try:
         data = json.loads(request.body)
         auto_id = data.get('auto_id')
-        auto = Auto.objects.get(id=auto_id)
-        direccion = auto.direccion
         # Eliminar el auto que cruzó
-        auto.delete()
-        # Actualizar turnos y tiempos de espera de los autos restantes en la cola
-        cola = Auto.objects.filter(direccion=direccion).order_by('turno')
-        tiempo_acumulado = 0
-        for idx, a in enumerate(cola, start=1):
-            velocidad_m_s = a.velocidad * 1000 / 3600
-            tiempo_cruce = LONGITUD_PUENTE / velocidad_m_s
-            a.turno = idx
-            a.tiempo_espera = tiempo_acumulado
-            a.tiempo_cruce = tiempo_cruce
-            a.save()
-            tiempo_acumulado += tiempo_cruce
+        await sync_to_async(_eliminar_auto)(auto_id)
         return JsonResponse({
             'success': True,
             'mensaje': 'Cruce finalizado y cola actualizada.'
@@ -117,55 +130,223 @@ def finalizar_cruce(request):
             'error': str(e)
         }, status=400)
 
-def estado_puente(request):
+def _datos_en_cola(a):
+    """Auto de Auto.objects.cola(): el turno que ve el cliente es su posición actual"""
+    return {
+        'id': a.id,
+        'turno': a.posicion,
+        'velocidad': round(a.velocidad, 2),
+        'tiempo_cruce': round(a.tiempo_cruce, 2),
+        'tiempo_espera': round(a.espera, 2)
+    }
+
+# La versión de las vistas de estado sale de ColaDireccion, en una consulta de
+# dos filas: un registro sube ultimo_turno y un borrado (también desde el
+# admin o con QuerySet.delete()) baja cantidad, así que cualquier cambio de
+# las colas da otra versión, y todos los workers ven la misma porque está en
+# la base. El ETag es esa versión: un If-None-Match vigente recibe 304 sin
+# leer la tabla Auto ni codificar JSON. El cuerpo se guarda en el cache de
+# Django con la versión en la clave; con un cache por proceso cada worker
+# codifica una vez cada versión.
+async def _version_estado():
+    filas = ColaDireccion.objects.order_by('direccion').values_list('direccion', 'pk', 'ultimo_turno', 'cantidad')
+    # El pk cambia si se recrean las filas, con los contadores otra vez en 0
+    return '-'.join([f'{direccion}{pk}.{ultimo}.{cantidad}'
+                     async for direccion, pk, ultimo, cantidad in filas]) or 'vacio'
+
+def _leer_paginacion(request):
+    """?limit=N&after=P: hasta N autos por cola, a partir de la posición (turno) P"""
+    limit = request.GET.get('limit')
+    after = request.GET.get('after')
+    limit = int(limit) if limit else None
+    after = int(after) if after else 0
+    if (limit is not None and limit < 1) or after < 0:
+        raise ValueError('limit debe ser mayor que 0 y after no puede ser negativo')
+    return limit, after
+
+async def _colas_paginadas(limit, after, cabeza=False):
+    """Autos de ambas colas en una consulta, con las posiciones entre after y
+    after + limit (más el primero de cada cola si cabeza=True), separados por dirección"""
+    filtro = Q(posicion__gt=after)
+    if limit is not None:
+        filtro &= Q(posicion__lte=after + limit)
+    if cabeza:
+        filtro |= Q(posicion=1)
+    colas = {'N': [], 'S': []}
+    async for a in Auto.objects.colas().filter(filtro):
+        colas[a.direccion].append(_datos_en_cola(a))
+    return colas
+
+async def _respuesta_estado(request, nombre, construir):
+    version = await _version_estado()
+    etag = f'"{version}"'
+    if request.headers.get('If-None-Match') == etag:
+        respuesta = HttpResponseNotModified()
+    else:
+        try:
+            limit, after = _leer_paginacion(request)
+        except ValueError as e:
+            return JsonResponse({'success': False, 'error': str(e)}, status=400)
+        clave = f'puente:estado:{nombre}:{version}:{limit}:{after}'
+        cuerpo = await cache.aget(clave)
+        if cuerpo is None:
+            cuerpo = json.dumps(await construir(limit, after), cls=DjangoJSONEncoder).encode()
+            # Si las colas cambiaron mientras se leían, el cuerpo puede ser más
+            # nuevo que la versión: se envía, pero no se guarda con esa clave
+            if await _version_estado() == version:
+                await cache.aset(clave, cuerpo)
+        respuesta = HttpResponse(cuerpo, content_type='application/json')
+    respuesta['ETag'] = etag
+    respuesta['Cache-Control'] = 'no-cache'  # el cliente revalida siempre con el ETag
+    return respuesta
+
+async def _construir_estado_puente(limit, after):
+    # El primero de cada cola está cruzando; la paginación es sobre el resto
+    colas = await _colas_paginadas(limit, max(after, 1), cabeza=True)
+    cruzando = {}
+    for direccion in colas:
+        if colas[direccion] and colas[direccion][0]['turno'] == 1:
+            cruzando[direccion] = colas[direccion].pop(0)
+    return {
+        'cruzando_norte': cruzando.get('N'),
+        'cruzando_sur': cruzando.get('S'),
+        'cola_norte': colas['N'],
+        'cola_sur': colas['S']
+    }
+
+async def _construir_estado_colas(limit, after):
+    colas = await _colas_paginadas(limit, after)
+    return {
+        'cola_norte': colas['N'],
+        'cola_sur': colas['S']
+    }
+
+@metricas.medir_vista
+async def estado_puente(request):
     """Mostrar el auto que está cruzando (turno 1 de cada cola) y las colas restantes"""
-    auto_norte = Auto.objects.filter(direccion='N').order_by('turno').first()
-    auto_sur = Auto.objects.filter(direccion='S').order_by('turno').first()
-    cola_norte = list(Auto.objects.filter(direccion='N', turno__gt=1).order_by('turno').values('id', 'turno', 'velocidad', 'tiempo_cruce', 'tiempo_espera'))
-    cola_sur = list(Auto.objects.filter(direccion='S', turno__gt=1).order_by('turno').values('id', 'turno', 'velocidad', 'tiempo_cruce', 'tiempo_espera'))
-    return JsonResponse({
-        'cruzando_norte': {
-            'id': auto_norte.id,
-            'turno': auto_norte.turno,
-            'velocidad': round(auto_norte.velocidad, 2),
-            'tiempo_cruce': round(auto_norte.tiempo_cruce, 2),
-            'tiempo_espera': round(auto_norte.tiempo_espera, 2)
-        } if auto_norte else None,
-        'cruzando_sur': {
-            'id': auto_sur.id,
-            'turno': auto_sur.turno,
-            'velocidad': round(auto_sur.velocidad, 2),
-            'tiempo_cruce': round(auto_sur.tiempo_cruce, 2),
-            'tiempo_espera': round(auto_sur.tiempo_espera, 2)
-        } if auto_sur else None,
-        'cola_norte': cola_norte,
-        'cola_sur': cola_sur
-    })
-
-def estado_colas(request):
+    return await _respuesta_estado(request, 'puente', _construir_estado_puente)
+
+@metricas.medir_vista
+async def estado_colas(request):
     """Obtener el estado actual de las colas Norte y Sur"""
-    cola_norte = Auto.objects.filter(direccion='N').order_by('turno')
-    cola_sur = Auto.objects.filter(direccion='S').order_by('turno')
+    return await _respuesta_estado(request, 'colas', _construir_estado_colas)
+
+# Alternativas HTTP al WebSocket para pantallas de solo lectura. Se suscriben
+# al mismo grupo de la capa de canales que PuenteConsumer y reciben los mismos
+# deltas, ya codificados por el difusor.
+INTERVALO_LATIDO = 15  # segundos sin eventos antes de enviar un comentario SSE
+ESPERA_MAXIMA = 60  # segundos, tope de ?timeout= en el long-poll
+
+def _sin_capa_de_canales():
     return JsonResponse({
-        'cola_norte': [
-            {
-                'id': a.id,
-                'turno': a.turno,
-                'velocidad': round(a.velocidad, 2),
-                'tiempo_cruce': round(a.tiempo_cruce, 2),
-                'tiempo_espera': round(a.tiempo_espera, 2)
-            } for a in cola_norte
-        ],
-        'cola_sur': [
-            {
-                'id': a.id,
-                'turno': a.turno,
-                'velocidad': round(a.velocidad, 2),
-                'tiempo_cruce': round(a.tiempo_cruce, 2),
-                'tiempo_espera': round(a.tiempo_espera, 2)
-            } for a in cola_sur
-        ]
-    })
+        'success': False,
+        'error': 'No hay una capa de canales configurada'
+    }, status=503)
+
+def _leer_puente(request):
+    """(puente, None) con el ?puente= pedido, o (None, respuesta de error)"""
+    puente = request.GET.get('puente', PUENTE_POR_DEFECTO)
+    if not puente_valido(puente):
+        return None, JsonResponse({
+            'success': False,
+            'error': 'Puente inválido'
+        }, status=400)
+    if not atiende(puente):
+        return None, JsonResponse({
+            'success': False,
+            'error': 'El puente lo atiende otro worker',
+            'servidor': servidor_de(puente)
+        }, status=421)
+    return puente, None
+
+async def eventos(request):
+    """Server-Sent Events: primero el estado completo (estado_inicial) y luego
+    cada delta del puente, con su seq como id del evento. Si el cliente ve un
+    hueco en la secuencia, reconecta y recibe un estado nuevo.
+
+    Last-Event-ID no se usa: cada conexión empieza con el estado completo y
+    su versión, así que tras un reinicio, con la secuencia otra vez en 0, el
+    cliente no descarta los deltas nuevos como ya vistos."""
+    puente, error = _leer_puente(request)
+    if error:
+        return error
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return _sin_capa_de_canales()
+    grupo = nombre_grupo(puente)
+
+    async def flujo():
+        canal = await channel_layer.new_channel()
+        await channel_layer.group_add(grupo, canal)
+        try:
+            estado = await obtener_bucle(puente).estado_json()
+            yield f'event: estado_inicial\ndata: {estado}\n\n'
+            while True:
+                try:
+                    mensaje = await asyncio.wait_for(channel_layer.receive(canal), INTERVALO_LATIDO)
+                except asyncio.TimeoutError:
+                    yield ': latido\n\n'
+                    continue
+                yield f"id: {mensaje['seq']}\nevent: {mensaje['type']}\ndata: {mensaje['texto']}\n\n"
+        finally:
+            await channel_layer.group_discard(grupo, canal)
+
+    respuesta = StreamingHttpResponse(flujo(), content_type='text/event-stream')
+    respuesta['Cache-Control'] = 'no-cache'
+    respuesta['X-Accel-Buffering'] = 'no'  # sin buffer en un proxy nginx
+    return respuesta
+
+async def esperar_cambio(request):
+    """Long-poll: responde con el estado completo en cuanto su versión es
+    distinta de ?version=, o con 204 si pasan ?timeout= segundos sin cambios.
+
+    Distinta y no solo mayor: tras un reinicio con EstadoMemoria la versión
+    vuelve a empezar y un cliente con una más alta debe recibir el estado nuevo."""
+    try:
+        version = int(request.GET.get('version', -1))
+        timeout = float(request.GET.get('timeout', 25))
+        # min() con nan devuelve nan, y un negativo vencería antes de esperar
+        if not math.isfinite(timeout) or timeout < 0:
+            raise ValueError
+    except ValueError:
+        return JsonResponse({
+            'success': False,
+            'error': 'version debe ser un entero y timeout un número de segundos no negativo'
+        }, status=400)
+    timeout = min(timeout, ESPERA_MAXIMA)
+    puente, error = _leer_puente(request)
+    if error:
+        return error
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return _sin_capa_de_canales()
+
+    bucle = obtener_bucle(puente)
+    grupo = nombre_grupo(puente)
+    canal = await channel_layer.new_channel()
+    # Suscribirse antes de leer la versión: un cambio entre ambos pasos no se pierde
+    await channel_layer.group_add(grupo, canal)
+    try:
+        if await bucle.ejecutar('obtener_version') == version:
+            limite = time.monotonic() + timeout
+            while True:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    return HttpResponse(status=204)
+                try:
+                    mensaje = await asyncio.wait_for(channel_layer.receive(canal), restante)
+                except asyncio.TimeoutError:
+                    return HttpResponse(status=204)
+                if mensaje['seq'] != version:
+                    break
+        estado = await bucle.estado_json()
+    finally:
+        await channel_layer.group_discard(grupo, canal)
+    return HttpResponse(estado, content_type='application/json')
 
 def dashboard(request):
-    return render(request, 'dashboard.html')
\ No newline at end of file
+    return render(request, 'dashboard.html')
+
+def exportar_metricas(request):
+    """Métricas de este proceso en el formato de texto de Prometheus"""
+    return HttpResponse(metricas.exportar(), content_type='text/plain; version=0.0.4; charset=utf-8')
\ No newline at end of file
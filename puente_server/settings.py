@@ -70,6 +70,106 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Codificador JSON de los mensajes del puente: 'json' (biblioteca estándar) u
+# 'orjson' (más rápido; si no está instalado se usa 'json')
+PUENTE_JSON_BACKEND = 'json'
+
+# Máximo de envíos por segundo al grupo del puente; los deltas intermedios se
+# agrupan en un solo mensaje 'lote'. 0 envía cada delta apenas ocurre.
+PUENTE_BROADCAST_HZ = 20
+
+# Tope de la cola de salida de cada WebSocket, contando lo enviado que el
+# cliente todavía no confirmó con 'confirmar' (app.js lo hace). Un cliente que
+# acumula más se desconecta con el código 4302 y al reconectar recibe el estado
+# completo; los resúmenes pendientes se reemplazan por el más nuevo. daphne no
+# frena los envíos, así que con un cliente que no confirma el tope no lo limita.
+PUENTE_SALIDA_MAX_MENSAJES = 1000
+PUENTE_SALIDA_MAX_BYTES = 4 * 1024 * 1024
+
+# Conexiones WebSocket atendidas por segundo en cada proceso (0: sin límite).
+# En una tormenta de reconexiones las demás esperan su turno en el handshake.
+PUENTE_CONEXIONES_POR_SEGUNDO = 1000
+
+# Dónde vive el estado del puente del WebSocket. EstadoMemoria sirve para un
+# solo proceso; con varios workers ASGI usar EstadoSQLite, que comparte entre
+# ellos un log de comandos en un archivo SQLite en modo WAL. Cada worker
+# difunde todos los cambios a sus propios sockets, así que la capa en memoria
+# sigue alcanzando. Cada instantanea_cada comandos (10000) guarda el estado
+# completo y recorta el log:
+# PUENTE_ESTADO = {
+#     'BACKEND': 'puente_app.backends.EstadoSQLite',
+#     'OPTIONS': {'ruta': BASE_DIR / 'puente_estado.sqlite3'},
+# }
+# Con un solo proceso, EstadoPersistente conserva el estado entre reinicios:
+# log de comandos escrito en lotes desde un hilo (fsync cada intervalo_escritura
+# segundos) e instantáneas cada instantanea_cada comandos.
+# PUENTE_ESTADO = {
+#     'BACKEND': 'puente_app.backends.EstadoPersistente',
+#     'OPTIONS': {'directorio': BASE_DIR / 'puente_estado'},
+# }
+PUENTE_ESTADO = {
+    'BACKEND': 'puente_app.backends.EstadoMemoria',
+}
+
+# Con PUENTE_CRUCE_AUTOMATICO el servidor termina cada cruce al cumplirse su
+# tiempo_cruce (LONGITUD_PUENTE / velocidad) multiplicado por ESCALA y da el
+# puente al siguiente auto sin esperar a los clientes; ESCALA < 1 acelera la
+# simulación. Un finalizar_cruce del cliente sigue terminando el cruce antes.
+# Sin él (None) cada cruce dura hasta que el cliente envía finalizar_cruce.
+# PUENTE_CRUCE_AUTOMATICO = {'ESCALA': 1.0}
+PUENTE_CRUCE_AUTOMATICO = None
+
+# Varios puentes: cada uno en ws/puente_app/<puente>/ con su propio estado y
+# grupo (ws/puente_app/ es el puente 'principal'). PUENTES_PERMITIDOS lista
+# los ids aceptados (desde el entorno: PUENTES_PERMITIDOS=principal,norte).
+# Cada puente abierto conserva su bucle, su hilo de backend y sus archivos
+# hasta que termina el proceso: None acepta cualquier id y con él cualquier
+# cliente puede abrir puentes sin límite, así que solo sirve en una red de confianza.
+PUENTES_PERMITIDOS = os.environ.get('PUENTES_PERMITIDOS', 'principal').split(',')
+# Reparto de puentes entre workers por hashing consistente. Cada worker se
+# lanza con PUENTE_WORKER=<nombre>; a un cliente que llega al worker
+# equivocado se le indica a qué servidor reconectarse. Vacío: cada worker
+# atiende todos los puentes.
+# PUENTE_WORKERS = {
+#     'w1': 'ws://127.0.0.1:8001',
+#     'w2': 'ws://127.0.0.1:8002',
+# }
+PUENTE_WORKERS = {}
+PUENTE_WORKER = os.environ.get('PUENTE_WORKER')
+
+# Política que decide qué auto entra al puente (puente_app/planificador.py).
+# Con capacidad > 1 cruzan a la vez varios autos del mismo sentido; con
+# envejecimiento = k un auto gana un nivel de prioridad cada k cruces que espera.
+# PUENTE_PLANIFICADOR = {
+#     'BACKEND': 'puente_app.planificador.LotesAlternados',
+#     'OPTIONS': {'lote': 5, 'capacidad': 3, 'envejecimiento': 10},
+# }
+PUENTE_PLANIFICADOR = {
+    'BACKEND': 'puente_app.planificador.PrioridadEstricta',
+}
+
+# Registro de puente_app. INFO queda para lo que pasa pocas veces (arranque,
+# recuperación); cada auto registrado, cada cruce y cada mensaje recibido van
+# en DEBUG, fuera del camino caliente. Con el nivel desactivado los mensajes
+# no se formatean. Las métricas se sirven en /metrics.
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'simple': {'format': '%(asctime)s %(levelname)s %(name)s %(message)s'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'simple'},
+    },
+    'loggers': {
+        'puente_app': {
+            'handlers': ['console'],
+            'level': os.environ.get('PUENTE_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
@@ -77,6 +177,18 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # WAL: las lecturas no esperan a la escritura en curso
+            'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL',
+            # Cada transacción toma el lock de escritura al empezar: dos workers
+            # registrando a la vez se esperan en vez de fallar al promover el lock
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,  # segundos de espera por el lock antes de "database is locked"
+        },
+        # Las pruebas usan un archivo y no la base en memoria compartida, que
+        # falla con "table is locked" sin esperar el timeout: así los registros
+        # concurrentes se prueban con los mismos locks que en producción
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
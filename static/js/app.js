@@ -6,11 +6,17 @@ let timeoutsFinalizar = new Map();
 let autosEsperandoTurno = new Set();
 let timeoutsSimulacion = new Map();
 let intervalosSimulacion = new Map();
+let cruceAutomatico = false;  // el servidor admite los autos y termina los cruces
+const estadoPuente = new EstadoPuente(() => {
+    if (socket && socket.readyState === WebSocket.OPEN) {
+        socket.send(JSON.stringify({ type: 'estado_inicial' }));
+    }
+});
+const confirmador = new Confirmador(() => socket);
 
 // Conectar WebSocket
 function conectarWebSocket() {
-    const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-    const wsUrl = `${protocol}//${window.location.host}/ws/puente_app/`;
+    const wsUrl = urlWebSocketPuente();
 
     console.log('Intentando conectar a:', wsUrl);
     
@@ -26,6 +32,7 @@ function conectarWebSocket() {
             try {
                 const data = JSON.parse(e.data);
                 console.log('Mensaje recibido:', data);
+                confirmador.recibido(data);
                 manejarMensaje(data);
             } catch (error) {
                 console.error('Error al parsear mensaje:', error);
@@ -35,6 +42,10 @@ function conectarWebSocket() {
 
         socket.onclose = (event) => {
             console.log('WebSocket cerrado:', event.code, event.reason);
+            if (event.code === CIERRE_REDIRIGIR || event.code === CIERRE_ATRASADO) {
+                setTimeout(conectarWebSocket, 0);  // otro worker, o resincronizar
+                return;
+            }
             agregarLog(`Conexión cerrada (código: ${event.code})`, 'error');
             setTimeout(conectarWebSocket, 5000); // reconectar
         };
@@ -87,13 +98,29 @@ function manejarMensaje(data) {
     console.log('Manejando mensaje:', data.type);
     
     try {
+        // Varios deltas acumulados entre dos envíos del servidor
+        if (data.type === 'lote') {
+            data.eventos.forEach(manejarMensaje);
+            return;
+        }
+
+        // Los eventos del grupo son deltas numerados sobre el estado local
+        if (data.seq !== undefined && estadoPuente.aplicarDelta(data)) {
+            actualizarEstadoInicial(estadoPuente.estado);
+        }
+
         switch (data.type) {
             case 'estado_inicial':
-                actualizarEstadoInicial(data.data);
+                cruceAutomatico = Boolean(data.cruce_automatico);
+                estadoPuente.aplicarSnapshot(data.data);
+                actualizarEstadoInicial(estadoPuente.estado);
                 break;
             case 'auto_registrado':
                 autoRegistrado(data.auto);
                 break;
+            case 'autos_registrados':
+                data.autos.forEach(autoRegistrado);
+                break;
             case 'auto_cruzando':
                 autoCruzando(data.auto);
                 break;
@@ -110,8 +137,12 @@ function manejarMensaje(data) {
                 limpiarInterfazSistema();
                 agregarLog('🔄 Sistema reseteado', 'info');
                 break;
-            case 'estado_actualizado':
-                actualizarEstadoInicial(data.estado);
+            case 'redirigir':
+                servidorPuente = data.servidor;
+                agregarLog(`El puente ${data.puente} está en ${data.servidor}, reconectando`, 'info');
+                break;
+            case 'resincronizar':
+                agregarLog(data.message, 'warning');
                 break;
             case 'error':
                 agregarLog(`Error: ${data.message}`, 'error');
@@ -127,7 +158,7 @@ function manejarMensaje(data) {
 }
 
 function actualizarEstadoInicial(estado) {
-    actualizarListaAutos('autosEsperandoList', estado.autos_esperando);
+    actualizarListaAutos('autosEsperandoList', estado.autos_esperando, estado.esperas);
     document.getElementById('totalAutos').textContent = estado.total_autos;
 
     const puenteStatus = document.getElementById('puenteStatus');
@@ -146,7 +177,7 @@ function actualizarEstadoInicial(estado) {
     }
 }
 
-function actualizarListaAutos(elementId, autos) {
+function actualizarListaAutos(elementId, autos, esperas = []) {
     const tbody = document.getElementById('autosEsperandoTablaBody');
     if (!tbody) return;
 
@@ -158,7 +189,8 @@ function actualizarListaAutos(elementId, autos) {
     tbody.innerHTML = '';
     autos.forEach((auto, index) => {
         const tr = document.createElement('tr');
-        const ordenTexto = index === 0 ? '🟢 PRÓXIMO' : `#${index + 1}`;
+        const ordenTexto = (index === 0 ? '🟢 PRÓXIMO' : `#${index + 1}`) +
+            (esperas[index] !== undefined ? ` (~${Math.round(esperas[index])} s)` : '');
         tr.innerHTML = `
             <td>${auto.nombre}</td>
             <td>${getPrioridadTexto(auto.prioridad)}</td>
@@ -224,6 +256,7 @@ function iniciarSimulacionAuto(auto) {
         clearInterval(intervalosSimulacion.get(auto.id));
         intervalosSimulacion.delete(auto.id);
     }
+    if (cruceAutomatico) return;  // el servidor le da el puente cuando le toca
 
     const intentarCruce = () => {
         if (autosRegistrados.has(auto.id) && !autosFinalizados.has(auto.id)) {
@@ -261,12 +294,14 @@ function manejarRespuestaCruce(respuesta) {
             const auto = autosRegistrados.get(respuesta.auto_id);
             const nombre = `#${auto.id} (${auto.nombre})`;
             const prioridadTexto = getPrioridadTexto(auto.prioridad);
+            const etaTexto = respuesta.espera_estimada !== undefined
+                ? ` (posición ${respuesta.posicion + 1}, ~${Math.round(respuesta.espera_estimada)} s)` : '';
 
             if (!autosEsperandoTurno.has(respuesta.auto_id)) {
                 if (respuesta.mensaje.includes('Puente ocupado')) {
-                    agregarLog(`⏳ ${nombre} - ${prioridadTexto} esperando - puente ocupado`, 'warning');
+                    agregarLog(`⏳ ${nombre} - ${prioridadTexto} esperando - puente ocupado${etaTexto}`, 'warning');
                 } else {
-                    agregarLog(`⏳ ${nombre} - ${prioridadTexto} está esperando su turno`, 'warning');
+                    agregarLog(`⏳ ${nombre} - ${prioridadTexto} está esperando su turno${etaTexto}`, 'warning');
                 }
                 autosEsperandoTurno.add(respuesta.auto_id);
             }
@@ -280,6 +315,11 @@ function autoCruzando(auto) {
     const vueltasTexto = auto.vueltas_totales > 1 ? ` (vuelta ${vueltaActual}/${auto.vueltas_totales})` : '';
 
     agregarLog(`🚗 ${auto.nombre} cruzando ${direccionTexto}${vueltasTexto}`, 'info');
+    autosEsperandoTurno.delete(auto.id);
+    if (intervalosSimulacion.has(auto.id)) {
+        clearInterval(intervalosSimulacion.get(auto.id));
+        intervalosSimulacion.delete(auto.id);
+    }
 
     const puenteStatus = document.getElementById('puenteStatus');
     const puenteVisual = document.getElementById('puenteVisual');
@@ -290,6 +330,8 @@ function autoCruzando(auto) {
         estadoPuente.textContent = `Ocupado por: ${auto.nombre}`;
     }
 
+    if (cruceAutomatico) return;  // el servidor termina el cruce
+
     const longitudPuente = 0.5;
     const tiempoCruce = (longitudPuente / auto.velocidad) * 3600 * 1000;
 
@@ -4,10 +4,15 @@ let autosEsperandoNorte = [];
 let autosEsperandoSur = [];
 let simulacionIniciada = false;
 let autosSimulando = new Set();
+const estadoPuente = new EstadoPuente(() => {
+    if (socket && socket.readyState === WebSocket.OPEN) {
+        socket.send(JSON.stringify({ type: 'estado_inicial' }));
+    }
+});
+const confirmador = new Confirmador(() => socket);
 
 function conectarWebSocketDashboard() {
-    const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-    const wsUrl = `${protocol}//${window.location.host}/ws/puente_app/`;
+    const wsUrl = urlWebSocketPuente();
     
     console.log('Dashboard: Conectando a WebSocket:', wsUrl);
     
@@ -21,6 +26,7 @@ function conectarWebSocketDashboard() {
             try {
                 const data = JSON.parse(e.data);
                 console.log('Dashboard: Mensaje recibido:', data.type);
+                confirmador.recibido(data);
                 manejarMensajeDashboard(data);
             } catch (error) {
                 console.error('Dashboard: Error al parsear mensaje:', error);
@@ -28,6 +34,10 @@ function conectarWebSocketDashboard() {
         };
         socket.onclose = function(event) {
             console.log('Dashboard: WebSocket cerrado:', event.code);
+            if (event.code === CIERRE_REDIRIGIR || event.code === CIERRE_ATRASADO) {
+                setTimeout(conectarWebSocketDashboard, 0);  // otro worker, o resincronizar
+                return;
+            }
             actualizarDashboardEstado('Desconectado');
             setTimeout(conectarWebSocketDashboard, 5000);
         };
@@ -43,14 +53,28 @@ function conectarWebSocketDashboard() {
 
 function manejarMensajeDashboard(data) {
     try {
+        // Varios deltas acumulados entre dos envíos del servidor
+        if (data.type === 'lote') {
+            data.eventos.forEach(manejarMensajeDashboard);
+            return;
+        }
+
+        // Los eventos del grupo son deltas numerados sobre el estado local
+        if (data.seq !== undefined && estadoPuente.aplicarDelta(data)) {
+            renderizarDashboard(estadoPuente.estado);
+        }
+
         switch (data.type) {
             case 'estado_inicial':
-            case 'estado_actualizado':
-                renderizarDashboard(data.data || data.estado);
+                estadoPuente.aplicarSnapshot(data.data);
+                renderizarDashboard(estadoPuente.estado);
                 break;
             case 'auto_registrado':
                 console.log('Dashboard: Auto registrado:', data.auto.nombre);
                 break;
+            case 'autos_registrados':
+                console.log('Dashboard: Autos registrados en lote:', data.autos.length);
+                break;
             case 'auto_cruzando':
                 console.log('Dashboard: Auto cruzando:', data.auto.nombre);
                 break;
@@ -69,6 +93,12 @@ function manejarMensajeDashboard(data) {
                 document.getElementById('dashboardTotal').textContent = 'Total de Autos: 0';
                 document.getElementById('dashboardEstado').textContent = 'Estado: Libre';
                 break;
+            case 'redirigir':
+                servidorPuente = data.servidor;
+                break;
+            case 'resincronizar':
+                console.warn('Dashboard:', data.message);
+                break;
             case 'error':
                 console.error('Dashboard: Error del servidor:', data.message);
                 break;
@@ -0,0 +1,128 @@
+// Puente elegido con ?puente=<id> en la URL de la página (sin él, el principal).
+// Si el servidor responde 'redirigir', el puente lo atiende otro worker y las
+// reconexiones van a ese servidor.
+const CIERRE_REDIRIGIR = 4301;
+// Cerrado por no leer los cambios a tiempo: al reconectar llega el estado completo
+const CIERRE_ATRASADO = 4302;
+let servidorPuente = null;
+
+function urlWebSocketPuente() {
+    const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+    const base = servidorPuente || `${protocol}//${window.location.host}`;
+    const puente = new URLSearchParams(window.location.search).get('puente');
+    return puente ? `${base}/ws/puente_app/${encodeURIComponent(puente)}/` : `${base}/ws/puente_app/`;
+}
+
+// Confirma al servidor el último seq recibido, como mucho cada
+// INTERVALO_CONFIRMACION ms o cada MENSAJES_POR_CONFIRMACION mensajes. El
+// servidor no sabe cuánto de lo enviado sigue sin leer; con esto cierra con
+// CIERRE_ATRASADO al cliente que se queda atrás en lugar de acumularlo.
+const INTERVALO_CONFIRMACION = 250;
+const MENSAJES_POR_CONFIRMACION = 100;
+
+class Confirmador {
+    constructor(obtenerSocket) {
+        this.obtenerSocket = obtenerSocket;
+        this.seq = null;
+        this.sinConfirmar = 0;
+        this.temporizador = null;
+    }
+
+    recibido(data) {
+        const seq = data.type === 'lote' ? data.eventos[data.eventos.length - 1].seq : data.seq;
+        if (seq === undefined) return;
+        this.seq = seq;
+        if (++this.sinConfirmar >= MENSAJES_POR_CONFIRMACION) {
+            this.enviar();
+        } else if (this.temporizador === null) {
+            this.temporizador = setTimeout(() => this.enviar(), INTERVALO_CONFIRMACION);
+        }
+    }
+
+    enviar() {
+        clearTimeout(this.temporizador);
+        this.temporizador = null;
+        this.sinConfirmar = 0;
+        const socket = this.obtenerSocket();
+        if (socket && socket.readyState === WebSocket.OPEN) {
+            socket.send(JSON.stringify({ type: 'confirmar', seq: this.seq }));
+        }
+    }
+}
+
+// Copia local del estado del puente, mantenida con el flujo de deltas del servidor.
+// Cada delta trae un número de secuencia (seq); si falta alguno se pide un
+// snapshot completo con 'estado_inicial' y se ignoran los deltas hasta recibirlo.
+class EstadoPuente {
+    constructor(pedirSnapshot) {
+        this.pedirSnapshot = pedirSnapshot;
+        this.version = null;
+        this.autosEsperando = [];
+        this.autosEnPuente = [];
+        this.resincronizando = false;
+    }
+
+    aplicarSnapshot(estado) {
+        this.version = estado.version;
+        this.autosEsperando = estado.autos_esperando || [];
+        this.autosEnPuente = estado.autos_en_puente || [];
+        this.resincronizando = false;
+    }
+
+    // Devuelve true si el delta modificó el estado local
+    aplicarDelta(delta) {
+        if (this.version === null || this.resincronizando) return false;
+        if (delta.seq <= this.version) return false;  // ya incluido en el snapshot
+        if (delta.seq !== this.version + 1) {
+            console.warn(`Hueco en la secuencia (${this.version} → ${delta.seq}), resincronizando`);
+            this.resincronizando = true;
+            this.pedirSnapshot();
+            return false;
+        }
+        this.version = delta.seq;
+
+        if (delta.op === 'reset') {
+            this.autosEsperando = [];
+            this.autosEnPuente = [];
+            return true;
+        }
+
+        if (delta.autos) {
+            // Registro en lote: ordenados por posición final
+            delta.autos.forEach((auto, i) => this.autosEsperando.splice(delta.posiciones[i], 0, auto));
+            return true;
+        }
+
+        const id = delta.auto.id;
+        this.autosEsperando = this.autosEsperando.filter(a => a.id !== id);
+        this.autosEnPuente = this.autosEnPuente.filter(a => a.id !== id);
+        if (delta.destino === 'cola') {
+            this.autosEsperando.splice(delta.posicion, 0, delta.auto);
+        } else if (delta.destino === 'puente') {
+            this.autosEnPuente.push(delta.auto);
+        }
+        return true;
+    }
+
+    // Espera estimada de cada auto de la cola (segundos): el cruce en curso
+    // más largo completo más los tiempos de cruce de los autos delante, como
+    // el servidor
+    get esperas() {
+        let acumulado = this.autosEnPuente.reduce((maximo, auto) => Math.max(maximo, auto.tiempo_cruce || 0), 0);
+        return this.autosEsperando.map(auto => {
+            const espera = acumulado;
+            acumulado += auto.tiempo_cruce || 0;
+            return espera;
+        });
+    }
+
+    get estado() {
+        return {
+            version: this.version,
+            autos_en_puente: this.autosEnPuente,
+            autos_esperando: this.autosEsperando,
+            esperas: this.esperas,
+            total_autos: this.autosEsperando.length + this.autosEnPuente.length
+        };
+    }
+}